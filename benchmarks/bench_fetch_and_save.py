@@ -0,0 +1,80 @@
+"""
+Compare the throughput (MB/s) of `fetch_and_save` against the original
+1 KB-chunk, write-on-the-loop implementation.
+
+    python -m benchmarks.bench_fetch_and_save --size-mb 64 --files 8
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import aiohttp
+from aiohttp import web
+from http_lassie.direct_util import fetch_and_save
+
+
+async def legacy_fetch_and_save(session, url, output_path, chunk_size=1024):
+    bytes_read = 0
+    async with session.get(url) as response:
+        with open(output_path, "wb") as fp:
+            async for data in response.content.iter_chunked(chunk_size):
+                fp.write(data)
+                bytes_read += len(data)
+    return url, output_path, bytes_read
+
+
+async def serve(body):
+    async def handler(request):
+        return web.Response(body=body)
+
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, 'http://127.0.0.1:{}'.format(port)
+
+
+async def run(fetch, base, directory, n_files, **kwargs):
+    async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            fetch(session, '{}/{}'.format(base, i),
+                  os.path.join(directory, str(i)), **kwargs)
+            for i in range(n_files)])
+        elapsed = time.perf_counter() - start
+    return sum(r[2] for r in results), elapsed
+
+
+async def main(size_mb, n_files, repeat):
+    runner, base = await serve(os.urandom(size_mb << 20))
+    directory = tempfile.mkdtemp()
+    variants = [('legacy (1 KB, on-loop)', legacy_fetch_and_save, {}),
+                ('adaptive (off-loop)', fetch_and_save,
+                 {'timeout': 600, 'conditional': False})]
+
+    try:
+        for name, fetch, kwargs in variants:
+            best = None
+            for _ in range(repeat):
+                n_bytes, elapsed = await run(fetch, base, directory,
+                                             n_files, **kwargs)
+                mb_s = n_bytes / elapsed / (1 << 20)
+                best = mb_s if best is None else max(best, mb_s)
+            print("{:<24} {:>10.1f} MB/s".format(name, best))
+    finally:
+        shutil.rmtree(directory)
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--size-mb', type=int, default=32)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.size_mb, args.files, args.repeat))
@@ -0,0 +1,59 @@
+"""
+Compare the stochastic acceptance user agent sampler against the alias
+method sampler (one at a time, and in batches).
+
+    python -m benchmarks.bench_user_agents --draws 100000
+"""
+import argparse
+import random
+import time
+from http_lassie import user_agents
+from http_lassie.user_agents import random_user_agent, random_user_agents
+
+
+def stochastic_acceptance(agents, max_proportion):
+    n = len(agents)
+    while True:
+        i = int(n * random.random())
+        proportion = agents[i][0]
+        if random.random() < proportion / max_proportion:
+            return agents[i][1]
+
+
+def timed(func, n_draws, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(n_draws)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(n_draws, repeat):
+    start = time.perf_counter()
+    agents = user_agents.USER_AGENTS
+    max_proportion = user_agents.MAX_PROPORTION
+    print("{:<28} {:>10.2f} ms".format(
+        "load (first use)", (time.perf_counter() - start) * 1e3))
+
+    variants = [
+        ('stochastic acceptance', lambda n: [
+            stochastic_acceptance(agents, max_proportion) for _ in range(n)]),
+        ('alias', lambda n: [random_user_agent() for _ in range(n)]),
+        ('alias (batch{})'.format(
+            ', numpy' if user_agents.numpy_or_none() else ''),
+         random_user_agents)]
+
+    for name, func in variants:
+        elapsed = timed(func, n_draws, repeat)
+        print("{:<28} {:>10.1f} ns/draw".format(name,
+                                               elapsed / n_draws * 1e9))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--draws', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    main(args.draws, args.repeat)
@@ -0,0 +1,288 @@
+"""
+Measure throughput (requests/s), latency (p50/p99), CPU and memory of
+`SmartFetcher` (driven by a `WorkerPool`, and by `fetch_many`) and of
+`direct_util`'s `stream_download_all` (over HTTP/1.1 with aiohttp, and
+over HTTP/2 with an `AsyncHTTP2Session` if httpx[http2] is installed), at
+increasing concurrency, against the local stand-ins in
+`benchmarks.standins`.
+
+Results are saved as JSON (to compare releases):
+
+    python -m benchmarks.harness --label v0.3 --concurrency 1,8,32
+    python -m benchmarks.harness --label v0.4 --compare \\
+        benchmarks/results/v0.3.json
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.standins import StandIn, StandInConfig
+from http_lassie.backoff import BackoffScheduler
+from http_lassie.direct_util import DownloadError, stream_download_all
+from http_lassie.smart_fetcher import SmartFetcher
+from http_lassie.transport import AsyncHTTP2Session, http2_available
+from http_lassie.worker_pool import WorkerPool
+
+THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+RESULTS_DIR = os.path.join(THIS_DIR, 'results')
+
+SCENARIOS = ('smart_fetcher', 'smart_fetcher_js', 'fetch_many',
+             'fetch_and_save', 'fetch_and_save_h2')
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def current_rss_mb():
+    """
+    :return: the memory this process has resident now, in MB. (Without
+        /proc, e.g. on macOS, the peak so far, which only ever grows.)
+    """
+    try:
+        with open('/proc/self/statm') as fp:
+            pages = int(fp.read().split()[1])
+        return pages * resource.getpagesize() / float(1 << 20)
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # In bytes on macOS, KB elsewhere.
+        return peak / float(1 << 20 if sys.platform == 'darwin' else 1024)
+
+
+def bench_smart_fetcher(base, n_requests, concurrency, render_js=False):
+    # :return: a list of (latency, success) per request
+    fetcher = SmartFetcher(base, base, pool_maxsize=concurrency,
+                           max_sessions=concurrency,
+                           backoff=BackoffScheduler(base_delay=0.01),
+                           block_on_backoff=True)
+
+    def fetch(i, submit):
+        start = time.perf_counter()
+        _, ok = fetcher('{}/page/{}'.format(base, i), render_js=render_js)
+        return time.perf_counter() - start, ok
+
+    pool = WorkerPool(fetch, n_workers=concurrency)
+    for i in range(n_requests):
+        pool.submit(i)
+    pool.start()
+    try:
+        return list(pool.gather())
+    finally:
+        fetcher.close()
+
+
+def bench_fetch_many(base, n_requests, concurrency):
+    # :return: a list of (latency, success) per request
+    fetcher = SmartFetcher(base, base, pool_maxsize=concurrency,
+                           max_sessions=concurrency,
+                           backoff=BackoffScheduler(base_delay=0.01),
+                           block_on_backoff=True)
+    urls = ('{}/page/{}'.format(base, i) for i in range(n_requests))
+    try:
+        return [(result.elapsed, result.ok)
+                for result in fetcher.fetch_many(urls, concurrency)]
+    finally:
+        fetcher.close()
+
+
+def bench_fetch_and_save(base, n_requests, concurrency, http2=False):
+    # :return: a list of (latency, success) per download
+    started = {}
+
+    def pairs(directory):
+        # Pulled only as download slots free up, so a download's latency
+        # runs from here to its result.
+        for i in range(n_requests):
+            url = '{}/file/{}'.format(base, i)
+            started[url] = time.perf_counter()
+            yield url, os.path.join(directory, str(i))
+
+    async def run(directory):
+        session = None
+        if http2:  # All the downloads share one (h2c) connection
+            session = AsyncHTTP2Session(prior_knowledge=True)
+        outcomes = []
+        async for result in stream_download_all(
+                pairs(directory), session=session, concurrency=concurrency,
+                timeout=60, conditional=False):
+            ok = not isinstance(result, DownloadError)
+            url = result[0] if ok else result.url
+            outcomes.append((time.perf_counter() - started.pop(url), ok))
+        if session is not None:
+            await session.close()
+        return outcomes
+
+    with tempfile.TemporaryDirectory() as directory:
+        return asyncio.run(run(directory))
+
+
+def run_scenario(name, standin, n_requests, concurrency):
+    """
+    :return: the measurements of one scenario at one concurrency
+    """
+    base = standin.h2_url if name.endswith('_h2') else standin.url
+    gc.collect()
+    rss_start = current_rss_mb()
+    cpu_start, start = time.process_time(), time.perf_counter()
+
+    # SmartFetcher prints every failed attempt; keep the report readable.
+    with contextlib.redirect_stdout(io.StringIO()):
+        if name.startswith('fetch_and_save'):
+            outcomes = bench_fetch_and_save(base, n_requests, concurrency,
+                                            http2=name.endswith('_h2'))
+        elif name == 'fetch_many':
+            outcomes = bench_fetch_many(base, n_requests, concurrency)
+        else:
+            outcomes = bench_smart_fetcher(base, n_requests, concurrency,
+                                           render_js=name.endswith('_js'))
+
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    rss = current_rss_mb()
+    latencies = [latency for latency, _ in outcomes]
+    return {'scenario': name,
+            'concurrency': concurrency,
+            'n_requests': len(outcomes),
+            'n_ok': sum(1 for _, ok in outcomes if ok),
+            'seconds': elapsed,
+            'requests_per_s': len(outcomes) / elapsed,
+            'p50_s': percentile(latencies, 0.5),
+            'p99_s': percentile(latencies, 0.99),
+            'cpu_percent': 100 * cpu / elapsed,
+            'rss_mb': rss,
+            'rss_delta_mb': rss - rss_start}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=THIS_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def change(new, old):
+    """
+    :return: the relative change from old to new, or None if there is no
+        (nonzero) old value to compare with
+    """
+    if not old or new is None:
+        return None
+    return new / old - 1
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print each result against the baseline's.
+
+    :return: the number of regressions (throughput down, or p99 up, by
+        more than `tolerance`)
+    """
+    before = {(r['scenario'], r['concurrency']): r
+              for r in baseline['results']}
+    n_regressions = 0
+
+    print("\nvs {} ({}):".format(baseline['label'], baseline['git_commit']))
+    for result in results:
+        old = before.get((result['scenario'], result['concurrency']))
+        if old is None:
+            continue
+        rps = change(result['requests_per_s'], old['requests_per_s'])
+        p99 = change(result['p99_s'], old['p99_s'])
+        regressed = ((rps is not None and rps < -tolerance) or
+                     (p99 is not None and p99 > tolerance))
+        n_regressions += regressed
+        print("{:<18} {:>5}  req/s {:>7}  p99 {:>7}{}".format(
+            result['scenario'], result['concurrency'],
+            'n/a' if rps is None else '{:+.1%}'.format(rps),
+            'n/a' if p99 is None else '{:+.1%}'.format(p99),
+            '  REGRESSION' if regressed else ''))
+
+    return n_regressions
+
+
+def main(args):
+    config = StandInConfig(latency=args.latency,
+                           failure_rate=args.failure_rate,
+                           no_proxy_rate=args.no_proxy_rate,
+                           body_size=args.body_size)
+    results = []
+
+    print("{:<18} {:>5} {:>9} {:>8} {:>8} {:>6} {:>8} {:>8}".format(
+        'scenario', 'conc', 'req/s', 'p50 ms', 'p99 ms', 'cpu%', 'rss MB',
+        '+rss MB'))
+    with StandIn(config) as standin:
+        for name in args.scenarios.split(','):
+            if name.endswith('_h2') and (standin.h2_url is None or
+                                         not http2_available()):
+                print("{:<18} skipped (needs httpx[http2])".format(name))
+                continue
+            for concurrency in map(int, args.concurrency.split(',')):
+                result = run_scenario(name, standin, args.requests,
+                                      concurrency)
+                results.append(result)
+                print("{:<18} {:>5} {:>9.1f} {:>8.1f} {:>8.1f} {:>6.0f} "
+                      "{:>8.1f} {:>+8.1f}".format(name, concurrency,
+                                                  result['requests_per_s'],
+                                                  result['p50_s'] * 1e3,
+                                                  result['p99_s'] * 1e3,
+                                                  result['cpu_percent'],
+                                                  result['rss_mb'],
+                                                  result['rss_delta_mb']))
+
+    label = args.label or git_commit() or 'local'
+    doc = {'label': label,
+           'git_commit': git_commit(),
+           'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+           'python': sys.version.split()[0],
+           'platform': platform.platform(),
+           'standin': config.to_dict(),
+           'n_requests': args.requests,
+           'results': results}
+
+    output = args.output or os.path.join(RESULTS_DIR, label + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as fp:
+        json.dump(doc, fp, indent=2, sort_keys=True)
+    print("\nSaved to {}".format(output))
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--no-proxy-rate', type=float, default=0.0)
+    parser.add_argument('--body-size', type=int, default=16 << 10)
+    parser.add_argument('--label', help="the results name (default: the "
+                                        "git commit)")
+    parser.add_argument('--output', help="the results file (default: "
+                                         "benchmarks/results/LABEL.json)")
+    parser.add_argument('--compare', help="a results file to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="the change counted as a regression")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,266 @@
+"""
+A local stand-in for mimic, splash, the proxies and the target sites, all
+served by one aiohttp app (in its own process, so it doesn't compete with
+the code being measured). With `h2` installed, the targets are also served
+over cleartext HTTP/2 (h2c, prior knowledge) on a second port.
+
+    python -m benchmarks.standins --latency 0.05 --failure-rate 0.1
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+from aiohttp import web
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+    import h2.exceptions
+except ImportError:  # pragma: no cover
+    h2 = None
+
+
+class StandInConfig:
+    def __init__(self, latency=0.01, jitter=0.5, failure_rate=0.0,
+                 no_proxy_rate=0.0, body_size=16 << 10, render_latency=0.05,
+                 http2=True):
+        """
+        :param latency: the mean seconds the target takes to respond
+        :param jitter: the +/- fraction of random variation in latencies
+        :param failure_rate: the fraction of target responses (and of
+            splash renders) that fail
+        :param no_proxy_rate: the fraction of mimic acquires without a
+            proxy
+        :param body_size: the target's body size in bytes
+        :param render_latency: the extra seconds splash takes per render
+        :param http2: if True (and `h2` is installed), also serve the
+            targets over h2c
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.no_proxy_rate = no_proxy_rate
+        self.body_size = body_size
+        self.render_latency = render_latency
+        self.http2 = http2
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def _body(config):
+    return (b'<html>' + b'x' * max(0, config.body_size - 13) +
+            b'</html>')[:config.body_size]
+
+
+async def _pause(config, seconds):
+    if seconds > 0:
+        spread = seconds * config.jitter
+        await asyncio.sleep(random.uniform(seconds - spread,
+                                           seconds + spread))
+
+
+def make_app(config):
+    """
+    :return: an aiohttp app that is mimic (`/proxies/...`), splash
+        (`/render.html`, `/execute`), every proxy mimic hands out, and
+        every target (any other path)
+    """
+    body = _body(config)
+    n_acquired = [0]
+
+    async def acquire(request):
+        n_acquired[0] += 1
+        proxy = None
+        if random.random() >= config.no_proxy_rate:
+            proxy = 'HTTP://{}'.format(request.host)
+        return web.json_response({'proxy': proxy, 'id': n_acquired[0]})
+
+    async def release(request):
+        return web.Response(text='ok')
+
+    async def target(request):
+        await _pause(config, config.latency)
+        if random.random() < config.failure_rate:
+            return web.Response(status=503, text='unavailable')
+        return web.Response(body=body, content_type='text/html')
+
+    async def render(request):
+        await _pause(config, config.latency + config.render_latency)
+        if random.random() < config.failure_rate:
+            return web.Response(status=502, text='render failed')
+        return web.Response(body=body, content_type='text/html')
+
+    async def execute(request):
+        args = await request.json()
+        results = []
+        for url in args['urls']:
+            await _pause(config, config.latency + config.render_latency)
+            if random.random() < config.failure_rate:
+                results.append({'url': url, 'ok': False,
+                                'reason': 'render failed'})
+            else:
+                results.append({'url': url, 'ok': True, 'status': 200,
+                                'html': body.decode()})
+        return web.json_response(results)
+
+    app = web.Application()
+    app.router.add_post('/proxies/acquire', acquire)
+    app.router.add_post('/proxies/release', release)
+    app.router.add_post('/render.html', render)
+    app.router.add_post('/execute', execute)
+    app.router.add_get('/{tail:.*}', target)
+    return app
+
+
+class H2Target(asyncio.Protocol):
+    def __init__(self, config):
+        """
+        The targets (as in `make_app`) over h2c: one connection serves
+        any number of concurrent streams.
+        """
+        self._config = config
+        self._body = _body(config)
+        self._conn = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False))
+        self._transport = None
+        self._window_open = asyncio.Event()
+        self._tasks = set()
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._conn.initiate_connection()
+        self._flush()
+
+    def connection_lost(self, exc):
+        for task in self._tasks:
+            task.cancel()
+
+    def data_received(self, data):
+        try:
+            events = self._conn.receive_data(data)
+        except h2.exceptions.ProtocolError:
+            self._flush()
+            self._transport.close()
+            return
+
+        for event in events:
+            if isinstance(event, h2.events.RequestReceived):
+                task = asyncio.ensure_future(self._respond(event.stream_id))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            elif isinstance(event, h2.events.WindowUpdated):
+                self._window_open.set()
+        self._flush()
+
+    def _flush(self):
+        self._transport.write(self._conn.data_to_send())
+
+    async def _respond(self, stream_id):
+        await _pause(self._config, self._config.latency)
+        status, body = 200, self._body
+        if random.random() < self._config.failure_rate:
+            status, body = 503, b'unavailable'
+
+        try:
+            self._conn.send_headers(stream_id, [
+                (':status', str(status)),
+                ('content-length', str(len(body))),
+                ('content-type', 'text/html')])
+            while True:
+                window = min(self._conn.local_flow_control_window(stream_id),
+                             self._conn.max_outbound_frame_size)
+                if window <= 0 and body:
+                    self._window_open.clear()
+                    await self._window_open.wait()
+                    continue
+                chunk, body = body[:window], body[window:]
+                self._conn.send_data(stream_id, chunk, end_stream=not body)
+                self._flush()
+                if not body:
+                    break
+        except h2.exceptions.StreamClosedError:
+            pass
+
+
+async def _serve(config, port, ready=None, h2_port=0):
+    runner = web.AppRunner(make_app(config), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+
+    h2_server = None
+    if config.http2 and h2 is not None:
+        h2_server = await asyncio.get_running_loop().create_server(
+            lambda: H2Target(config), '127.0.0.1', h2_port)
+    if ready is not None:
+        ready.send((site._server.sockets[0].getsockname()[1],
+                    h2_server and h2_server.sockets[0].getsockname()[1]))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        if h2_server is not None:
+            h2_server.close()
+        await runner.cleanup()
+
+
+def _main(config, ready):
+    asyncio.run(_serve(config, 0, ready))
+
+
+class StandIn:
+    def __init__(self, config=None):
+        """
+        Run the stand-in servers in a child process.
+
+        :param config: a `StandInConfig`
+        """
+        self.config = config or StandInConfig()
+        self._process = None
+        self.url = None
+        self.h2_url = None
+
+    def start(self):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        context = multiprocessing.get_context('spawn')
+        self._process = context.Process(target=_main,
+                                        args=(self.config, sender),
+                                        daemon=True)
+        self._process.start()
+        port, h2_port = receiver.recv()
+        self.url = 'http://127.0.0.1:{}'.format(port)
+        if h2_port is not None:
+            # The targets over h2c (None without `h2`).
+            self.h2_url = 'http://127.0.0.1:{}'.format(h2_port)
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--no-proxy-rate', type=float, default=0.0)
+    parser.add_argument('--h2-port', type=int, default=8902)
+    parser.add_argument('--body-size', type=int, default=16 << 10)
+    args = parser.parse_args()
+    config = StandInConfig(latency=args.latency,
+                           failure_rate=args.failure_rate,
+                           no_proxy_rate=args.no_proxy_rate,
+                           body_size=args.body_size)
+    print(json.dumps(config.to_dict()))
+    asyncio.run(_serve(config, args.port, h2_port=args.h2_port))
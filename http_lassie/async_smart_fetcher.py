@@ -0,0 +1,319 @@
+import asyncio
+import json
+import sys
+import time
+import aiohttp
+from http_lassie.backoff import BackoffScheduler
+from http_lassie.coalesce import AsyncSingleFlight, flight_key
+from http_lassie.proxy_leases import lease_key, normalize_proxy
+from http_lassie.response import BufferedResponse
+from http_lassie.smart_fetcher import (DEFAULT_SPLASH_CONFIG,
+                                       FailingStatusCode, always_true,
+                                       content_extractor, format_exception)
+from http_lassie.user_agents import random_user_agent
+from six.moves.urllib.parse import urlencode
+
+###############################################################################
+#                    __                   __                _                 #
+#                   / /  _____      __   / /  _____   _____| |                #
+#                  / /  / _ \ \ /\ / /  / /  / _ \ \ / / _ \ |                #
+#                 / /__| (_) \ V  V /  / /__|  __/\ V /  __/ |                #
+#                 \____/\___/ \_/\_/   \____/\___| \_/ \___|_|                #
+#                                                                             #
+###############################################################################
+
+
+async def get_proxy_async(session, mimic_server, request_url, requirements,
+                          max_wait_time=60):
+    """
+    Get a proxy from your mimic (proxy broker) server without blocking.
+
+    :param session: the `aiohttp.ClientSession` to issue the request on
+    :param mimic_server: a URL like `http://192.168.99.100:8901`
+    :param request_url: the URL you want to request (needed because mimic
+        throttles by domain)
+    :param requirements: the requirements for the proxy (e.g. anonymous)
+    :param max_wait_time: the maximum time you are willing to wait for a
+        response before a timeout
+    :return: a proxy resource
+    """
+    params = {'url': request_url, 'max_wait_time': str(max_wait_time)}
+    if requirements:
+        params['requirements'] = ",".join(requirements)
+
+    async with session.post(mimic_server + "/proxies/acquire",
+                            data=params) as resp:
+        content = await resp.read()
+        assert resp.status == 200, content
+        return json.loads(content.decode())
+
+
+async def release_proxy_async(session, mimic_server, proxy_resource,
+                              resp_time=None, is_failure=False):
+    """
+    Release this proxy for use again on mimic without blocking.
+
+    :param session: the `aiohttp.ClientSession` to issue the request on
+    :param mimic_server: a URL like `http://192.168.99.100:8901`
+    :param proxy_resource: the used proxy resource (returned from
+        `get_proxy_async`)
+    :param resp_time: the total time it took for this response, or None
+        if nothing was timed
+    :param is_failure: True if the content returned by this proxy was invalid
+    """
+    params = {k: str(v) for k, v in proxy_resource.items() if v is not None}
+
+    if is_failure:
+        params['is_failure'] = 'true'
+
+    if resp_time is not None and resp_time >= 0:
+        params['response_time'] = str(resp_time)
+
+    async with session.post(mimic_server + "/proxies/release",
+                            data=params) as resp:
+        content = await resp.read()
+        assert resp.status == 200, content
+
+
+###############################################################################
+#                        _       _         __                _                #
+#                  /\  /(_) __ _| |__     / /  _____   _____| |               #
+#                 / /_/ / |/ _` | '_ \   / /  / _ \ \ / / _ \ |               #
+#                / __  /| | (_| | | | | / /__|  __/\ V /  __/ |               #
+#                \/ /_/ |_|\__, |_| |_| \____/\___| \_/ \___|_|               #
+#                          |___/                                              #
+###############################################################################
+
+
+class AsyncSmartFetcher:
+    def __init__(self, mimic_server, splash_server, proxy_requirements=None,
+                 splash_config=None, max_wait_time=60, session=None,
+                 connection_limit=1000, connection_limit_per_host=0,
+                 backoff=None, coalesce=False):
+        """
+        An asyncio version of `SmartFetcher`.
+
+        Proxy acquisition, target fetches and splash rendering all share a
+        single pooled `aiohttp.ClientSession`, so one event loop can keep
+        thousands of fetches in flight.
+
+        :param mimic_server: the url to your mimic (proxy broker) server
+        :param splash_server: the url to your SPLASH server. Can be None
+            if you do not use javascript rendering.
+        :param proxy_requirements: the requirements for your proxy request
+            to mimic
+        :param splash_config: the configuration (parameters) used for
+            fulfilling splash (JS-rendering) requests
+        :param max_wait_time: the max time to wait before a timeout
+        :param session: an existing `aiohttp.ClientSession`. If None, one
+            is created (lazily, inside the running loop) and owned by
+            this fetcher.
+        :param connection_limit: the total number of pooled connections
+            when this fetcher creates its own session (0 is unlimited)
+        :param connection_limit_per_host: the number of pooled connections
+            per (host, port) when this fetcher creates its own session
+            (0 is unlimited)
+        :param backoff: the `BackoffScheduler` that tracks which domains
+            mimic has run out of proxies for. If None, a default one.
+            Cooldowns are awaited, which only parks this coroutine.
+        :param coalesce: if True, concurrent identical calls (same request,
+            extractor and validator) share one fetch and its result
+        """
+        self._mimic_server = mimic_server
+        self._splash_server = splash_server
+        self._proxy_requirements = proxy_requirements or []
+        self._splash_config = splash_config or DEFAULT_SPLASH_CONFIG.copy()
+        self._max_wait_time = max_wait_time
+        self._backoff = backoff or BackoffScheduler()
+        self._flights = AsyncSingleFlight() if coalesce else None
+        self._session = session
+        self._owns_session = session is None
+        self._connection_limit = connection_limit
+        self._connection_limit_per_host = connection_limit_per_host
+
+    @property
+    def session(self):
+        """
+        The shared `aiohttp.ClientSession` (created on first use).
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._connection_limit,
+                limit_per_host=self._connection_limit_per_host)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        """
+        Close the session if this fetcher created it.
+        """
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def __call__(self,
+                       request_url,
+                       request_params=None,
+                       request_data=None,
+                       http_method='GET',
+                       extractor=content_extractor,
+                       validator=always_true,
+                       render_js=False,
+                       splash_overrides=None,
+                       header_overrides=None,
+                       retries=3):
+        """
+        Same arguments and semantics as `SmartFetcher.__call__`.
+
+        The extractor and validator are ordinary (synchronous) functions
+        that receive a `BufferedResponse`.
+
+        :return: a tuple of (content, success)
+        """
+        args = (request_url, request_params, request_data, http_method,
+                extractor, validator, render_js, splash_overrides,
+                header_overrides, retries)
+
+        if self._flights is None:
+            return await self._fetch(*args)
+
+        key = flight_key(http_method, request_url, request_params,
+                         request_data, render_js, extractor, validator,
+                         header_overrides, splash_overrides)
+        return await self._flights.do(key, lambda: self._fetch(*args))
+
+    async def _fetch(self, request_url, request_params, request_data,
+                     http_method, extractor, validator, render_js,
+                     splash_overrides, header_overrides, retries):
+        content, resp_time, is_failure = None, 60, True
+
+        while is_failure and retries > 0:
+            proxy_resource, is_final = None, False
+
+            try:
+                proxy_resource = await self._get_proxy_resource(
+                    request_url, render_js)
+                headers = self._common_headers(header_overrides)
+
+                f = self._via_splash if render_js else self._via_requests
+                start_time, resp = await f(headers,
+                                           http_method,
+                                           request_url,
+                                           request_params,
+                                           request_data,
+                                           proxy_resource,
+                                           **(splash_overrides or {}))
+
+                resp_time = time.time() - start_time
+                content = extractor(resp)
+
+                if resp.status_code == 404 or resp.status_code == 500:
+                    is_failure, is_final = True, True
+                else:
+                    if resp.status_code != 200:
+                        raise FailingStatusCode(resp.status_code,
+                                                resp.content,
+                                                indent=' '*18)
+                    is_failure = not validator(content)
+                    if is_failure:
+                        retries -= 1
+            except Exception:
+                is_failure = True
+                retries -= 1
+                print(format_exception(request_url,
+                                       retries,
+                                       sys.exc_info()) + "\n\n")
+            finally:
+                if proxy_resource is not None:
+                    # A 404/500 is the target's fault, not the proxy's.
+                    await release_proxy_async(self.session,
+                                              self._mimic_server,
+                                              proxy_resource,
+                                              resp_time,
+                                              is_failure and not is_final)
+
+            if is_final:
+                break
+
+        return content, not is_failure
+
+    async def _get_proxy_resource(self, request_url, render_js):
+        key = lease_key(request_url, self._proxy_requirements, render_js)
+        wait = self._backoff.delay(key)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        resource = await get_proxy_async(self.session,
+                                         self._mimic_server,
+                                         request_url,
+                                         self._proxy_requirements,
+                                         max_wait_time=self._max_wait_time)
+
+        if resource['proxy'] is None:
+            self._backoff.failure(key)
+            raise Exception('No proxy found')
+
+        self._backoff.success(key)
+        return resource
+
+    def _common_headers(self, header_overrides):
+        headers = {'User-Agent': random_user_agent()}
+        if header_overrides:
+            headers.update(header_overrides)
+        return headers
+
+    async def _via_splash(self, headers, http_method, request_url,
+                          request_params, request_data, proxy_resource,
+                          **splash_overrides):
+        kwargs = {**self._splash_config,
+                  **(splash_overrides or {})}
+        kwargs.update({'proxy': normalize_proxy(proxy_resource['proxy']),
+                       'http_method': http_method,
+                       'filters': "nofonts,easylist"})
+
+        if request_params:
+            request_url += "?" + urlencode(request_params)
+        elif request_data:
+            kwargs['body'] = urlencode(request_data)
+
+        kwargs['url'] = request_url
+        kwargs['headers'] = headers
+
+        start_time = time.time()
+        # Splash enforces its own render timeout; leave headroom for it.
+        timeout = aiohttp.ClientTimeout(
+            total=kwargs.get('timeout', self._max_wait_time) + 5)
+        async with self.session.post(
+                self._splash_server + '/render.html',
+                data=json.dumps(kwargs),
+                headers={"Content-Type": "application/json"},
+                timeout=timeout) as resp:
+            body = await resp.read()
+            return start_time, BufferedResponse(resp.status, body,
+                                                resp.headers, request_url)
+
+    async def _via_requests(self, headers, http_method, request_url,
+                            request_params, request_data, proxy_resource,
+                            **kwargs):
+        kwargs = {'timeout': aiohttp.ClientTimeout(total=self._max_wait_time),
+                  'proxy': normalize_proxy(proxy_resource['proxy']),
+                  'headers': headers}
+
+        if request_params:
+            kwargs['params'] = request_params
+        if request_data:
+            kwargs['data'] = request_data
+
+        start_time = time.time()
+        async with self.session.request(http_method, request_url,
+                                        **kwargs) as resp:
+            body = await resp.read()
+            return start_time, BufferedResponse(resp.status, body,
+                                                resp.headers, str(resp.url))
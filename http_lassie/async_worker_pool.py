@@ -0,0 +1,198 @@
+import asyncio
+import inspect
+import sys
+from collections import deque
+from http_lassie.smart_fetcher import format_exception
+from http_lassie.worker_pool import echo_error
+
+_DONE = object()
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class AsyncWorkerPool:
+    def __init__(self, task_func, error_func=echo_error, concurrency=100,
+                 max_queued=1000, max_results=1000, auto_stop=True):
+        """
+        Create an asyncio worker pool.
+
+        :param task_func: a coroutine function with the signature of
+            f(item, submit), where submit is a (non-blocking) function
+            that resubmits an item to this pool
+        :param error_func: a function (or coroutine function) with the
+            signature of f(item, exception, submit) that gets called on
+            any exception not handled by the task_func
+        :param concurrency: the maximum number of tasks running at once
+        :param max_queued: the size of the input queue. Once it is full,
+            `submit` waits for room (backpressure).
+        :param max_results: the size of the output queue. Once it is full,
+            finished tasks wait for `gather` to catch up.
+        :param auto_stop: if True, stop the pool when `gather` finishes
+        """
+        self._task_func = task_func
+        self._error_func = error_func
+        self._concurrency = concurrency
+        self._max_queued = max_queued
+        self._max_results = max_results
+        self._auto_stop = auto_stop
+
+        self._submitted = 0
+        self._finished = 0
+        self._open_feeds = 0
+        self._overflow = deque()
+        self._running = set()
+        self._work_queue = None
+        self._done_queue = None
+        self._semaphore = None
+        self._dispatcher = None
+
+    def start(self):
+        """
+        Begin processing the queue. Must be called inside the event loop.
+        """
+        if self._dispatcher is None:
+            self._ensure_queues()
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def stop(self):
+        """
+        Wait for running tasks to finish, then stop dispatching.
+
+        Items still queued are dropped.
+        """
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+
+    async def submit(self, item):
+        """
+        Submit some item for processing, waiting while the input queue
+        is full.
+        """
+        self._ensure_queues()
+        self._submitted += 1
+        await self._work_queue.put(item)
+
+    def feed(self, items):
+        """
+        Submit every item of an iterable (or async iterable) from a
+        background task, respecting backpressure. The pool is not done
+        until the iterable is exhausted.
+
+        :return: the feeding task
+        """
+        self._open_feeds += 1
+        return asyncio.ensure_future(self._feed(items))
+
+    async def gather(self):
+        """
+        Yields results as they complete until there is nothing left to
+        process.
+
+        If auto_stop is True, this will automatically call stop when there
+        is nothing left to process.
+        """
+        self.start()
+
+        while not self.is_done():
+            result = await self._done_queue.get()
+            if result is not _DONE:
+                yield result
+
+        while not self._done_queue.empty():
+            result = self._done_queue.get_nowait()
+            if result is not _DONE:
+                yield result
+
+        if self._auto_stop:
+            await self.stop()
+
+    def is_done(self):
+        return (self._submitted == self._finished and
+                self._open_feeds == 0)
+
+    def stats(self):
+        return {'n_submitted': self._submitted,
+                'n_finished': self._finished,
+                'n_running': len(self._running),
+                'work_queue_size': self._queue_size(self._work_queue) +
+                len(self._overflow),
+                'done_queue_size': self._queue_size(self._done_queue),
+                'is_done': self.is_done()}
+
+    def _ensure_queues(self):
+        if self._work_queue is None:
+            self._work_queue = asyncio.Queue(self._max_queued)
+            self._done_queue = asyncio.Queue(self._max_results)
+
+    @staticmethod
+    def _queue_size(queue):
+        return 0 if queue is None else queue.qsize()
+
+    def _resubmit(self, item):
+        # Tasks can't wait on the bounded queue: if every running task
+        # did, nothing would be left to drain it.
+        self._submitted += 1
+        try:
+            self._work_queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._overflow.append(item)
+
+    async def _feed(self, items):
+        try:
+            if hasattr(items, '__aiter__'):
+                async for item in items:
+                    await self.submit(item)
+            else:
+                for item in items:
+                    await self.submit(item)
+        finally:
+            self._open_feeds -= 1
+            self._signal_if_done()
+
+    async def _dispatch(self):
+        while True:
+            await self._semaphore.acquire()
+            if self._overflow:
+                item = self._overflow.popleft()
+            else:
+                item = await self._work_queue.get()
+            task = asyncio.ensure_future(self._run(item))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, item):
+        try:
+            result = await self._task_func(item, self._resubmit)
+            await self._done_queue.put(result)
+        except Exception as e:
+            try:
+                await _maybe_await(
+                    self._error_func(item, e, self._resubmit))
+            except Exception:
+                print(format_exception("[_run]", 0, sys.exc_info()))
+        finally:
+            self._finished += 1
+            self._semaphore.release()
+            self._signal_if_done()
+
+    def _signal_if_done(self):
+        # Wakes a `gather` blocked on an empty queue. A full queue needs no
+        # wake up: `gather` re-checks `is_done` after every result.
+        if self.is_done():
+            try:
+                self._done_queue.put_nowait(_DONE)
+            except asyncio.QueueFull:
+                pass
@@ -0,0 +1,143 @@
+from threading import Event, Lock, Thread
+from http_lassie.backoff import DomainBackoff
+
+
+class AutoScaler:
+    def __init__(self, pool, min_workers=1, max_workers=50, interval=1.0,
+                 increase=1, decrease=0.5, max_failure_rate=0.2,
+                 max_latency=None, is_failure=None, backoff_domains=2,
+                 metrics=None):
+        """
+        Resize a `WorkerPool` with additive-increase/multiplicative-
+        decrease (AIMD), from what it observes of the items the pool
+        finishes.
+
+        Every `interval`, the pool shrinks (by `decrease`) if mimic had
+        no proxies for several domains (`DomainBackoff`s), if too many
+        items failed, or if items got too slow. Otherwise, it grows (by
+        `increase`) while items are waiting for a worker.
+
+        Backoffs are counted per domain: one domain cooling down is left
+        to its cooldown, rather than slowing every other domain. Items
+        that backed off count as neither failures nor latency.
+
+        :param pool: the `WorkerPool`
+        :param min_workers: the fewest workers
+        :param max_workers: the most workers
+        :param interval: the seconds between adjustments
+        :param increase: the workers added per interval
+        :param decrease: the fraction of workers kept on congestion
+        :param max_failure_rate: the fraction of items that may fail (raise,
+            or be judged a failure by `is_failure`) before shrinking
+        :param max_latency: if not None, shrink when the mean seconds per
+            item exceed this
+        :param is_failure: an optional function of a task's result that
+            returns True if it failed without raising (e.g.
+            `lambda result: not result[1]` for `SmartFetcher` results,
+            which counts validator failures)
+        :param backoff_domains: the number of domains backing off within
+            an interval that makes the pool shrink
+        :param metrics: an optional `Metrics` to record each resize to
+        """
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError("Need 1 <= min_workers <= max_workers")
+
+        self._pool = pool
+        self._min_workers = min_workers
+        self._max_workers = max_workers
+        self._interval = interval
+        self._increase = increase
+        self._decrease = decrease
+        self._max_failure_rate = max_failure_rate
+        self._max_latency = max_latency
+        self._is_failure = is_failure
+        self._backoff_domains = backoff_domains
+        self._metrics = metrics
+
+        self._lock = Lock()
+        self._window = self._empty_window()
+        self._n_resizes = 0
+        self._stopped = Event()
+        self._thread = None
+
+        pool.add_listener(self._observe)
+
+    def start(self):
+        """
+        Start adjusting the pool (in a background thread).
+        """
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def adjust(self):
+        """
+        Resize the pool once, from what was observed since the last call.
+
+        :return: the new number of workers
+        """
+        with self._lock:
+            window, self._window = self._window, self._empty_window()
+
+        current = self._pool.n_workers
+        n = window['n_items']
+        mean_latency = window['latency'] / n if n else 0
+        failure_rate = window['n_failures'] / n if n else 0
+
+        if (len(window['backoffs']) >= self._backoff_domains or
+                failure_rate > self._max_failure_rate or
+                (self._max_latency is not None and
+                 mean_latency > self._max_latency)):
+            target = int(current * self._decrease)
+        elif self._pool.queue_depth() > 0:
+            target = current + self._increase
+        else:
+            target = current
+
+        target = max(self._min_workers, min(self._max_workers, target))
+        if target != current:
+            self._pool.resize(target)
+            self._n_resizes += 1
+        if self._metrics is not None:
+            self._metrics.set('workers', target)
+        return target
+
+    def stats(self):
+        with self._lock:
+            window = dict(self._window)
+        window['backoffs'] = dict(window['backoffs'])
+        window['n_workers'] = self._pool.n_workers
+        window['n_resizes'] = self._n_resizes
+        return window
+
+    def _observe(self, item, result, error, elapsed):
+        if isinstance(error, DomainBackoff):
+            domain = error.key
+            if isinstance(domain, tuple):  # A `lease_key`
+                domain = domain[0]
+            with self._lock:
+                backoffs = self._window['backoffs']
+                backoffs[domain] = backoffs.get(domain, 0) + 1
+            return
+
+        failed = error is not None
+        if not failed and self._is_failure is not None:
+            failed = self._is_failure(result)
+
+        with self._lock:
+            self._window['n_items'] += 1
+            self._window['latency'] += elapsed
+            self._window['n_failures'] += failed
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.adjust()
+
+    @staticmethod
+    def _empty_window():
+        return {'n_items': 0, 'latency': 0.0, 'n_failures': 0,
+                'backoffs': {}}
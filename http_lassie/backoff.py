@@ -0,0 +1,115 @@
+import random
+import time
+from threading import Lock
+
+
+class DomainBackoff(Exception):
+    def __init__(self, key, retry_after):
+        """
+        Raised instead of blocking when a domain is cooling down.
+
+        :param key: the backoff key (domain and requirements)
+        :param retry_after: the number of seconds until the key is ready
+        """
+        super().__init__(key, retry_after)
+        self.key = key
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return "{} is cooling down for {:.2f}s".format(self.key,
+                                                       self.retry_after)
+
+
+class BackoffScheduler:
+    def __init__(self, base_delay=1.0, factor=2.0, max_delay=300.0,
+                 jitter=0.5):
+        """
+        Track jittered exponential backoff per key (e.g. per domain and
+        requirement set).
+
+        Nothing here sleeps. Callers ask how long a key has left to cool
+        down and decide what to do with the time.
+
+        :param base_delay: the delay after the first failure, in seconds
+        :param factor: the multiplier applied for each consecutive failure
+        :param max_delay: the largest (pre-jitter) delay
+        :param jitter: the fraction of each delay that is randomized away
+            (0 is no jitter, 1 is "full jitter")
+        """
+        self._lock = Lock()
+        self._base_delay = base_delay
+        self._factor = factor
+        self._max_delay = max_delay
+        self._jitter = jitter
+        self._failures = {}  # key -> (consecutive failures, ready_at)
+        self._ready_at = {}  # The keys still cooling down
+        self._sweep_at = 64  # Sweep expired keys at this many failures
+
+    def delay(self, key):
+        """
+        :return: the number of seconds until the key is ready (0 if ready)
+        """
+        now = time.time()
+        with self._lock:
+            ready_at = self._ready_at.get(key)
+            if ready_at is not None and ready_at <= now:
+                del self._ready_at[key]
+        if ready_at is None:
+            return 0
+        return max(0, ready_at - now)
+
+    def failure(self, key):
+        """
+        Record a failure (e.g. mimic had no proxy) and start a cooldown.
+
+        A key's failures count as consecutive until it succeeds, or until
+        it has been ready for `max_delay` without failing again.
+
+        :return: the cooldown, in seconds
+        """
+        now = time.time()
+        with self._lock:
+            n, ready_at = self._failures.get(key, (0, now))
+            if now - ready_at >= self._max_delay:
+                n = 0
+            n += 1
+            delay = min(self._max_delay,
+                        self._base_delay * self._factor ** (n - 1))
+            delay *= 1 - self._jitter * random.random()
+            self._failures[key] = (n, now + delay)
+            self._ready_at[key] = now + delay
+            if len(self._failures) >= self._sweep_at:
+                self._sweep(now)
+        return delay
+
+    def success(self, key):
+        """
+        Record a success, which resets the key's backoff.
+        """
+        with self._lock:
+            self._failures.pop(key, None)
+            self._ready_at.pop(key, None)
+
+    def _sweep(self, now):
+        # Called with the lock held. Drop the keys that are ready, and the
+        # failures of those ready for max_delay. Sweeping again only once
+        # the failures have doubled keeps this O(1) per failure.
+        self._ready_at = {key: ready_at
+                          for key, ready_at in self._ready_at.items()
+                          if ready_at > now}
+        self._failures = {key: (n, ready_at)
+                          for key, (n, ready_at) in self._failures.items()
+                          if now - ready_at < self._max_delay}
+        self._sweep_at = max(64, 2 * len(self._failures))
+
+    def stats(self):
+        """
+        :return: a dict of the number of keys cooling down and the
+            remaining seconds for each
+        """
+        now = time.time()
+        with self._lock:
+            cooling = {key: ready_at - now
+                       for key, ready_at in self._ready_at.items()
+                       if ready_at > now}
+        return {'n_cooling': len(cooling), 'cooling': cooling}
@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from requests.structures import CaseInsensitiveDict
+from http_lassie.response import BufferedResponse
+
+MAX_AGE_RE = re.compile(r'max-age\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+# Responses to other methods (e.g. a POST) are never stored.
+CACHEABLE_METHODS = ('GET', 'HEAD')
+
+
+def request_key(http_method, request_url, request_params=None,
+                request_data=None, render_js=False):
+    """
+    :return: a stable key identifying a `SmartFetcher` request
+    """
+    doc = json.dumps([http_method.upper(), request_url, request_params,
+                      request_data, bool(render_js)],
+                     sort_keys=True, default=str)
+    return hashlib.sha1(doc.encode()).hexdigest()
+
+
+def _cache_control(headers):
+    value = headers.get('Cache-Control', '')
+    return {d.strip().split('=')[0].lower() for d in value.split(',')}
+
+
+def freshness_lifetime(headers, default_ttl=0):
+    """
+    :return: how long (in seconds) a response may be served without
+        revalidation, per its Cache-Control/Expires headers, or None if
+        it must not be stored at all
+    """
+    directives = _cache_control(headers)
+    if 'no-store' in directives:
+        return None
+    if 'no-cache' in directives:
+        return 0
+
+    match = MAX_AGE_RE.search(headers.get('Cache-Control', ''))
+    if match:
+        return int(match.group(1))
+
+    if 'Expires' in headers:
+        try:
+            expires = parsedate_to_datetime(headers['Expires']).timestamp()
+        except (TypeError, ValueError):
+            return 0
+        return max(0, expires - time.time())
+
+    return default_ttl
+
+
+class CacheEntry:
+    __slots__ = ('status_code', 'content', 'headers', 'url', 'expires_at')
+
+    def __init__(self, status_code, content, headers, url, expires_at):
+        self.status_code = status_code
+        self.content = content
+        self.headers = CaseInsensitiveDict(headers)
+        self.url = url
+        self.expires_at = expires_at
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    @property
+    def validators(self):
+        """
+        :return: the conditional request headers to revalidate this entry
+        """
+        headers = {}
+        if 'ETag' in self.headers:
+            headers['If-None-Match'] = self.headers['ETag']
+        if 'Last-Modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+    def is_fresh(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+    def to_response(self):
+        return BufferedResponse(self.status_code, self.content,
+                                self.headers, self.url)
+
+
+class MemoryCache:
+    def __init__(self, max_bytes=64 << 20):
+        """
+        An in-memory LRU cache with a budget on the total body size.
+
+        :param max_bytes: the most body bytes held at once
+        """
+        self._lock = Lock()
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._n_bytes = 0
+        self.n_evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if entry.size > self._max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._n_bytes -= old.size
+            self._entries[key] = entry
+            self._n_bytes += entry.size
+
+            while self._n_bytes > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._n_bytes -= evicted.size
+                self.n_evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._n_bytes -= entry.size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache:
+    def __init__(self, directory, max_bytes=None):
+        """
+        An on-disk cache with one (pickled) file per entry.
+
+        The size and recency of every entry are indexed in memory (from a
+        scan of the directory when created), so neither storing nor
+        counting entries lists the directory.
+
+        :param directory: where to store the entries
+        :param max_bytes: if not None, evict the least recently used
+            entries once the files exceed this many bytes
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        self.n_evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+        files = []
+        for dir_entry in os.scandir(directory):
+            if dir_entry.name.endswith('.entry'):
+                try:
+                    st = dir_entry.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, dir_entry.name[:-len('.entry')],
+                              st.st_size))
+        self._sizes = OrderedDict((key, size)
+                                  for _, key, size in sorted(files))
+        self._n_bytes = sum(self._sizes.values())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                entry = pickle.load(fp)
+            os.utime(path)  # Touch, for the LRU order of the next scan.
+        except FileNotFoundError:  # Evicted or deleted meanwhile
+            self._forget(key)
+            return None
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+        with self._lock:
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        return entry
+
+    def set(self, key, entry):
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            pickle.dump(entry, fp, pickle.HIGHEST_PROTOCOL)
+            size = fp.tell()
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            self._n_bytes += size - self._sizes.pop(key, 0)
+            self._sizes[key] = size
+            if self._max_bytes is not None:
+                self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+        self._forget(key)
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + '.entry')
+
+    def _forget(self, key):
+        with self._lock:
+            self._n_bytes -= self._sizes.pop(key, 0)
+
+    def _evict(self):
+        # The caller holds the lock.
+        while self._n_bytes > self._max_bytes and self._sizes:
+            key, size = self._sizes.popitem(last=False)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            self._n_bytes -= size
+            self.n_evictions += 1
+
+
+class ResponseCache:
+    def __init__(self, backend=None, default_ttl=0):
+        """
+        An HTTP-aware cache for `SmartFetcher` responses.
+
+        Fresh entries are served without acquiring a proxy. Stale entries
+        with an ETag or Last-Modified are revalidated with a conditional
+        request, and a 304 serves the stored body.
+
+        :param backend: a `MemoryCache` or `DiskCache`. If None, a
+            `MemoryCache` with the default budget.
+        :param default_ttl: the freshness lifetime (in seconds) of
+            responses without Cache-Control or Expires headers
+        """
+        self._backend = backend if backend is not None else MemoryCache()
+        self._default_ttl = default_ttl
+        self._lock = Lock()
+        self._counts = {'n_hits': 0, 'n_misses': 0, 'n_revalidated': 0,
+                        'n_stored': 0}
+
+    def lookup(self, key):
+        """
+        :return: a tuple of (fresh entry or None, stale entry or None)
+        """
+        entry = self._backend.get(key)
+        if entry is not None and entry.is_fresh():
+            self._count('n_hits')
+            return entry, None
+
+        self._count('n_misses')
+        if entry is not None and entry.validators:
+            return None, entry
+        return None, None
+
+    def store(self, key, resp, http_method='GET'):
+        """
+        Store a (200) response to a GET or HEAD, if its headers allow it.
+        """
+        if http_method.upper() not in CACHEABLE_METHODS:
+            return
+        lifetime = freshness_lifetime(resp.headers, self._default_ttl)
+        if resp.status_code != 200 or lifetime is None:
+            return
+
+        entry = CacheEntry(resp.status_code, resp.content, resp.headers,
+                           getattr(resp, 'url', None), time.time() + lifetime)
+        if lifetime > 0 or entry.validators:
+            self._backend.set(key, entry)
+            self._count('n_stored')
+
+    def revalidated(self, key, entry, resp):
+        """
+        Refresh a stale entry from a 304 response.
+
+        :return: the stored response
+        """
+        headers = CaseInsensitiveDict(entry.headers)
+        headers.update(resp.headers)
+        lifetime = freshness_lifetime(headers, self._default_ttl) or 0
+        entry = CacheEntry(entry.status_code, entry.content, headers,
+                           entry.url, time.time() + lifetime)
+        self._backend.set(key, entry)
+        self._count('n_revalidated')
+        return entry.to_response()
+
+    def invalidate(self, key):
+        self._backend.delete(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        stats['n_evictions'] = self._backend.n_evictions
+        stats['n_entries'] = len(self._backend)
+        return stats
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
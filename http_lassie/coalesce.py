@@ -0,0 +1,119 @@
+import asyncio
+import json
+from threading import Event, Lock
+from http_lassie.cache import request_key
+
+
+def flight_key(http_method, request_url, request_params, request_data,
+               render_js, extractor, validator, header_overrides=None,
+               splash_overrides=None):
+    """
+    :return: a key under which identical `SmartFetcher` calls coalesce
+        (two calls only share a result if they'd extract and validate it
+        the same way)
+    """
+    overrides = json.dumps([header_overrides, splash_overrides],
+                           sort_keys=True, default=str)
+    return (request_key(http_method, request_url, request_params,
+                        request_data, render_js),
+            extractor, validator, overrides)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self, done):
+        self.done = done
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        """
+        Deduplicate concurrent calls (across threads): while a call for a
+        key is in flight, later calls for the same key wait for it and
+        share its result (or exception).
+        """
+        self._lock = Lock()
+        self._calls = {}
+        self._n_calls = 0
+        self._n_shared = 0
+
+    def do(self, key, func):
+        """
+        :param key: the (hashable) key for the call
+        :param func: a zero-argument function that does the work
+        :return: the result of func (possibly from another thread's call)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call(Event())
+                self._n_calls += 1
+            else:
+                self._n_shared += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {'n_calls': self._n_calls,
+                    'n_shared': self._n_shared,
+                    'n_in_flight': len(self._calls)}
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        """
+        Deduplicate concurrent coroutine calls on one event loop (see
+        `SingleFlight`).
+        """
+        self._calls = {}
+        self._n_calls = 0
+        self._n_shared = 0
+
+    async def do(self, key, func):
+        """
+        :param key: the (hashable) key for the call
+        :param func: a zero-argument coroutine function that does the work
+        :return: the result of func (possibly from another task's call)
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self._n_shared += 1
+            # Shield, so one waiter being cancelled doesn't cancel the rest.
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(func())
+        self._calls[key] = future
+        self._n_calls += 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                del self._calls[key]
+            else:
+                future.add_done_callback(
+                    lambda _: self._calls.pop(key, None))
+
+    def stats(self):
+        return {'n_calls': self._n_calls,
+                'n_shared': self._n_shared,
+                'n_in_flight': len(self._calls)}
@@ -1,28 +1,308 @@
 import aiohttp
 import asyncio
 import async_timeout
+import json
+import logging
+import os
+import time
+from http_lassie.politeness import domain_of
+from http_lassie.transport import AsyncHTTP2Session, http2_available
+
+
+PART_SUFFIX = ".part"
+META_SUFFIX = ".meta.json"
+
+
+def read_meta(output_path):
+    """
+    :return: the sidecar metadata for a download (or an empty dict)
+    """
+    try:
+        with open(output_path + META_SUFFIX) as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_meta(output_path, meta):
+    """
+    Atomically replace the sidecar metadata for a download.
+    """
+    tmp_path = output_path + META_SUFFIX + ".tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(meta, fp)
+    os.replace(tmp_path, output_path + META_SUFFIX)
+
+
+def remove_meta(output_path):
+    """
+    Remove the sidecar metadata for a download, if any.
+    """
+    try:
+        os.remove(output_path + META_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def _validators(response):
+    return {k: response.headers[h]
+            for k, h in (('etag', 'ETag'), ('last_modified', 'Last-Modified'))
+            if h in response.headers}
+
+
+def _request_headers(output_path, part_path, meta, resume, conditional):
+    headers, offset = {}, 0
+
+    saved = meta.get('complete')
+    if conditional and saved and os.path.exists(output_path):
+        if 'etag' in saved:
+            headers['If-None-Match'] = saved['etag']
+        if 'last_modified' in saved:
+            headers['If-Modified-Since'] = saved['last_modified']
+
+    # Only resume when the server can tell us if the partial is stale.
+    partial = meta.get('partial') or {}
+    validator = partial.get('etag') or partial.get('last_modified')
+    if resume and validator and os.path.exists(part_path):
+        offset = os.path.getsize(part_path)
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = validator
+
+    return headers, offset
+
+
+def _write_prefix(fp, buf, n):
+    # Release the views before returning, so the buffer can be resized.
+    with memoryview(buf) as view, view[:n] as prefix:
+        fp.write(prefix)
+
+
+class _OffLoopWriter:
+    def __init__(self, fp, chunk_size, max_chunk_size, executor):
+        """
+        Coalesce network chunks into two reusable buffers and write each
+        full buffer from the executor while the other one fills. The
+        buffer size doubles on every flush (up to max_chunk_size), so
+        large bodies quickly move to few, large writes.
+        """
+        self._fp = fp
+        self._loop = asyncio.get_running_loop()
+        self._executor = executor
+        self._target = chunk_size
+        self._max_chunk_size = max(chunk_size, max_chunk_size)
+        self._buffers = [bytearray(chunk_size), bytearray(chunk_size)]
+        self._active = 0
+        self._filled = 0
+        self._pending = None
+
+    async def write(self, data):
+        data = memoryview(data)
+        while data:
+            buf = self._buffers[self._active]
+            if len(buf) < self._target:
+                buf.extend(bytes(self._target - len(buf)))
+
+            n = min(len(data), self._target - self._filled)
+            buf[self._filled:self._filled + n] = data[:n]
+            self._filled += n
+            data = data[n:]
+
+            if self._filled == self._target:
+                await self._flush()
+                self._target = min(self._max_chunk_size, self._target * 2)
+
+    async def close(self):
+        await self._flush()
+        if self._pending is not None:
+            await self._pending
+            self._pending = None
+
+    async def _flush(self):
+        if self._pending is not None:
+            await self._pending
+            self._pending = None
+
+        if self._filled:
+            self._pending = self._loop.run_in_executor(
+                self._executor, _write_prefix, self._fp,
+                self._buffers[self._active], self._filled)
+            self._active ^= 1
+            self._filled = 0
+
+
+def _resumes_at(response, offset):
+    # e.g. `Content-Range: bytes 1024-2047/2048`
+    content_range = response.headers.get('Content-Range', '')
+    try:
+        start = int(content_range.split()[1].split('-')[0])
+    except (IndexError, ValueError):
+        return False
+    return start == offset
+
+
+def metrics_trace_config(metrics):
+    """
+    :param metrics: a `Metrics`
+    :return: an `aiohttp.TraceConfig` that records how long new
+        connections take to open (per domain). Pass it to the
+        `ClientSession` (`trace_configs=[...]`).
+    """
+    async def on_request_start(session, ctx, params):
+        ctx.domain = domain_of(str(params.url))
+
+    async def on_connection_create_start(session, ctx, params):
+        ctx.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(session, ctx, params):
+        metrics.observe('phase_seconds',
+                        time.perf_counter() - ctx.connect_start,
+                        phase='connect', domain=ctx.domain)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_start.append(
+        on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
 
 
 async def fetch_and_save(session, url, output_path,
-                         chunk_size=1024, timeout=10):
+                         chunk_size=1024, timeout=10, resume=True,
+                         conditional=True, max_chunk_size=1 << 20,
+                         executor=None, metrics=None):
+    """
+    Save a url to a file.
+
+    The body is streamed to `output_path + ".part"`, which is renamed over
+    `output_path` only once complete, so `output_path` is never truncated.
+    Validators (ETag, Last-Modified) are kept in a sidecar
+    `output_path + ".meta.json"` file.
+
+    :param session: the ClientSession (or an `AsyncHTTP2Session`)
+    :param url: the url to fetch
+    :param output_path: the path to save the body to
+    :param chunk_size: the initial write size when streaming the body
+    :param timeout: the maximum time for the whole transfer
+    :param resume: if True, continue an interrupted download with a Range
+        request (when the server provided a validator for it)
+    :param conditional: if True and `output_path` was saved before, send
+        If-None-Match/If-Modified-Since and skip it if it's unchanged
+    :param max_chunk_size: the largest write size (the write size doubles
+        from chunk_size as the body streams in)
+    :param executor: the executor used for disk I/O, so the loop never
+        blocks on it. If None, the loop's default executor.
+    :param metrics: an optional `Metrics`, which then records the time to
+        the response headers (ttfb) and to stream the body, and the bytes
+        and statuses per domain
+    :return: a tuple of (url, output_path, bytes_read), where bytes_read
+        counts only the bytes transferred by this call (0 if unchanged)
+    """
     bytes_read = 0
+    part_path = output_path + PART_SUFFIX
+    loop = asyncio.get_running_loop()
+    meta = await loop.run_in_executor(executor, read_meta, output_path)
+    headers, offset = _request_headers(output_path, part_path, meta,
+                                       resume, conditional)
+
+    domain, start = domain_of(url), time.perf_counter()
+    async with async_timeout.timeout(timeout):
+        while True:
+            async with session.get(url, headers=headers) as response:
+                if metrics is not None:
+                    metrics.observe('phase_seconds',
+                                    time.perf_counter() - start,
+                                    phase='ttfb', domain=domain)
+                    metrics.inc('downloads_total', domain=domain,
+                                status=response.status)
+
+                if response.status == 304:
+                    return url, output_path, 0
 
-    with async_timeout.timeout(timeout):
-        async with session.get(url) as response:
-            # Don't save files that return a bad response.
-            if response.status != 200:
-                msg = "Response status for {} is {}"
-                raise ValueError(msg.format(url, response.status))
+                if response.status == 416 and offset:
+                    # The partial is unusable (e.g. already complete), so
+                    # start over without it.
+                    await loop.run_in_executor(executor, os.remove,
+                                               part_path)
+                    del headers['Range'], headers['If-Range']
+                    offset = 0
+                    continue
 
-            # Write the file to the output, streaming.
-            with open(output_path, "wb") as fp:
-                async for data in response.content.iter_chunked(chunk_size):
-                    fp.write(data)
-                    bytes_read += len(data)
+                # Don't save files that return a bad response.
+                if response.status not in (200, 206):
+                    msg = "Response status for {} is {}"
+                    raise ValueError(msg.format(url, response.status))
+
+                if response.status == 206 and _resumes_at(response, offset):
+                    mode = "ab"
+                elif response.status == 206:
+                    msg = "Unexpected Content-Range for {}: {}"
+                    raise ValueError(msg.format(
+                        url, response.headers.get('Content-Range')))
+                else:
+                    mode = "wb"
+
+                # Record validators first, so an interrupted transfer
+                # resumes (without any, it can't, so don't bother).
+                validators = _validators(response)
+                if validators:
+                    meta['partial'] = validators
+                    await loop.run_in_executor(executor, write_meta,
+                                               output_path, meta)
+
+                # Write the file to the output, streaming.
+                start = time.perf_counter()
+                fp = await loop.run_in_executor(executor, open, part_path,
+                                                mode)
+                try:
+                    writer = _OffLoopWriter(fp, chunk_size, max_chunk_size,
+                                            executor)
+                    try:
+                        while True:
+                            data = await response.content.readany()
+                            if not data:
+                                break
+                            await writer.write(data)
+                            bytes_read += len(data)
+                    finally:
+                        await writer.close()
+                finally:
+                    await loop.run_in_executor(executor, fp.close)
+                    if metrics is not None:
+                        metrics.observe('phase_seconds',
+                                        time.perf_counter() - start,
+                                        phase='body', domain=domain)
+                        metrics.inc('bytes_total', bytes_read,
+                                    domain=domain)
+            break
+
+    await loop.run_in_executor(executor, os.replace, part_path, output_path)
+    if validators:
+        await loop.run_in_executor(executor, write_meta, output_path,
+                                   {'complete': validators})
+    elif meta:
+        # The saved validators describe a previous version of the file.
+        await loop.run_in_executor(executor, remove_meta, output_path)
 
     return url, output_path, bytes_read
 
 
+async def fetch_and_save_politely(session, url, output_path, limiter,
+                                  **kwargs):
+    """
+    `fetch_and_save`, but only once the limiter has a slot for the url's
+    domain.
+
+    :param limiter: a `DomainLimiter`
+    """
+    key = domain_of(url)
+    await limiter.acquire(key)
+    try:
+        return await fetch_and_save(session, url, output_path, **kwargs)
+    finally:
+        limiter.release(key)
+
+
 async def fetch_and_save_all(loop, session,
                              *url_and_output_path_pairs,
                              **kwargs):
@@ -32,8 +312,141 @@ async def fetch_and_save_all(loop, session,
         return await asyncio.gather(*coros, loop)
 
 
+class DownloadError(Exception):
+    def __init__(self, url, output_path, error):
+        """
+        A failed download, yielded (not raised) by the streaming downloaders
+        so one bad url doesn't end the stream.
+
+        :param url: the url
+        :param output_path: the path it was to be saved to
+        :param error: the underlying exception
+        """
+        super().__init__(url, output_path, error)
+        self.url = url
+        self.output_path = output_path
+        self.error = error
+
+    def __str__(self):
+        return "{} -> {}: {!r}".format(self.url, self.output_path,
+                                       self.error)
+
+
+async def _aiter_pairs(url_and_output_path_pairs):
+    if hasattr(url_and_output_path_pairs, '__aiter__'):
+        async for pair in url_and_output_path_pairs:
+            yield pair
+    else:
+        for pair in url_and_output_path_pairs:
+            yield pair
+
+
+async def _fetch_or_error(session, url, output_path, limiter, **kwargs):
+    try:
+        if limiter is None:
+            return await fetch_and_save(session, url, output_path, **kwargs)
+        return await fetch_and_save_politely(session, url, output_path,
+                                             limiter, **kwargs)
+    except Exception as e:
+        return DownloadError(url, output_path, e)
+
+
+async def stream_download_all(url_and_output_path_pairs, session=None,
+                              concurrency=100, limiter=None, http2=False,
+                              **kwargs):
+    """
+    Save the given urls to the given files, yielding each result as it
+    completes. At most `concurrency` downloads are in flight and pairs are
+    only pulled from the input as slots free up, so memory is bounded by
+    `concurrency` rather than by the number of pairs.
+
+    :param url_and_output_path_pairs: an iterable (or async iterable) of
+        (url, output_path) pairs
+    :param session: the ClientSession. If None, create (and close) a new
+        session.
+    :param concurrency: the maximum number of downloads in flight
+    :param limiter: an optional `DomainLimiter`
+    :param http2: if True, a new session is an `AsyncHTTP2Session`, which
+        multiplexes the downloads from each HTTP/2 host over one
+        connection (if httpx[http2] is installed)
+    :param kwargs: a dictionary of options passed to fetch_and_save
+        (with `metrics`, a new aiohttp session also records connect times and
+        the downloads in flight are tracked)
+    :return: an async generator of `(url, output_path, bytes_read)` tuples
+        or `DownloadError` instances, in completion order
+    """
+    metrics = kwargs.get('metrics')
+    owns_session = session is None
+    if owns_session and http2 and http2_available():
+        session = AsyncHTTP2Session(max_connections=concurrency)
+    elif owns_session:
+        if http2:
+            logging.warning("httpx[http2] is not installed; using HTTP/1.1")
+        trace_configs = ([metrics_trace_config(metrics)]
+                         if metrics is not None else None)
+        session = aiohttp.ClientSession(trace_configs=trace_configs)
+    pairs = _aiter_pairs(url_and_output_path_pairs).__aiter__()
+    pending, exhausted = set(), False
+
+    try:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    url, output_path = await pairs.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(
+                    _fetch_or_error(session, url, output_path, limiter,
+                                    **kwargs)))
+
+            if not pending:
+                break
+
+            if metrics is not None:
+                metrics.set('downloads_in_flight', len(pending))
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if metrics is not None:
+            metrics.set('downloads_in_flight', 0)
+        if owns_session:
+            await session.close()
+
+
+def iter_download_all(url_and_output_path_pairs, loop=None, **kwargs):
+    """
+    A blocking generator over `stream_download_all`.
+
+    :param url_and_output_path_pairs: an iterable of (url, output_path)
+        pairs (consumed lazily)
+    :param loop: the event loop. If None, create a new loop.
+    :param kwargs: a dictionary of options passed to stream_download_all
+    :return: a generator of `(url, output_path, bytes_read)` tuples or
+        `DownloadError` instances, in completion order
+    """
+    owns_loop = loop is None
+    loop = loop or asyncio.new_event_loop()
+    results = stream_download_all(url_and_output_path_pairs, **kwargs)
+
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(results.aclose())
+        if owns_loop:
+            loop.close()
+
+
 def download_all(*url_and_output_path_pairs, loop=None, session=None,
-                 **kwargs):
+                 limiter=None, **kwargs):
     """
     Save all given urls to the given files, asynchronously.
 
@@ -41,12 +454,19 @@ def download_all(*url_and_output_path_pairs, loop=None, session=None,
         pairs
     :param loop: the event loop. If None, get the current loop
     :param session: the ClientSession. If None, create a new session.
+    :param limiter: an optional `DomainLimiter` that rate limits and caps
+        the requests in flight per domain
     :param kwargs: a dictionary of options passed to fetch_and_save
     """
     loop = loop or asyncio.get_event_loop()
     session = session or aiohttp.ClientSession(loop=loop)
-    coros = [fetch_and_save(session, url, output_path, **kwargs)
-             for url, output_path in url_and_output_path_pairs]
+    if limiter is None:
+        coros = [fetch_and_save(session, url, output_path, **kwargs)
+                 for url, output_path in url_and_output_path_pairs]
+    else:
+        coros = [fetch_and_save_politely(session, url, output_path, limiter,
+                                         **kwargs)
+                 for url, output_path in url_and_output_path_pairs]
 
     res = loop.run_until_complete(asyncio.gather(*coros))
     loop.run_until_complete(session.close())
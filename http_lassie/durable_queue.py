@@ -0,0 +1,291 @@
+import logging
+import pickle
+import sqlite3
+import time
+from threading import Condition, Lock, Thread
+from six.moves.queue import Queue
+
+PENDING, IN_FLIGHT, DONE, FAILED = 0, 1, 2, 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+    key     TEXT NOT NULL UNIQUE,
+    state   INTEGER NOT NULL,
+    item    BLOB,
+    updated REAL NOT NULL
+)
+""".strip()
+
+UPSERT = """
+INSERT INTO items (key, state, item, updated) VALUES (?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    state = excluded.state,
+    item = COALESCE(excluded.item, items.item),
+    updated = excluded.updated
+""".strip()
+
+
+class DurableQueue:
+    def __init__(self, path, key_func=repr, dedupe=True, flush_interval=0.5,
+                 batch_size=1000, sync_adds=False):
+        """
+        A `WorkerPool` work queue that records every item's state
+        (pending, in flight, done or failed) in a SQLite file, so a
+        restarted pool resumes where the last one stopped.
+
+        Items are served from memory. State changes are written by a
+        background thread in batches (one transaction per batch), so the
+        workers never wait on disk. A crash loses at most the last
+        `flush_interval` of changes: items whose later changes (in
+        flight, done or failed) are lost are processed again, but items
+        added in that interval are lost with them. With `sync_adds`, `add`
+        waits for the batch holding its item to be written (concurrent
+        adds share a transaction), so an added item is never lost.
+
+        Only the items pending or in flight are held in memory: whether
+        an item was already done is looked up in the file (by its
+        indexed key).
+
+        Opening an existing file requeues its pending and in-flight
+        items. Pass the queue as a `WorkerPool`'s `work_queue`: items
+        whose task raised (and that weren't resubmitted) are recorded as
+        failed, the rest as done. Items must be picklable.
+
+        :param path: the SQLite file
+        :param key_func: a function of an item returning its (string)
+            identity, for deduplication
+        :param dedupe: if True, items already done (in this or an earlier
+            run) or already pending are not queued again. Failed items
+            may be.
+        :param flush_interval: the most seconds a state change waits to
+            be written
+        :param batch_size: write as soon as this many changes are waiting
+        :param sync_adds: if True, `add` returns once its item is written
+        """
+        self._key_func = key_func
+        self._dedupe = dedupe
+        self._sync_adds = sync_adds
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+
+        self._lock = Lock()
+        self._active = {}  # key -> PENDING or IN_FLIGHT
+        self._outstanding = {}
+        self._counts = {DONE: 0, FAILED: 0}
+        self._queue = Queue()
+
+        self._writes = []
+        self._unwritten = {}  # key -> its latest state in self._writes
+        self._write_cond = Condition(Lock())
+        self._closed = False
+        self._sync_waiting = False  # A sync add waits for the writer
+        self._n_recorded = 0
+        self._n_written = 0
+
+        self._db_lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(SCHEMA)
+        self._db.commit()
+        self.n_resumed = self._resume()
+
+        self._writer = Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def add(self, item, hold=False):
+        """
+        Record an item as pending and (unless held) queue it.
+
+        :param item: the item
+        :param hold: if True, only record it. The caller `put`s it later
+            (e.g. once a `WorkerPool` delay is over).
+        :return: False if the item is a duplicate (and was dropped)
+        """
+        key = self._key_func(item)
+        blob = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self._dedupe and self._outstanding.get(key, 0) > 0:
+                return False
+            if key not in self._active:
+                state = self._state(key)
+                if self._dedupe and state == DONE:
+                    return False
+                if state in self._counts:  # Done or failed, redone
+                    self._counts[state] -= 1
+            # An in-flight item may be added again (e.g. a retry).
+            self._active[key] = PENDING
+            self._outstanding[key] = self._outstanding.get(key, 0) + 1
+            n_recorded = self._record(key, PENDING, blob)
+
+        if self._sync_adds:
+            self._wait_written(n_recorded)
+        if not hold:
+            self._queue.put(item)
+        return True
+
+    def put(self, item):
+        """
+        Queue an item that was already `add`ed with hold=True (or the
+        `None` kill sentinel).
+        """
+        self._queue.put(item)
+
+    def get(self):
+        item = self._queue.get()
+        if item is None:
+            return item
+
+        key = self._key_func(item)
+        with self._lock:
+            self._outstanding[key] -= 1
+            if self._outstanding[key] == 0:
+                self._active[key] = IN_FLIGHT
+                self._record(key, IN_FLIGHT)
+        return item
+
+    def release(self, item):
+        """
+        Record an item as done (unless another copy of it is pending).
+        """
+        self._finish(item, DONE)
+
+    def fail(self, item):
+        """
+        Record an item as failed (unless another copy of it is pending,
+        e.g. a retry).
+        """
+        self._finish(item, FAILED)
+
+    def failed_items(self):
+        """
+        :return: a list of the items recorded as failed (in this or an
+            earlier run)
+        """
+        self.flush()
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT item FROM items WHERE state = ? ORDER BY seq",
+                (FAILED,)).fetchall()
+        return [pickle.loads(blob) for blob, in rows]
+
+    def empty(self):
+        return self._queue.empty()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        """
+        Write every recorded state change now.
+        """
+        # Hold the db lock while draining, so batches land in order (and
+        # `_state` never misses a change that is drained but unwritten).
+        with self._db_lock:
+            with self._write_cond:
+                writes, self._writes = self._writes, []
+                self._unwritten = {}
+                self._sync_waiting = False
+            if writes:
+                with self._db:
+                    self._db.executemany(UPSERT, writes)
+                with self._write_cond:
+                    self._n_written += len(writes)
+                    self._write_cond.notify_all()
+
+    def close(self):
+        """
+        Flush, then close the SQLite file.
+        """
+        with self._write_cond:
+            self._closed = True
+            self._write_cond.notify_all()
+        self._writer.join()
+        self.flush()
+        self._db.close()
+
+    def stats(self):
+        with self._lock:
+            states = list(self._active.values())
+            counts = dict(self._counts)
+        with self._write_cond:
+            n_unwritten = len(self._writes)
+        return {'n_pending': states.count(PENDING),
+                'n_in_flight': states.count(IN_FLIGHT),
+                'n_done': counts[DONE],
+                'n_failed': counts[FAILED],
+                'n_resumed': self.n_resumed,
+                'n_written': self._n_written,
+                'n_unwritten': n_unwritten}
+
+    def _resume(self):
+        for state, n in self._db.execute(
+                "SELECT state, COUNT(*) FROM items GROUP BY state"):
+            if state in self._counts:
+                self._counts[state] = n
+
+        rows = self._db.execute(
+            "SELECT key, item FROM items WHERE state IN (?, ?) ORDER BY seq",
+            (PENDING, IN_FLIGHT))
+        n_resumed = 0
+        for key, blob in rows:
+            self._active[key] = PENDING
+            self._outstanding[key] = 1
+            self._queue.put(pickle.loads(blob))
+            n_resumed += 1
+        return n_resumed
+
+    def _state(self, key):
+        # :return: the recorded state of an item not pending or in flight
+        #     (DONE, FAILED or None)
+        with self._write_cond:
+            state = self._unwritten.get(key)
+        if state is not None:
+            return state
+        with self._db_lock:
+            row = self._db.execute("SELECT state FROM items WHERE key = ?",
+                                   (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _finish(self, item, state):
+        key = self._key_func(item)
+        with self._lock:
+            if self._outstanding.get(key, 0) > 0:
+                return
+            self._outstanding.pop(key, None)
+            self._active.pop(key, None)
+            self._counts[state] += 1
+            self._record(key, state)
+
+    def _record(self, key, state, blob=None):
+        # Called with self._lock held, so changes are written in order.
+        # :return: the number of changes recorded so far
+        with self._write_cond:
+            self._writes.append((key, state, blob, time.time()))
+            self._unwritten[key] = state
+            self._n_recorded += 1
+            if self._sync_adds and state == PENDING:
+                self._sync_waiting = True
+            if len(self._writes) >= self._batch_size or self._sync_waiting:
+                self._write_cond.notify_all()
+            return self._n_recorded
+
+    def _wait_written(self, n_recorded):
+        with self._write_cond:
+            while self._n_written < n_recorded and not self._closed:
+                self._write_cond.wait()
+
+    def _write_loop(self):
+        while True:
+            with self._write_cond:
+                if (not self._closed and
+                        len(self._writes) < self._batch_size and
+                        not self._sync_waiting):
+                    self._write_cond.wait(self._flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("Failed to write the durable queue")
@@ -0,0 +1,88 @@
+from collections import defaultdict, deque
+from threading import Lock
+
+
+class HedgePolicy:
+    def __init__(self, percentile=0.95, initial_delay=1.0, min_delay=0.05,
+                 max_delay=None, budget=0.05, max_tokens=10, window=200,
+                 min_samples=20):
+        """
+        When (and how often) `SmartFetcher` hedges: if an attempt hasn't
+        finished after the `percentile` latency of recent attempts on
+        its domain, a second attempt is launched through another proxy.
+
+        Hedges are paid for from a budget: every request earns `budget`
+        tokens (up to `max_tokens`) and every hedge costs one, so hedging
+        adds at most about `budget` (e.g. 5%) extra requests.
+
+        :param percentile: the latency percentile (0 to 1) to hedge at
+        :param initial_delay: the delay until a domain has `min_samples`
+            latencies
+        :param min_delay: the shortest delay
+        :param max_delay: if not None, the longest delay
+        :param budget: the hedges allowed per request
+        :param max_tokens: the most hedges that can be saved up
+        :param window: the latencies kept per domain
+        :param min_samples: the fewest latencies to trust a percentile
+        """
+        self._lock = Lock()
+        self._percentile = percentile
+        self._initial_delay = initial_delay
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._budget = budget
+        self._max_tokens = max_tokens
+        self._min_samples = min_samples
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._tokens = 0.0
+        self._n_requests = 0
+        self._n_hedged = 0
+        self._n_denied = 0
+
+    def record(self, domain, latency):
+        """
+        Record how long an attempt on this domain took.
+        """
+        with self._lock:
+            self._latencies[domain].append(latency)
+
+    def delay(self, domain):
+        """
+        :return: the seconds to wait before hedging a request for this
+            domain. Also earns the request its share of the budget.
+        """
+        with self._lock:
+            self._n_requests += 1
+            self._tokens = min(self._max_tokens,
+                               self._tokens + self._budget)
+            latencies = self._latencies.get(domain)
+            if latencies is None or len(latencies) < self._min_samples:
+                delay = self._initial_delay
+            else:
+                ordered = sorted(latencies)
+                delay = ordered[min(len(ordered) - 1,
+                                    int(self._percentile * len(ordered)))]
+
+        delay = max(self._min_delay, delay)
+        if self._max_delay is not None:
+            delay = min(self._max_delay, delay)
+        return delay
+
+    def try_hedge(self):
+        """
+        :return: True (and spend a token) if the budget allows a hedge
+        """
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._n_hedged += 1
+                return True
+            self._n_denied += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {'n_requests': self._n_requests,
+                    'n_hedged': self._n_hedged,
+                    'n_denied': self._n_denied,
+                    'tokens': self._tokens}
@@ -0,0 +1,116 @@
+import random
+import time
+from collections import OrderedDict
+from threading import Lock
+from requests.cookies import RequestsCookieJar
+from http_lassie.user_agents import random_user_agent
+
+ACCEPT = "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
+
+ACCEPT_LANGUAGES = ["en-US,en;q=0.9",
+                    "en-US,en;q=0.5",
+                    "en-GB,en;q=0.9,en-US;q=0.8",
+                    "en-US,en;q=0.8,es;q=0.6",
+                    "en-US,en;q=0.9,fr;q=0.7"]
+
+
+class Identity:
+    __slots__ = ('user_agent', 'headers', 'cookies', 'created_at', 'uses')
+
+    def __init__(self, user_agent, headers, created_at):
+        """
+        A browser identity: the user agent, headers and cookies a client
+        presents to one domain.
+        """
+        self.user_agent = user_agent
+        self.headers = headers
+        self.cookies = RequestsCookieJar()
+        self.created_at = created_at
+        self.uses = 0
+
+    def update_cookies(self, resp):
+        """
+        Keep the cookies set by a response (and any redirects before it).
+        """
+        for r in list(getattr(resp, 'history', [])) + [resp]:
+            cookies = getattr(r, 'cookies', None)
+            if cookies:
+                self.cookies.update(cookies)
+
+
+def make_identity(now):
+    """
+    :return: a new `Identity` with a random user agent and header set
+    """
+    headers = {'User-Agent': random_user_agent(),
+               'Accept': ACCEPT,
+               'Accept-Language': random.choice(ACCEPT_LANGUAGES)}
+    return Identity(headers['User-Agent'], headers, now)
+
+
+class IdentityManager:
+    def __init__(self, lifetime=600, max_identities=10000,
+                 identity_factory=make_identity):
+        """
+        Bind an identity (user agent, headers and cookie jar) to each
+        (proxy, domain) pair, so the same proxy looks like the same
+        browser every time it comes back to a domain.
+
+        One manager can be shared by several `SmartFetcher`s (e.g. the
+        tasks of a `WorkerPool`).
+
+        :param lifetime: how long (in seconds) an identity lasts before
+            it's replaced with a new one
+        :param max_identities: the most identities held at once (the
+            least recently used are dropped)
+        :param identity_factory: a callable taking the current time and
+            returning a new `Identity`
+        """
+        self._lock = Lock()
+        self._lifetime = lifetime
+        self._max_identities = max_identities
+        self._identity_factory = identity_factory
+        self._identities = OrderedDict()
+        self._counts = {'n_created': 0, 'n_reused': 0, 'n_retired': 0}
+
+    def get(self, proxy, domain):
+        """
+        :return: the identity for this (proxy, domain), creating it if
+            there is none or it has expired
+        """
+        key, now = (proxy, domain), time.time()
+
+        with self._lock:
+            identity = self._identities.get(key)
+            if (identity is not None and
+                    now - identity.created_at < self._lifetime):
+                self._identities.move_to_end(key)
+                self._counts['n_reused'] += 1
+            else:
+                identity = self._identity_factory(now)
+                self._identities[key] = identity
+                self._identities.move_to_end(key)
+                self._counts['n_created'] += 1
+                while len(self._identities) > self._max_identities:
+                    self._identities.popitem(last=False)
+
+            identity.uses += 1
+            return identity
+
+    def retire(self, proxy, domain):
+        """
+        Drop the identity for this (proxy, domain) (e.g. after it was
+        served a captcha), so the next request starts over.
+        """
+        with self._lock:
+            if self._identities.pop((proxy, domain), None) is not None:
+                self._counts['n_retired'] += 1
+
+    def __len__(self):
+        return len(self._identities)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+            stats['n_identities'] = len(self._identities)
+        return stats
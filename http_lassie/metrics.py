@@ -0,0 +1,243 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from six.moves.urllib.parse import urlparse
+
+# Latency buckets (in seconds), from fast cache-like hits to slow renders.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+
+COUNTER, GAUGE, HISTOGRAM = 'counter', 'gauge', 'histogram'
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        A fixed-bucket histogram.
+
+        :param buckets: the (sorted) upper bounds of the buckets. Values
+            above the last one land in an implicit +Inf bucket.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        :return: a list of (upper bound, count of values <= it) pairs,
+            ending with (inf, count)
+        """
+        pairs, total = [], 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, q):
+        """
+        :return: the upper bound of the bucket holding the q-th quantile
+            (0 if empty)
+        """
+        if self.count == 0:
+            return 0
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+
+
+def proxy_label(proxy):
+    """
+    :return: the host and port of a proxy url, for a metric label (so
+        credentials in the url never reach a metrics backend): 'direct'
+        if there is no proxy, or 'unknown' if it has no host
+    """
+    if not proxy:
+        return 'direct'
+    if '://' not in proxy:  # e.g. `host:port`
+        proxy = '//' + proxy
+    parsed = urlparse(proxy)
+    try:
+        port = parsed.port
+    except ValueError:  # Not a number
+        port = None
+    if not parsed.hostname:
+        return 'unknown'
+    if port is None:
+        return parsed.hostname
+    return '{}:{}'.format(parsed.hostname, port)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v))
+                          for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        A thread-safe registry of labelled counters, gauges and latency
+        histograms.
+
+        Pass one to `SmartFetcher`, `WorkerPool` or the `direct_util`
+        downloaders (as `metrics=`) to instrument them. Read it back with
+        `snapshot()` or `to_prometheus()`, or watch every measurement as
+        it happens with `add_callback()`.
+
+        :param buckets: the histogram bucket bounds (in seconds)
+        """
+        self._lock = Lock()
+        self._buckets = buckets
+        self._metrics = {COUNTER: {}, GAUGE: {}, HISTOGRAM: {}}
+        self._callbacks = []
+
+    def add_callback(self, callback):
+        """
+        :param callback: a function with the signature of
+            f(kind, name, value, labels), called (on the recording thread)
+            for every measurement. kind is 'counter', 'gauge' or
+            'histogram' and labels is a dict.
+        """
+        with self._lock:
+            self._callbacks = self._callbacks + [callback]
+
+    def remove_callback(self, callback):
+        with self._lock:
+            self._callbacks = [c for c in self._callbacks if c != callback]
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add to a counter.
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            counters = self._metrics[COUNTER]
+            counters[key] = counters.get(key, 0) + value
+        self._notify(COUNTER, name, value, labels)
+
+    def set(self, name, value, **labels):
+        """
+        Set a gauge.
+        """
+        with self._lock:
+            self._metrics[GAUGE][(name, _label_key(labels))] = value
+        self._notify(GAUGE, name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """
+        Add a value (e.g. a duration in seconds) to a histogram.
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._metrics[HISTOGRAM].get(key)
+            if histogram is None:
+                histogram = Histogram(self._buckets)
+                self._metrics[HISTOGRAM][key] = histogram
+            histogram.observe(value)
+        self._notify(HISTOGRAM, name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe how long the body of a `with` block takes.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get(self, name, **labels):
+        """
+        :return: the counter or gauge value (or `Histogram`) for this name
+            and labels, or None
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            for kind in (COUNTER, GAUGE, HISTOGRAM):
+                if key in self._metrics[kind]:
+                    return self._metrics[kind][key]
+        return None
+
+    def snapshot(self):
+        """
+        :return: a dict of {kind: {(name, labels): value}}, where labels
+            is a sorted tuple of (label, value) pairs and histograms are
+            summarised as {'count', 'sum', 'buckets'}
+        """
+        with self._lock:
+            snapshot = {COUNTER: dict(self._metrics[COUNTER]),
+                        GAUGE: dict(self._metrics[GAUGE])}
+            snapshot[HISTOGRAM] = {
+                key: {'count': h.count, 'sum': h.sum,
+                      'buckets': h.cumulative()}
+                for key, h in self._metrics[HISTOGRAM].items()}
+        return snapshot
+
+    def to_prometheus(self, namespace='http_lassie'):
+        """
+        :return: every metric in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        prefix = namespace + '_' if namespace else ''
+        lines = []
+
+        for kind in (COUNTER, GAUGE, HISTOGRAM):
+            by_name = {}
+            for (name, label_key), value in snapshot[kind].items():
+                by_name.setdefault(name, []).append((label_key, value))
+
+            for name in sorted(by_name):
+                full_name = prefix + name
+                lines.append('# TYPE {} {}'.format(full_name, kind))
+                for label_key, value in sorted(by_name[name]):
+                    if kind != HISTOGRAM:
+                        lines.append('{}{} {}'.format(
+                            full_name, _format_labels(label_key),
+                            _format_value(value)))
+                        continue
+
+                    for bound, total in value['buckets']:
+                        lines.append('{}_bucket{} {}'.format(
+                            full_name,
+                            _format_labels(label_key,
+                                           [('le', _format_value(bound))]),
+                            total))
+                    lines.append('{}_sum{} {}'.format(
+                        full_name, _format_labels(label_key),
+                        _format_value(value['sum'])))
+                    lines.append('{}_count{} {}'.format(
+                        full_name, _format_labels(label_key),
+                        value['count']))
+
+        return '\n'.join(lines) + '\n'
+
+    def _notify(self, kind, name, value, labels):
+        for callback in self._callbacks:
+            callback(kind, name, value, labels)
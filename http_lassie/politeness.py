@@ -0,0 +1,285 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from threading import Condition, Lock
+from six.moves.urllib.parse import urlparse
+
+
+def domain_of(url):
+    """
+    :return: the (lowercased) host and port of a url
+    """
+    return urlparse(url).netloc.lower()
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate, burst):
+        """
+        :param rate: the tokens added per second (None is unlimited)
+        :param burst: the most tokens that can accumulate
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.time()
+
+    def wait_time(self, now):
+        """
+        :return: the seconds until a token is available (0 if one is)
+        """
+        if self.rate is None:
+            return 0
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate is not None:
+            self.tokens -= 1
+
+    def is_full(self, now):
+        """
+        :return: True if the bucket has refilled (so a new one would do)
+        """
+        return (self.rate is None or
+                self.tokens + (now - self.updated_at) * self.rate >=
+                self.burst)
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class DomainLimiter:
+    def __init__(self, rate=1.0, burst=1, max_in_flight=2, per_domain=None):
+        """
+        Rate limit and cap concurrency per domain (or any other key).
+
+        :param rate: the requests per second allowed for each domain
+            (None is unlimited)
+        :param burst: the number of requests a domain may burst to
+        :param max_in_flight: the number of simultaneous requests allowed
+            for each domain (None is unlimited)
+        :param per_domain: a dictionary of domain to a dictionary of
+            overrides for `rate`, `burst` and `max_in_flight`
+        """
+        self._lock = Lock()
+        self._defaults = {'rate': rate, 'burst': burst,
+                          'max_in_flight': max_in_flight}
+        self._per_domain = per_domain or {}
+        self._buckets = {}
+        self._sweep_at = 64  # Evict idle buckets at this many buckets
+        self._in_flight = {}
+        self._waiters = {}  # Futures of `acquire`s waiting for a release
+
+    def try_acquire(self, key):
+        """
+        Take a slot for this key if one is free.
+
+        :return: 0 on success. Otherwise, the seconds until a token is
+            available, or None if the key is at its in-flight cap (wait
+            for a `release`).
+        """
+        with self._lock:
+            return self._try_acquire(key)
+
+    def _try_acquire(self, key):
+        # The caller holds the lock.
+        limits = self._limits(key)
+        in_flight = self._in_flight.get(key, 0)
+        max_in_flight = limits['max_in_flight']
+        if max_in_flight is not None and in_flight >= max_in_flight:
+            return None
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self._sweep_at:
+                self._evict_idle(time.time())
+            bucket = TokenBucket(limits['rate'], limits['burst'])
+            self._buckets[key] = bucket
+
+        wait = bucket.wait_time(time.time())
+        if wait > 0:
+            return wait
+
+        bucket.take()
+        self._in_flight[key] = in_flight + 1
+        return 0
+
+    def release(self, key):
+        """
+        Give back the slot taken by a successful `try_acquire`.
+        """
+        with self._lock:
+            in_flight = self._in_flight.get(key, 0) - 1
+            if in_flight > 0:
+                self._in_flight[key] = in_flight
+            else:
+                self._in_flight.pop(key, None)
+        self._wake_one(key)
+
+    async def acquire(self, key):
+        """
+        Wait (without blocking the loop) until a slot for this key is free.
+
+        At the in-flight cap, this waits to be woken by a `release` (from
+        any thread or loop); otherwise it sleeps until a token is due.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            waiter = None
+            with self._lock:
+                wait = self._try_acquire(key)
+                if wait is None:
+                    waiter = loop.create_future()
+                    self._waiters.setdefault(key, deque()).append(waiter)
+
+            if wait == 0:
+                return
+            if waiter is None:
+                await asyncio.sleep(wait)
+                continue
+
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._lock:
+                    waiters = self._waiters.get(key, ())
+                    woken = waiter not in waiters
+                    if not woken:
+                        waiters.remove(waiter)
+                        if not waiters:
+                            del self._waiters[key]
+                if woken:  # Pass the release on to the next waiter.
+                    self._wake_one(key)
+                raise
+
+    def _wake_one(self, key):
+        while True:
+            with self._lock:
+                waiters = self._waiters.get(key)
+                if not waiters:
+                    return
+                waiter = waiters.popleft()
+                if not waiters:
+                    del self._waiters[key]
+            try:
+                waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+                return
+            except RuntimeError:  # Its loop is closed; try the next one.
+                continue
+
+    def _evict_idle(self, now):
+        # The caller holds the lock. A bucket that has refilled, for a key
+        # with nothing in flight, is no different from a new one. Evicting
+        # again only once the buckets have doubled keeps this O(1) per
+        # new key.
+        self._buckets = {key: bucket
+                         for key, bucket in self._buckets.items()
+                         if key in self._in_flight or
+                         not bucket.is_full(now)}
+        self._sweep_at = max(64, 2 * len(self._buckets))
+
+    def in_flight(self):
+        """
+        :return: a dict of key to the number of requests in flight
+        """
+        with self._lock:
+            return dict(self._in_flight)
+
+    def _limits(self, key):
+        overrides = self._per_domain.get(key)
+        if not overrides:
+            return self._defaults
+        return {**self._defaults, **overrides}
+
+
+class DomainQueue:
+    def __init__(self, key_func, limiter=None):
+        """
+        A drop-in replacement for `WorkerPool`'s FIFO work queue that keeps
+        a queue per domain and round-robins across the domains that the
+        limiter says are ready, so no single host monopolizes the workers.
+
+        :param key_func: a function mapping an item to its domain (e.g.
+            `lambda item: domain_of(item['url'])`)
+        :param limiter: the `DomainLimiter`. If None, a default one.
+        """
+        self._key_func = key_func
+        self._limiter = limiter or DomainLimiter()
+        self._cond = Condition()
+        self._queues = OrderedDict()
+        self._sentinels = deque()
+        self._size = 0
+
+    def put(self, item):
+        with self._cond:
+            if item is None:  # Kill sentinels skip the line.
+                self._sentinels.append(item)
+            else:
+                key = self._key_func(item)
+                queue = self._queues.get(key)
+                if queue is None:
+                    queue = self._queues[key] = deque()
+                queue.append(item)
+                self._size += 1
+            self._cond.notify()
+
+    def get(self):
+        """
+        Remove and return the next item from a ready domain, blocking
+        until there is one. The caller must `release` the item when done.
+        """
+        with self._cond:
+            while True:
+                if self._sentinels:
+                    return self._sentinels.popleft()
+
+                item, timeout = self._next_ready()
+                if item is not None:
+                    return item
+                self._cond.wait(timeout)
+
+    def release(self, item):
+        """
+        Mark an item returned by `get` as finished.
+        """
+        self._limiter.release(self._key_func(item))
+        with self._cond:
+            self._cond.notify()
+
+    def empty(self):
+        with self._cond:
+            return self._size == 0 and not self._sentinels
+
+    def qsize(self):
+        with self._cond:
+            return self._size + len(self._sentinels)
+
+    def sizes(self):
+        """
+        :return: a dict of domain to the number of items waiting for it
+        """
+        with self._cond:
+            return {key: len(queue) for key, queue in self._queues.items()}
+
+    def _next_ready(self):
+        timeout = None
+        for key in list(self._queues):
+            wait = self._limiter.try_acquire(key)
+            if wait == 0:
+                queue = self._queues.pop(key)
+                item = queue.popleft()
+                if queue:  # Back of the line for fairness.
+                    self._queues[key] = queue
+                self._size -= 1
+                return item, None
+            if wait is not None and (timeout is None or wait < timeout):
+                timeout = wait
+        return None, timeout
@@ -0,0 +1,183 @@
+import time
+from collections import OrderedDict, deque
+from threading import Lock
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class Circuit:
+    __slots__ = ('outcomes', 'latencies', 'state', 'opened_at', 'trial_at',
+                 'n_opened')
+
+    def __init__(self, window):
+        """
+        The rolling outcomes (and latencies) of one proxy, or one
+        (proxy, domain) pair, and its circuit breaker state.
+        """
+        self.outcomes = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = 0
+        self.trial_at = 0
+        self.n_opened = 0
+
+    def success_rate(self):
+        if not self.outcomes:
+            return 1.0
+        return sum(self.outcomes) / len(self.outcomes)
+
+    def percentile(self, q):
+        """
+        :return: the q-th (0 to 1) percentile latency, or None
+        """
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+class ProxyHealth:
+    def __init__(self, window=50, min_samples=5, max_failure_rate=0.5,
+                 open_for=60, max_open_for=900, max_circuits=10000):
+        """
+        Track rolling success rates and latencies per proxy and per
+        (proxy, domain), with a circuit breaker on each.
+
+        A circuit opens once it has `min_samples` outcomes with a failure
+        rate of at least `max_failure_rate`. An open circuit rejects the
+        proxy for `open_for` seconds (doubling each time it reopens, up to
+        `max_open_for`), then half-opens to let one trial request
+        through: a success closes it, a failure reopens it. (If the trial
+        never reports back within `open_for`, another one is let
+        through.)
+
+        :param window: the number of recent outcomes kept per circuit
+        :param min_samples: the fewest outcomes before a circuit can open
+        :param max_failure_rate: the failure rate that opens a circuit
+        :param open_for: the seconds a circuit first stays open
+        :param max_open_for: the most seconds a circuit stays open
+        :param max_circuits: the most circuits held at once (those least
+            recently recorded to are dropped)
+        """
+        self._lock = Lock()
+        self._window = window
+        self._min_samples = min_samples
+        self._max_failure_rate = max_failure_rate
+        self._open_for = open_for
+        self._max_open_for = max_open_for
+        self._max_circuits = max_circuits
+        self._circuits = OrderedDict()
+
+    def record(self, proxy, domain, ok, latency=None):
+        """
+        Record the outcome of a request through a proxy.
+
+        :param proxy: the proxy url
+        :param domain: the domain requested
+        :param ok: True if the proxy delivered a valid response
+        :param latency: the response time (in seconds), if any
+        """
+        now = time.time()
+        with self._lock:
+            for key in (proxy, (proxy, domain)):
+                circuit = self._circuit(key)
+                circuit.outcomes.append(bool(ok))
+                if latency is not None:
+                    circuit.latencies.append(latency)
+                self._update(circuit, ok, now)
+
+    def allows(self, proxy, domain):
+        """
+        :return: False if the proxy's circuit, or its circuit for this
+            domain, is open. A half-open circuit allows one trial.
+        """
+        now = time.time()
+        with self._lock:
+            circuits = [self._circuits.get(key)
+                        for key in (proxy, (proxy, domain))]
+            circuits = [c for c in circuits if c is not None]
+            if not all(self._ready(c, now) for c in circuits):
+                return False
+            for circuit in circuits:
+                if circuit.state != CLOSED:
+                    circuit.state = HALF_OPEN
+                    circuit.trial_at = now
+            return True
+
+    def excluded(self, domain=None):
+        """
+        :return: the set of proxies whose circuit is open (overall or, if
+            given, for this domain)
+        """
+        now = time.time()
+        with self._lock:
+            items = list(self._circuits.items())
+        return {key if isinstance(key, str) else key[0]
+                for key, circuit in items
+                if circuit.state == OPEN and
+                now - circuit.opened_at < self._cooldown(circuit) and
+                (isinstance(key, str) or key[1] == domain)}
+
+    def success_rate(self, proxy, domain=None):
+        key = proxy if domain is None else (proxy, domain)
+        with self._lock:
+            circuit = self._circuits.get(key)
+            return 1.0 if circuit is None else circuit.success_rate()
+
+    def percentile(self, proxy, q, domain=None):
+        """
+        :return: the q-th (0 to 1) percentile latency through the proxy
+            (for the domain, if given), or None
+        """
+        key = proxy if domain is None else (proxy, domain)
+        with self._lock:
+            circuit = self._circuits.get(key)
+            return None if circuit is None else circuit.percentile(q)
+
+    def stats(self):
+        with self._lock:
+            circuits = list(self._circuits.values())
+        return {'n_circuits': len(circuits),
+                'n_open': sum(c.state == OPEN for c in circuits),
+                'n_half_open': sum(c.state == HALF_OPEN for c in circuits),
+                'n_opened': sum(c.n_opened for c in circuits)}
+
+    def _circuit(self, key):
+        circuit = self._circuits.get(key)
+        if circuit is None:
+            circuit = self._circuits[key] = Circuit(self._window)
+            while len(self._circuits) > self._max_circuits:
+                self._circuits.popitem(last=False)
+        else:
+            self._circuits.move_to_end(key)
+        return circuit
+
+    def _cooldown(self, circuit):
+        return min(self._max_open_for,
+                   self._open_for * 2 ** max(0, circuit.n_opened - 1))
+
+    def _ready(self, circuit, now):
+        if circuit.state == HALF_OPEN:  # Unless the trial seems lost
+            return now - circuit.trial_at >= self._open_for
+        if circuit.state == OPEN:
+            return now - circuit.opened_at >= self._cooldown(circuit)
+        return True
+
+    def _update(self, circuit, ok, now):
+        if circuit.state == HALF_OPEN:
+            if ok:
+                circuit.state = CLOSED
+                circuit.outcomes.clear()
+                circuit.outcomes.append(True)
+            else:
+                self._open(circuit, now)
+        elif (circuit.state == CLOSED and
+              len(circuit.outcomes) >= self._min_samples and
+              1 - circuit.success_rate() >= self._max_failure_rate):
+            self._open(circuit, now)
+
+    @staticmethod
+    def _open(circuit, now):
+        circuit.state = OPEN
+        circuit.opened_at = now
+        circuit.n_opened += 1
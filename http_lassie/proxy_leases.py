@@ -0,0 +1,228 @@
+import logging
+import time
+from collections import defaultdict
+from threading import Lock, Thread
+from six.moves.queue import Queue, Empty
+from six.moves.urllib.parse import urlparse
+
+
+def normalize_proxy(proxy):
+    """
+    :return: the proxy url with its scheme lowercased (mimic hands out
+        e.g. `HTTP://...`) and any credentials left as they are, or None
+        if there is no proxy
+    """
+    if not proxy:
+        return None
+    parsed = urlparse(proxy)
+    return parsed._replace(scheme=parsed.scheme.lower()).geturl()
+
+
+def lease_key(request_url, requirements, render_js):
+    """
+    :return: the key under which proxies for this request are leased
+    """
+    return (urlparse(request_url).netloc.lower(),
+            tuple(sorted(requirements or ())),
+            bool(render_js))
+
+
+class ProxyLease:
+    __slots__ = ('key', 'resource', 'acquired_at', 'uses', 'resp_times',
+                 'is_failure')
+
+    def __init__(self, key, resource):
+        self.key = key
+        self.resource = resource
+        self.acquired_at = time.time()
+        self.uses = 0
+        self.resp_times = []
+        self.is_failure = False
+
+    def mean_resp_time(self):
+        # None if the lease was never timed (e.g. handed back unused)
+        if not self.resp_times:
+            return None
+        return sum(self.resp_times) / len(self.resp_times)
+
+
+class ProxyLeaseCache:
+    def __init__(self, release_func, ttl=0, max_uses=1,
+                 release_interval=None):
+        """
+        Hold on to acquired proxies so repeated requests to the same domain
+        (with the same requirements) don't each cost a mimic round trip.
+
+        A lease is exclusive: it is handed to one request at a time. It is
+        returned to mimic once it has been used `max_uses` times, is older
+        than `ttl` seconds, or has failed.
+
+        :param release_func: a function with the signature of
+            f(proxy_resource, resp_time, is_failure) that reports the
+            proxy back to mimic
+        :param ttl: the maximum age of a lease in seconds
+        :param max_uses: the maximum number of requests per lease
+        :param release_interval: if None, releases happen inline.
+            Otherwise, they are queued and reported by a background thread
+            (still one call per lease: mimic has no batch release), which
+            also retires idle leases, waking at least this often (in
+            seconds).
+        """
+        self._release_func = release_func
+        self._ttl = ttl
+        self._max_uses = max(1, max_uses)
+        self._release_interval = release_interval
+
+        self._lock = Lock()
+        self._idle = defaultdict(list)
+        self._n_acquired = 0
+        self._n_reused = 0
+        self._n_released = 0
+
+        self._release_queue = None
+        self._releaser = None
+        if release_interval is not None:
+            self._release_queue = Queue()
+            self._releaser = Thread(target=self._release_loop, daemon=True)
+            self._releaser.start()
+
+    def acquire(self, key, acquire_func):
+        """
+        :param key: the lease key (see `lease_key`)
+        :param acquire_func: a zero-argument function that gets a new
+            proxy resource from mimic
+        :return: a `ProxyLease`
+        """
+        now = time.time()
+        expired = []
+        lease = None
+
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                candidate = idle.pop()
+                if self._is_expired(candidate, now):
+                    expired.append(candidate)
+                else:
+                    lease = candidate
+                    self._n_reused += 1
+                    break
+
+        for old in expired:
+            self._retire(old)
+
+        if lease is None:
+            lease = ProxyLease(key, acquire_func())
+            with self._lock:
+                self._n_acquired += 1
+
+        lease.uses += 1
+        return lease
+
+    def release(self, lease, resp_time=None, is_failure=False,
+                retire=False):
+        """
+        Hand a lease back after a request.
+
+        :param lease: the lease from `acquire`
+        :param resp_time: the response time for this use, or None if it
+            wasn't timed
+        :param is_failure: True if the proxy's response was invalid
+        :param retire: if True, return the proxy to mimic even if the
+            lease could be reused (e.g. it doesn't suit this request)
+        """
+        if resp_time is not None and resp_time >= 0:
+            lease.resp_times.append(resp_time)
+        lease.is_failure = is_failure
+
+        if (is_failure or retire or lease.uses >= self._max_uses or
+                self._is_expired(lease, time.time())):
+            self._retire(lease)
+        else:
+            with self._lock:
+                self._idle[lease.key].append(lease)
+
+    def flush(self):
+        """
+        Retire every idle lease and report all pending releases.
+        """
+        with self._lock:
+            leases = [lease for idle in self._idle.values() for lease in idle]
+            self._idle.clear()
+
+        for lease in leases:
+            self._retire(lease)
+
+        if self._release_queue is not None:
+            self._release_queue.join()
+
+    def close(self):
+        """
+        Flush, then stop the background releaser (if any).
+        """
+        self.flush()
+        if self._releaser is not None:
+            self._release_queue.put(None)
+            self._releaser.join()
+            self._releaser = None
+
+    def stats(self):
+        with self._lock:
+            return {'n_acquired': self._n_acquired,
+                    'n_reused': self._n_reused,
+                    'n_released': self._n_released,
+                    'n_idle': sum(len(idle) for idle in self._idle.values())}
+
+    def _is_expired(self, lease, now):
+        return (lease.uses >= self._max_uses or
+                now - lease.acquired_at >= self._ttl)
+
+    def _retire(self, lease):
+        if self._release_queue is not None:
+            self._release_queue.put(lease)
+        else:
+            self._report(lease)
+
+    def _report(self, lease):
+        with self._lock:
+            self._n_released += 1
+        self._release_func(lease.resource, lease.mean_resp_time(),
+                           lease.is_failure)
+
+    def _sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = []
+            for key, idle in self._idle.items():
+                expired.extend(lease for lease in idle
+                               if self._is_expired(lease, now))
+                idle[:] = [lease for lease in idle
+                           if not self._is_expired(lease, now)]
+        for lease in expired:
+            self._release_queue.put(lease)
+
+    def _release_loop(self):
+        last_sweep = time.time()
+
+        while True:
+            try:
+                lease = self._release_queue.get(
+                    timeout=self._release_interval)
+            except Empty:
+                lease = False
+
+            if lease is None:  # Kill sentinel
+                self._release_queue.task_done()
+                break
+
+            if lease:
+                try:
+                    self._report(lease)
+                except Exception:
+                    logging.exception("Failed to release a proxy lease")
+                finally:
+                    self._release_queue.task_done()
+
+            if time.time() - last_sweep >= self._release_interval:
+                self._sweep()
+                last_sweep = time.time()
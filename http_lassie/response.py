@@ -0,0 +1,34 @@
+import json
+from requests.structures import CaseInsensitiveDict
+
+
+class BufferedResponse:
+    """
+    A fully-read response with the subset of the `requests.Response`
+    interface that extractors and validators rely upon.
+
+    This lets the same extractor (e.g. `content_extractor` or
+    `json_extractor`) run against responses that did not come from
+    `requests` (aiohttp, a cache, etc.).
+    """
+
+    def __init__(self, status_code, content, headers=None, url=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.url = url
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size=1):
+        size = chunk_size or len(self.content) or 1
+        for i in range(0, len(self.content), size):
+            yield self.content[i:i + size]
+
+    def __repr__(self):
+        return "<BufferedResponse [{}]>".format(self.status_code)
@@ -0,0 +1,73 @@
+import mmap
+import tempfile
+from threading import Lock
+from six.moves.queue import Queue
+
+
+def spill(data, directory=None):
+    """
+    Copy bytes out of the heap into a memory-mapped (unlinked) temporary
+    file.
+
+    :param data: a non-empty bytes-like object
+    :param directory: where to create the file (e.g. `/dev/shm` for
+        shared memory). If None, the default temporary directory.
+    :return: a read-only memoryview of the mapping. The file is unmapped
+        once the last view of it is released.
+    """
+    with tempfile.TemporaryFile(dir=directory) as fp:
+        fp.write(data)
+        fp.flush()
+        mapped = mmap.mmap(fp.fileno(), len(data), access=mmap.ACCESS_READ)
+    return memoryview(mapped)
+
+
+class ResultChannel(Queue):
+    def __init__(self, maxsize=0, spill_threshold=None, spill_dir=None):
+        """
+        The queue results travel through from workers to a consumer.
+
+        With a `maxsize`, workers block once that many results are
+        waiting, so a consumer that lags behind slows the producers down
+        instead of letting results pile up in memory.
+
+        With a `spill_threshold`, byte payloads at least that large (the
+        result itself, or an element of a tuple result such as
+        `SmartFetcher`'s (content, success)) are handed over as a
+        memoryview of a memory-mapped file (see `spill`). Their pages are
+        then the OS's to evict and reread, not part of the heap.
+
+        :param maxsize: the most results waiting at once (0 for no limit)
+        :param spill_threshold: if not None, spill payloads of this many
+            bytes or more
+        :param spill_dir: the directory spilled payloads go to
+        """
+        super().__init__(maxsize)
+        self._spill_threshold = spill_threshold
+        self._spill_dir = spill_dir
+        self._stats_lock = Lock()
+        self._n_spilled = 0
+        self._bytes_spilled = 0
+
+    def put(self, item, block=True, timeout=None):
+        if self._spill_threshold is not None:
+            item = self._spill(item)
+        super().put(item, block, timeout)
+
+    def _spill(self, value):
+        if type(value) is tuple:
+            return tuple(self._spill(element) for element in value)
+        if (isinstance(value, (bytes, bytearray)) and value and
+                len(value) >= self._spill_threshold):
+            view = spill(value, self._spill_dir)
+            with self._stats_lock:
+                self._n_spilled += 1
+                self._bytes_spilled += len(value)
+            return view
+        return value
+
+    def stats(self):
+        with self._stats_lock:
+            return {'n_waiting': self.qsize(),
+                    'n_spilled': self._n_spilled,
+                    'bytes_spilled': self._bytes_spilled}
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+from threading import Lock
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def make_session(pool_maxsize=10, store_cookies=True):
+    """
+    Create a keep-alive `requests.Session`.
+
+    :param pool_maxsize: the number of connections kept alive per host
+        (raise this when many threads share the session)
+    :param store_cookies: if False, the session never keeps cookies
+        (pass them per request instead, e.g. from an `Identity`)
+    :return: a new session
+    """
+    session = requests.Session()
+    if not store_cookies:
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=pool_maxsize,
+                          pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class SessionPool:
+    def __init__(self, max_sessions=32, session_factory=make_session):
+        """
+        A bounded, thread-safe pool of sessions keyed by some value
+        (e.g. the proxy they route through).
+
+        When the pool is full, the least recently used session is
+        evicted. It is closed right away unless it is borrowed (see
+        `acquire`), in which case it is closed once the last borrower
+        `release`s it.
+
+        :param max_sessions: the maximum number of live sessions
+        :param session_factory: a zero-argument callable returning a new
+            session
+        """
+        if max_sessions < 1:
+            raise ValueError("max_sessions must be positive")
+
+        self._lock = Lock()
+        self._max_sessions = max_sessions
+        self._session_factory = session_factory
+        self._sessions = OrderedDict()
+        self._borrowers = {}  # id(session) -> number of borrowers
+        self._retiring = {}  # id(session) -> session, closed on release
+        self._evictions = 0
+
+    def get(self, key):
+        """
+        :param key: the key for the session (e.g. a proxy url)
+        :return: the session for that key, creating it if necessary
+        """
+        with self._lock:
+            session, evicted = self._get(key)
+        if evicted is not None:
+            evicted.close()
+        return session
+
+    def acquire(self, key):
+        """
+        Like `get`, but borrow the session: it isn't closed (if evicted
+        meanwhile) until it is `release`d.
+        """
+        with self._lock:
+            session, evicted = self._get(key)
+            self._borrowers[id(session)] = (
+                self._borrowers.get(id(session), 0) + 1)
+        if evicted is not None:
+            evicted.close()
+        return session
+
+    def release(self, session):
+        """
+        Give back a session borrowed with `acquire`.
+        """
+        retired = None
+        with self._lock:
+            n_borrowers = self._borrowers.pop(id(session)) - 1
+            if n_borrowers > 0:
+                self._borrowers[id(session)] = n_borrowers
+            else:
+                retired = self._retiring.pop(id(session), None)
+        if retired is not None:
+            retired.close()
+
+    def discard(self, key):
+        """
+        Close (once no longer borrowed) and drop the session for this
+        key, if any.
+        """
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                session = self._retire(session)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        """
+        Close every session in the pool (those still borrowed, once their
+        last borrower `release`s them).
+        """
+        with self._lock:
+            sessions = [self._retire(session)
+                        for session in self._sessions.values()]
+            self._sessions.clear()
+        for session in sessions:
+            if session is not None:
+                session.close()
+
+    def _get(self, key):
+        # :return: (the session, a session to close or None)
+        # The caller holds the lock.
+        session = self._sessions.get(key)
+        if session is not None:
+            self._sessions.move_to_end(key)
+            return session, None
+
+        session = self._session_factory()
+        self._sessions[key] = session
+        if len(self._sessions) > self._max_sessions:
+            _, evicted = self._sessions.popitem(last=False)
+            self._evictions += 1
+            return session, self._retire(evicted)
+        return session, None
+
+    def _retire(self, session):
+        # :return: the session if it can be closed now, or None if that
+        #     is left to its last borrower.
+        # The caller holds the lock.
+        if id(session) in self._borrowers:
+            self._retiring[id(session)] = session
+            return None
+        return session
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, key):
+        return key in self._sessions
+
+    def stats(self):
+        with self._lock:
+            return {'n_sessions': len(self._sessions),
+                    'max_sessions': self._max_sessions,
+                    'n_evictions': self._evictions}
@@ -0,0 +1,211 @@
+import heapq
+import itertools
+import multiprocessing
+import sys
+import time
+from threading import Thread, Lock
+from six.moves.queue import Queue, Empty
+from http_lassie.smart_fetcher import format_exception
+from http_lassie.worker_pool import echo_error
+
+_RESULT, _SUBMIT, _FINISHED, _WAKE_ROUTER, _STOP = range(5)
+_WAKE = object()
+
+
+def _shard_main(task_func, error_func, n_workers, inbox, outbox):
+    def submit(item, delay=0):
+        if item is None:
+            raise ValueError("Can't submit a `None`. It's the kill sentinel")
+        outbox.put((_SUBMIT, item, delay))
+
+    def work():
+        while True:
+            item = inbox.get()
+            if item is None:  # Kill sentinel
+                break
+
+            try:
+                outbox.put((_RESULT, task_func(item, submit), 0))
+            except Exception as e:
+                try:
+                    error_func(item, e, submit)
+                except Exception:
+                    print(format_exception("[_work]", 0, sys.exc_info()))
+            finally:
+                outbox.put((_FINISHED, None, 0))
+
+    workers = [Thread(target=work) for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+class ShardedWorkerPool:
+    def __init__(self, task_func, error_func=echo_error, n_shards=None,
+                 n_workers=5, key_func=None, auto_stop=True,
+                 start_method='spawn'):
+        """
+        Create a worker pool that shards items across processes, each
+        running its own pool of threads. Use this when tasks are CPU-bound
+        (e.g. heavy extractors) and the GIL caps a `WorkerPool`.
+
+        Items with the same key always go to the same process, so
+        per-key state (e.g. per-domain) stays local to it. The task_func,
+        error_func, items and results must be picklable.
+
+        :param task_func: a function with the signature of f(item, submit),
+            where submit resubmits an item to this pool (it is routed by
+            key, so it may run on another shard)
+        :param error_func: a function with the signature of
+            f(item, exception, submit) that gets called on any exception
+            not handled by the task_func
+        :param n_shards: the number of processes (defaults to cpu count)
+        :param n_workers: the number of threads per process
+        :param key_func: a function mapping an item to its routing key
+            (e.g. its domain). If None, items are spread round-robin.
+        :param auto_stop: if True, stop every process when there are no
+            items left to process or items still in processing
+        :param start_method: the multiprocessing start method. Defaults
+            to 'spawn', since forking a process that runs threads (as
+            the caller's fetchers often do) can deadlock the child on a
+            lock held at fork time. None uses the platform default.
+        """
+        context = multiprocessing.get_context(start_method)
+        n_shards = n_shards or multiprocessing.cpu_count()
+
+        self._lock = Lock()
+        self._key_func = key_func
+        self._auto_stop = auto_stop
+        self._n_workers = n_workers
+        self._round_robin = itertools.count()
+
+        self._submitted = 0
+        self._finished = 0
+        self._done_queue = Queue()
+        self._deferred = []
+        self._deferred_ids = itertools.count()
+
+        self._outbox = context.Queue()
+        self._inboxes = [context.Queue() for _ in range(n_shards)]
+        self._shards = [context.Process(target=_shard_main,
+                                        args=(task_func, error_func,
+                                              n_workers, inbox,
+                                              self._outbox),
+                                        daemon=True)
+                        for inbox in self._inboxes]
+        self._router = Thread(target=self._route, daemon=True)
+
+    def start(self):
+        """
+        Start each process and begin processing.
+        """
+        for shard in self._shards:
+            shard.start()
+        self._router.start()
+
+    def stop(self):
+        """
+        Send each thread of each process the kill sentinel and wait for
+        them to die.
+        """
+        for inbox in self._inboxes:
+            for _ in range(self._n_workers):
+                inbox.put(None)
+
+        for shard in self._shards:
+            shard.join()
+
+        if self._router.is_alive():
+            self._outbox.put((_STOP, None, 0))
+            self._router.join()
+
+    def submit(self, item, delay=0):
+        """
+        Submit some item for processing.
+
+        :param item: the item
+        :param delay: if positive, hold the item back for this many seconds
+        """
+        if item is None:
+            raise ValueError("Can't submit a `None`. It's the kill sentinel")
+
+        with self._lock:
+            self._submitted += 1
+            if delay > 0:
+                entry = (time.time() + delay, next(self._deferred_ids), item)
+                heapq.heappush(self._deferred, entry)
+                # Wake the router so it recomputes its timeout.
+                self._outbox.put((_WAKE_ROUTER, None, 0))
+                return
+        self._dispatch(item)
+
+    def gather(self):
+        """
+        Yields results as they are streamed back from the shards,
+        otherwise blocks.
+
+        If auto_stop is True, this will automatically call stop when there
+        is nothing left to process.
+        """
+        while not self.is_done() or not self._done_queue.empty():
+            result = self._done_queue.get()
+            if result is not _WAKE:
+                yield result
+
+        if self._auto_stop:
+            self.stop()
+
+    def is_done(self):
+        with self._lock:
+            return self._submitted == self._finished and not self._deferred
+
+    def stats(self):
+        with self._lock:
+            return {'n_submitted': self._submitted,
+                    'n_finished': self._finished,
+                    'n_deferred': len(self._deferred),
+                    'living_processes': sum(p.is_alive()
+                                            for p in self._shards)}
+
+    def _shard_for(self, item):
+        if self._key_func is None:
+            return next(self._round_robin) % len(self._inboxes)
+        return hash(self._key_func(item)) % len(self._inboxes)
+
+    def _dispatch(self, item):
+        self._inboxes[self._shard_for(item)].put(item)
+
+    def _route(self):
+        while True:
+            with self._lock:
+                timeout = None
+                if self._deferred:
+                    timeout = max(0, self._deferred[0][0] - time.time())
+
+            try:
+                kind, value, delay = self._outbox.get(timeout=timeout)
+            except Empty:
+                kind = None
+
+            if kind == _STOP:
+                break
+            elif kind == _RESULT:
+                self._done_queue.put(value)
+            elif kind == _SUBMIT:
+                self.submit(value, delay)
+            elif kind == _FINISHED:
+                with self._lock:
+                    self._finished += 1
+                if self.is_done():
+                    self._done_queue.put(_WAKE)
+
+            self._release_due()
+
+    def _release_due(self):
+        now, due = time.time(), []
+        with self._lock:
+            while self._deferred and self._deferred[0][0] <= now:
+                due.append(heapq.heappop(self._deferred)[2])
+        for item in due:
+            self._dispatch(item)
@@ -1,7 +1,25 @@
+import heapq
+import itertools
 import json
+import logging
 import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import partial
+from threading import Condition, Event, Lock, Thread
 import requests
 import sys
+from http_lassie.backoff import BackoffScheduler, DomainBackoff
+from http_lassie.cache import CACHEABLE_METHODS, request_key
+from http_lassie.coalesce import SingleFlight, flight_key
+from http_lassie.metrics import proxy_label
+from http_lassie.politeness import domain_of
+from http_lassie.proxy_leases import (ProxyLeaseCache, lease_key,
+                                      normalize_proxy)
+from http_lassie.session_pool import SessionPool, make_session
+from http_lassie.splash import render_batch
+from http_lassie.streaming import ResponseTooLarge, read_head
 from http_lassie.user_agents import random_user_agent
 from six.moves.urllib.parse import urlencode
 
@@ -24,19 +42,24 @@ class FailingStatusCode(Exception):
     def __str__(self):
         try:
             if self.resp_content.startswith(b"{"):
-                json_body = json.loads(self.resp_content.decode())
-                err_doc = json.dumps(json_body, indent='    ')
-                lines = err_doc.splitlines()
-                return (lines[0] + "\n" +
-                        "\n".join(self.indent + line for line in lines[1:]))
-            else:
-                return ("status code: {}\n".format(self.status_code) +
-                        self.indent + "{}".format(self.resp_content))
+                try:
+                    json_body = json.loads(self.resp_content.decode())
+                except ValueError:  # e.g. truncated (see `read_head`)
+                    json_body = None
+                if json_body is not None:
+                    err_doc = json.dumps(json_body, indent='    ')
+                    lines = err_doc.splitlines()
+                    return (lines[0] + "\n" +
+                            "\n".join(self.indent + line
+                                      for line in lines[1:]))
+            return ("status code: {}\n".format(self.status_code) +
+                    self.indent + "{}".format(self.resp_content))
         except Exception as e:
             return "ERROR PRINTING ERROR on {}".format(e)
 
 
-def get_proxy(mimic_server, request_url, requirements, max_wait_time=60):
+def get_proxy(mimic_server, request_url, requirements, max_wait_time=60,
+              session=None):
     """
     Get a proxy from your mimic (proxy broker) server.
 
@@ -46,41 +69,48 @@ def get_proxy(mimic_server, request_url, requirements, max_wait_time=60):
     :param requirements: the requirements for the proxy (e.g. anonymous)
     :param max_wait_time: the maximum time you are willing to wait for a
         response before a timeout
+    :param session: an optional (keep-alive) `requests.Session` to post with
     :return: a proxy resource
     """
     params = {'url': request_url, 'max_wait_time': max_wait_time}
     if requirements:
         params['requirements'] = ",".join(requirements)
 
-    resp = requests.post(mimic_server + "/proxies/acquire", data=params)
+    resp = (session or requests).post(mimic_server + "/proxies/acquire",
+                                      data=params)
     assert resp.status_code == 200, resp.content
     return resp.json()
 
 
-def release_proxy(mimic_server, proxy_resource, resp_time=-1,
-                  is_failure=False):
+def release_proxy(mimic_server, proxy_resource, resp_time=None,
+                  is_failure=False, session=None):
     """
     Release this proxy for use again on mimic.
 
     :param mimic_server: a URL like `http://192.168.99.100:8901`
     :param proxy_resource: the used proxy resource (returned from `get_proxy`)
     :param resp_time: the total time it took for this response
-        (used for weighting which proxies to use in the future)
+        (used for weighting which proxies to use in the future), or None
+        if nothing was timed (e.g. the proxy was handed back unused)
     :param is_failure: True if the content returned by this proxy was invalid
         (e.g. if their is now a captcha code)
+    :param session: an optional (keep-alive) `requests.Session` to post with
     """
-    params = proxy_resource
+    params = dict(proxy_resource)
 
     if is_failure:
         params['is_failure'] = 'true'
 
-    if resp_time >= 0:
+    if resp_time is None:
+        pass  # Nothing was timed, so there is nothing to report
+    elif resp_time >= 0:
         # Must be positive! XXX: BUG
         params['response_time'] = resp_time
     else:
         print("RESP TIME: {}".format(resp_time))
 
-    resp = requests.post(mimic_server + "/proxies/release", data=params)
+    resp = (session or requests).post(mimic_server + "/proxies/release",
+                                      data=params)
     assert resp.status_code == 200, resp.content
 
 
@@ -132,9 +162,136 @@ def always_true(_):
     return True
 
 
+def _request_args(request_url, request_params=None, request_data=None,
+                  http_method='GET', extractor=content_extractor,
+                  validator=always_true, render_js=False,
+                  splash_overrides=None, header_overrides=None, retries=3):
+    # :return: `SmartFetcher.__call__`'s arguments (with its defaults)
+    return (request_url, request_params, request_data, http_method,
+            extractor, validator, render_js, splash_overrides,
+            header_overrides, retries)
+
+
+class FetchResult:
+    __slots__ = ('index', 'request_url', 'content', 'ok', 'status',
+                 'attempts', 'proxy', 'resp_time', 'elapsed', 'error')
+
+    def __init__(self, index, request_url):
+        """
+        The outcome of one request of `SmartFetcher.fetch_many`.
+
+        Unpacks like `SmartFetcher.__call__`'s (content, success) tuple.
+
+        :param index: the request's position in the input
+        :param request_url: the requested url
+        """
+        self.index = index
+        self.request_url = request_url
+        self.content = None
+        self.ok = False
+        # The last attempt's status code ('error' if it got no response;
+        # None if no attempt was made).
+        self.status = None
+        self.attempts = 0
+        self.proxy = None  # The last attempt's proxy
+        self.resp_time = None  # The last response's time
+        self.elapsed = None  # The time for all attempts
+        self.error = None  # The last attempt's exception, if it raised
+
+    def record_attempt(self, lease, status, resp_time, errored):
+        self.proxy = lease.resource['proxy'] if lease is not None else None
+        self.status = status
+        self.resp_time = resp_time if status != 'error' else None
+        if not errored:
+            self.error = None
+
+    def __iter__(self):
+        return iter((self.content, self.ok))
+
+    def __repr__(self):
+        return "<FetchResult [{}] {} ok={}>".format(self.status,
+                                                   self.request_url,
+                                                   self.ok)
+
+
+def _in_thread(func, *args):
+    # :return: a `Future` of func(*args), run in a new (daemon) thread
+    future = Future()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    Thread(target=run, daemon=True).start()
+    return future
+
+
+def _is_decisive(outcome):
+    # :return: True if an attempt's outcome needs no further attempts
+    _, is_failure, is_final, _ = outcome
+    return not is_failure or is_final
+
+
+class _Timers:
+    # Runs functions after a delay, all on one (daemon) thread started by
+    # the first `call_later`.
+
+    def __init__(self):
+        self._cond = Condition()
+        self._due = []
+        self._ids = itertools.count()
+        self._thread = None
+        self._closed = False
+
+    def call_later(self, delay, func):
+        # :return: an `Event` that, once set, keeps func from running
+        cancelled = Event()
+        with self._cond:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            heapq.heappush(self._due, (time.time() + delay, next(self._ids),
+                                       func, cancelled))
+            self._cond.notify()
+        return cancelled
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._due = []
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (
+                        not self._due or self._due[0][0] > time.time()):
+                    timeout = None
+                    if self._due:
+                        timeout = self._due[0][0] - time.time()
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                _, _, func, cancelled = heapq.heappop(self._due)
+            if not cancelled.is_set():
+                try:
+                    func()
+                except Exception:
+                    logging.exception("Failed to run a timer")
+
+
 class SmartFetcher:
     def __init__(self, mimic_server, splash_server, proxy_requirements=None,
-                 splash_config=None, max_wait_time=60):
+                 splash_config=None, max_wait_time=60, max_sessions=32,
+                 pool_maxsize=10, lease_ttl=None, lease_max_uses=10,
+                 release_interval=1.0, backoff=None, block_on_backoff=True,
+                 cache=None, coalesce=False, splash_tracker=None,
+                 max_reroutes=3, identities=None, metrics=None,
+                 health=None, hedge=None, transport=None,
+                 keep_cookies=False):
         """
 
         :param mimic_server: the url to your mimic (proxy broker) server
@@ -147,12 +304,116 @@ class SmartFetcher:
         :param splash_config: the configuration (parameters) used for
             fulfilling splash (JS-rendering) requests
         :param max_wait_time: the max time to wait before a timeout
+        :param max_sessions: the maximum number of keep-alive proxy
+            sessions held at once (least recently used are evicted)
+        :param pool_maxsize: the number of kept-alive connections per host
+            for the mimic and splash sessions (set this near the number
+            of threads sharing this fetcher)
+        :param lease_ttl: if not None, hold on to acquired proxies for up
+            to this many seconds and reuse them for later requests to the
+            same domain (with the same requirements and render_js)
+        :param lease_max_uses: the number of requests a leased proxy serves
+            before it is released back to mimic
+        :param release_interval: how often (in seconds) the background
+            thread that reports leased proxies back to mimic (one call
+            each, off the request path) wakes to retire idle leases
+        :param backoff: the `BackoffScheduler` that tracks which domains
+            mimic has run out of proxies for. If None, a default one.
+        :param block_on_backoff: if True (the default), a request for a
+            domain that is cooling down sleeps through the cooldown. If
+            False, it raises `DomainBackoff` right away, so the caller
+            (e.g. `WorkerPool` via `retry_on_backoff`) can go work on other
+            domains. (`fetch_many` never blocks.)
+        :param cache: an optional `ResponseCache`. Fresh hits skip proxy
+            acquisition entirely; stale entries are revalidated.
+        :param coalesce: if True, concurrent identical calls (same request,
+            extractor and validator) share one fetch and its result
+        :param splash_tracker: an optional `SplashProxyTracker`. JS
+            rendering then records which proxies work with splash for
+            each domain, and hands incompatible proxies straight back
+            to mimic.
+        :param max_reroutes: the most incompatible (or unhealthy) proxies
+            handed back per attempt before using whatever mimic gives us
+        :param identities: an optional `IdentityManager`. Each proxy then
+            presents the same user agent, headers and cookies every time
+            it comes back to a domain (instead of a new random user agent
+            per attempt), and the identity is dropped when the proxy
+            fails validation.
+        :param metrics: an optional `Metrics`, which then records per-phase
+            timings (acquire, ttfb, body, extract, validate, release) and
+            per-domain and per-proxy latencies, retries, bytes and the
+            fetches in flight
+        :param health: an optional `ProxyHealth`. Every attempt's outcome
+            is recorded to it, and proxies whose circuit is open (overall
+            or for the domain) are handed straight back to mimic, so
+            retries land on proxies likely to succeed.
+        :param hedge: an optional `HedgePolicy`. An attempt that is slower
+            than the policy's delay (a latency percentile for the domain)
+            is then raced against a second attempt through another proxy,
+            within the policy's budget. The first attempt runs in the
+            calling thread; only a hedge starts one. The first good result
+            wins, and the loser is abandoned as soon as it is next checked
+            (once its proxy is acquired or its response headers arrive: a
+            request already sent can't be interrupted, so a slow first
+            attempt still holds up the call until its headers arrive).
+            Both proxies are released to mimic with their own timings.
+        :param transport: the factory for the per-proxy sessions, with the
+            signature of `make_session` (the default, HTTP/1.1 via
+            `requests`). Pass `transport.make_http2_session` to multiplex
+            requests over HTTP/2 where the target supports it.
+        :param keep_cookies: if True (and without `identities`), each
+            proxy's keep-alive session keeps the cookies it is sent
+            across requests. By default every request starts without
+            cookies, as with a new session (cookies still carry through
+            its redirects).
         """
         self._mimic_server = mimic_server
         self._splash_server = splash_server
         self._proxy_requirements = proxy_requirements or []
         self._splash_config = splash_config or DEFAULT_SPLASH_CONFIG.copy()
         self._max_wait_time = max_wait_time
+        self._backoff = backoff or BackoffScheduler()
+        self._block_on_backoff = block_on_backoff
+        self._cache = cache
+        self._flights = SingleFlight() if coalesce else None
+        self._splash_tracker = splash_tracker
+        self._max_reroutes = max_reroutes
+        self._identities = identities
+        self._metrics = metrics
+        self._health = health
+        self._hedge = hedge
+        self._timers = _Timers()
+        self._in_flight_lock = Lock()
+        self._in_flight = 0
+        # With identities, cookies live in them, not the proxy sessions.
+        self._sessions = SessionPool(
+            max_sessions, partial(transport or make_session,
+                                  store_cookies=(keep_cookies and
+                                                 identities is None)))
+        self._mimic_session = make_session(pool_maxsize)
+        self._splash_session = make_session(pool_maxsize)
+
+        self._lease_ttl = lease_ttl
+        self._lease_max_uses = lease_max_uses
+        self._release_interval = release_interval
+        if lease_ttl is None:
+            self._leases = ProxyLeaseCache(self._release_proxy)
+        else:
+            self._leases = ProxyLeaseCache(self._release_proxy,
+                                           ttl=lease_ttl,
+                                           max_uses=lease_max_uses,
+                                           release_interval=release_interval)
+
+    def close(self):
+        """
+        Release every leased proxy, then close every keep-alive session
+        held by this fetcher.
+        """
+        self._leases.close()
+        self._timers.close()
+        self._sessions.close()
+        self._mimic_session.close()
+        self._splash_session.close()
 
     def __call__(self,
                  request_url,
@@ -172,7 +433,9 @@ class SmartFetcher:
         :param request_data: the data in your request (for a POST)
         :param http_method: the method to use ('GET' or 'POST')
         :param extractor: the function to call to extract content from the
-            response object.
+            response object. A `StreamingExtractor` reads the body as it
+            arrives (and can abandon it early) instead of buffering it;
+            its responses are not stored in the cache.
         :param validator: the function to call to validate the extracted
             content before returning
         :param render_js: if True, use splash to render the JS
@@ -180,71 +443,559 @@ class SmartFetcher:
             with the splash request
         :param retries: maximum number of retries before failing
         :return: a tuple of (content, success)
+        :raises DomainBackoff: if mimic has no proxies for this domain and
+            `block_on_backoff` is False
         """
+        args = (request_url, request_params, request_data, http_method,
+                extractor, validator, render_js, splash_overrides,
+                header_overrides, retries)
 
-        content, resp_time, is_failure = None, 60, True
+        fetch = self._fetch if self._metrics is None else self._fetch_counted
+        if self._flights is None:
+            return fetch(*args)
 
-        while is_failure and retries > 0:
-            proxy_resource, status_received = None, None
+        key = flight_key(http_method, request_url, request_params,
+                         request_data, render_js, extractor, validator,
+                         header_overrides, splash_overrides)
+        return self._flights.do(key, lambda: fetch(*args))
+
+    def fetch_many(self, requests, concurrency=8, ordered=False,
+                   lease_ttl=60, **kwargs):
+        """
+        Fetch many requests at once, `concurrency` at a time.
+
+        All requests share this fetcher's keep-alive sessions. Unless the
+        fetcher already leases proxies (see `lease_ttl` in the
+        constructor), the batch does: requests to a domain reuse proxies
+        instead of each acquiring one, and releases are reported to mimic
+        from the background. Errors are kept in the results rather than
+        printed. A request whose domain is cooling down doesn't hold up
+        a thread (whatever `block_on_backoff` is): it is set aside until
+        the cooldown ends (up to `retries` times).
 
+        :param requests: an iterable (consumed lazily) of urls, or of
+            dicts of `__call__` arguments (e.g. `{'request_url': url,
+            'render_js': True}`)
+        :param concurrency: the number of requests in flight
+        :param ordered: if True, yield results in the order of `requests`
+            (holding finished ones back until those before them are
+            done). If False, as they complete.
+        :param lease_ttl: the most seconds the batch holds on to a proxy
+        :param kwargs: the default `__call__` arguments of each request
+        :return: a generator of `FetchResult`
+        """
+        leases = self._leases
+        if self._lease_ttl is None:
+            leases = ProxyLeaseCache(self._release_proxy, ttl=lease_ttl,
+                                     max_uses=self._lease_max_uses,
+                                     release_interval=self._release_interval)
+        fetch = self._fetch if self._metrics is None else self._fetch_counted
+
+        def task(item, submit):
+            index, spec, n_backoffs = item
+            args = _request_args(**{**kwargs, **spec})
+            result, start = FetchResult(index, args[0]), time.time()
             try:
-                proxy_resource = self._get_proxy_resource(request_url)
-                headers = self._common_headers(header_overrides)
-
-                f = self._via_splash if render_js else self._via_requests
-                start_time, resp = f(headers,
-                                     http_method,
-                                     request_url,
-                                     request_params,
-                                     request_data,
-                                     proxy_resource,
-                                     **(splash_overrides or {}))
-
-                resp_time = time.time() - start_time
+                result.content, result.ok = fetch(*args, leases=leases,
+                                                  result=result, block=False)
+            except DomainBackoff as e:
+                if n_backoffs < args[-1]:
+                    submit((index, spec, n_backoffs + 1),
+                           delay=e.retry_after)
+                    return None
+                result.error = e
+            except Exception as e:
+                result.error = e
+            result.elapsed = time.time() - start
+            return result
+
+        # Imported here, as worker_pool imports this module.
+        from http_lassie.worker_pool import WorkerPool
+        pool = WorkerPool(task, n_workers=concurrency)
+        specs = enumerate(requests)
+
+        def feed(n):
+            for index, spec in itertools.islice(specs, n):
+                if not isinstance(spec, dict):
+                    spec = {'request_url': spec}
+                pool.submit((index, spec, 0))
+
+        # Keep the input, and any out of order results, bounded.
+        feed(2 * concurrency)
+        pool.start()
+        held, next_index = {}, 0
+        try:
+            for result in pool.gather():
+                if result is None:  # Set aside for a cooldown
+                    continue
+                if not ordered:
+                    feed(1)
+                    yield result
+                    continue
+                held[result.index] = result
+                while next_index in held:
+                    feed(1)
+                    yield held.pop(next_index)
+                    next_index += 1
+        finally:
+            pool.stop()
+            if leases is not self._leases:
+                leases.close()
+
+    def _fetch_counted(self, *args, **kwargs):
+        self._count_in_flight(1)
+        try:
+            return self._fetch(*args, **kwargs)
+        finally:
+            self._count_in_flight(-1)
+
+    def _count_in_flight(self, delta):
+        with self._in_flight_lock:
+            self._in_flight += delta
+            self._metrics.set('fetches_in_flight', self._in_flight)
+
+    def _fetch(self, request_url, request_params, request_data, http_method,
+               extractor, validator, render_js, splash_overrides,
+               header_overrides, retries, leases=None, result=None,
+               block=None):
+        # :param leases: the `ProxyLeaseCache` to use, if not the default
+        # :param result: a `FetchResult` to record the attempts in
+        # :param block: overrides `block_on_backoff`, if not None
+        content, is_failure = None, True
+        cache_key, stale = None, None
+        domain, n_attempts = domain_of(request_url), 0
+
+        if (self._cache is not None and
+                http_method.upper() in CACHEABLE_METHODS):
+            cache_key = request_key(http_method, request_url,
+                                    request_params, request_data, render_js)
+            fresh, stale = self._cache.lookup(cache_key)
+            if fresh is not None:
+                # The entry may have been stored for another extractor:
+                # if this one can't use it, it's a miss.
+                try:
+                    content = extractor(fresh.to_response())
+                    hit = validator(content)
+                except Exception:
+                    content, hit = None, False
+                if hit:
+                    if result is not None:
+                        result.status = fresh.status_code
+                    return content, True
+                self._cache.invalidate(cache_key)
+            elif stale is not None:
+                header_overrides = {**stale.validators,
+                                    **(header_overrides or {})}
+
+        attempt = partial(self._attempt, request_url, request_params,
+                          request_data, http_method, extractor, validator,
+                          render_js, splash_overrides, header_overrides,
+                          cache_key, stale, leases=leases, result=result,
+                          block=block)
+        while is_failure and retries > 0:
+            if n_attempts and self._metrics is not None:
+                self._metrics.inc('retries_total', domain=domain)
+            n_attempts += 1
+            if result is not None:
+                result.attempts = n_attempts
+
+            if self._hedge is None:
+                outcome = attempt(retries)
+            else:
+                outcome = self._hedged(domain, partial(attempt, retries))
+            content, is_failure, is_final, errored = outcome
+            if errored:
+                retries -= 1
+            if is_final:
+                break
+
+        return content, not is_failure
+
+    def _attempt(self, request_url, request_params, request_data,
+                 http_method, extractor, validator, render_js,
+                 splash_overrides, header_overrides, cache_key, stale,
+                 retries, cancel=None, avoid=None, leases=None, result=None,
+                 block=None):
+        # :param cancel: an `Event` set when a hedged attempt has lost
+        # :param avoid: the proxies of a hedged request's other attempt
+        # :param leases: the `ProxyLeaseCache` to use, if not the default
+        # :param result: a `FetchResult` to record the attempt in (instead
+        #     of printing its errors)
+        # :param block: overrides `block_on_backoff`, if not None
+        # :return: (content, is_failure, is_final, errored)
+        content, resp_time, is_failure, is_final = None, 60, True, False
+        lease, status, resp, errored = None, 'error', None, False
+        session = None
+        leases = self._leases if leases is None else leases
+        domain = domain_of(request_url)
+        streamed = getattr(extractor, 'streaming', False) and not render_js
+        # Hedged attempts read the body only if they are still wanted.
+        lazy = streamed or (cancel is not None and not render_js)
+        if cancel is not None and cancel.is_set():
+            return content, is_failure, is_final, errored
+
+        try:
+            with self._phase('acquire', domain):
+                lease = self._acquire_lease(request_url, render_js, avoid,
+                                            leases, block)
+            proxy_resource = lease.resource
+            if avoid is not None:
+                avoid.add(proxy_resource['proxy'])
+            if cancel is not None and cancel.is_set():
+                # Lost while waiting on mimic: don't send the request.
+                status, resp_time = 'cancelled', None
+                return content, is_failure, is_final, errored
+            identity = self._identity(request_url, proxy_resource)
+            headers = self._common_headers(header_overrides, identity)
+
+            if render_js:
+                start_time, resp = self._via_splash(
+                    headers, http_method, request_url, request_params,
+                    request_data, proxy_resource,
+                    **(splash_overrides or {}))
+            else:
+                session = self._sessions.acquire(proxy_resource['proxy'])
+                start_time, resp = self._via_requests(
+                    session, headers, http_method, request_url,
+                    request_params, request_data, proxy_resource,
+                    identity=identity, stream=lazy)
+
+            resp_time = time.time() - start_time
+            status = resp.status_code
+            self._observe_response(domain, proxy_resource['proxy'],
+                                   resp_time, resp, lazy)
+            if cancel is not None and cancel.is_set():
+                status = 'cancelled'
+                return content, is_failure, is_final, errored
+            revalidated = resp.status_code == 304 and stale is not None
+            if revalidated:
+                resp = self._cache.revalidated(cache_key, stale, resp)
+            if resp.status_code not in (200, 404, 500):
+                # Only keep the head of the body (it may be huge).
+                raise FailingStatusCode(resp.status_code,
+                                        read_head(resp, streamed=lazy),
+                                        indent=' '*18)
+            with self._phase('extract', domain):
                 content = extractor(resp)
-                status_received = resp.status_code
 
-                if resp.status_code == 404 or resp.status_code == 500:
-                    is_failure = True
-                    release_proxy(self._mimic_server,
-                                  proxy_resource,
-                                  resp_time,
-                                  False)
-                    break
-                else:
-                    if resp.status_code != 200:
-                        raise FailingStatusCode(resp.status_code,
-                                                resp.content,
-                                                indent=' '*18)
+            if resp.status_code == 404 or resp.status_code == 500:
+                is_failure, is_final = True, True
+            else:
+                with self._phase('validate', domain):
                     is_failure = not validator(content)
-            except Exception as e:
-                is_failure = True
-                retries -= 1
+                if cache_key is not None and not (is_failure or
+                                                  revalidated or
+                                                  streamed):
+                    self._cache.store(cache_key, resp, http_method)
+        except DomainBackoff:
+            raise
+        except Exception as e:
+            # Too large through one proxy is too large through any.
+            is_failure, errored = True, True
+            is_final = isinstance(e, ResponseTooLarge)
+            if result is None:
                 print(format_exception(request_url,
-                                       retries,
+                                       retries - 1,
                                        sys.exc_info()) + "\n\n")
-                # TODO: Add better logging
-            finally:
-                # BUG BUG BUB
-                release_proxy(self._mimic_server, proxy_resource, resp_time,
-                              is_failure)
+            elif cancel is None or not cancel.is_set():
+                result.error = e
+            # TODO: Add better logging
+        finally:
+            if lazy and resp is not None:
+                # Free the connection (dropping it, if we aborted).
+                getattr(resp, 'close', lambda: None)()
+            if session is not None:
+                self._sessions.release(session)
+            if lease is not None:
+                # A 404/500 is the target's fault, not the proxy's (and a
+                # cancelled hedge's proxy did nothing wrong either).
+                proxy_failed = (is_failure and not is_final and
+                                status != 'cancelled')
+                if status != 'cancelled':
+                    self._record_outcome(lease, domain, render_js,
+                                         proxy_failed,
+                                         resp_time if status != 'error'
+                                         else None)
+                with self._phase('release', domain):
+                    leases.release(lease, resp_time, proxy_failed)
+            if self._metrics is not None:
+                self._metrics.inc('attempts_total', domain=domain,
+                                  status=status,
+                                  ok=str(not is_failure).lower())
+            if result is not None and status != 'cancelled' and (
+                    cancel is None or not cancel.is_set()):
+                result.record_attempt(lease, status, resp_time, errored)
 
-        return content, not is_failure
+        return content, is_failure, is_final, errored
+
+    def _record_outcome(self, lease, domain, render_js, proxy_failed,
+                        latency):
+        proxy = lease.resource['proxy']
+        if render_js and self._splash_tracker is not None:
+            self._splash_tracker.record(domain, proxy, not proxy_failed)
+        if self._health is not None:
+            self._health.record(proxy, domain, not proxy_failed, latency)
+        if proxy_failed and self._identities is not None:
+            self._identities.retire(proxy, domain)
+
+    def _hedged(self, domain, attempt):
+        # Run the attempt here and, if it's slower than the hedge delay
+        # (and the budget allows), start a second one through another
+        # proxy in a thread. The first good (or final) outcome wins and
+        # cancels the other, and only the winner's latency is recorded.
+        cancels, avoid, hedges = [Event(), Event()], set(), []
+        lock, finished = Lock(), Event()
+
+        def timed(cancel, rival):
+            start = time.time()
+            outcome = attempt(cancel, avoid)
+            if _is_decisive(outcome):
+                rival.set()
+            return outcome, time.time() - start
+
+        def launch():
+            with lock:
+                if finished.is_set() or not self._hedge.try_hedge():
+                    return
+                hedges.append(_in_thread(timed, cancels[1], cancels[0]))
+            if self._metrics is not None:
+                self._metrics.inc('hedges_total', domain=domain)
+
+        timer = self._timers.call_later(self._hedge.delay(domain), launch)
+        outcome, elapsed, backoff = None, None, None
+        try:
+            outcome, elapsed = timed(cancels[0], cancels[1])
+        except DomainBackoff as e:
+            backoff = e
+        finally:
+            timer.set()
+            with lock:
+                finished.set()
+
+        if hedges and (outcome is None or not _is_decisive(outcome)):
+            try:
+                hedged, hedged_elapsed = hedges[0].result()
+            except DomainBackoff as e:
+                backoff = e
+            else:
+                if outcome is None or _is_decisive(hedged):
+                    outcome, elapsed = hedged, hedged_elapsed
+                if _is_decisive(hedged) and self._metrics is not None:
+                    self._metrics.inc('hedge_wins_total', domain=domain)
+        cancels[1].set()
+
+        if outcome is None:
+            raise backoff
+        if _is_decisive(outcome):
+            self._hedge.record(domain, elapsed)
+        return outcome
+
+    def render_many(self, request_urls, extractor=content_extractor,
+                    validator=always_true, splash_overrides=None,
+                    header_overrides=None, retries=3, batch_size=5):
+        """
+        Render several urls with JS, several per splash request.
+
+        Urls are grouped by domain into batches of up to `batch_size`, and
+        each batch is rendered in one splash tab through one proxy. Urls
+        that fail in a batch are retried one at a time (via `__call__`).
+
+        Every url in a batch waits for JS within the one splash timeout,
+        so batches are capped at `timeout // wait` urls.
+
+        :param request_urls: the urls to render
+        :param batch_size: the most urls per splash request
+        :return: a list of (content, success) tuples, in the order of
+            request_urls. If a domain starts cooling down (a
+            `DomainBackoff`, when `block_on_backoff` is False), its urls
+            not yet rendered are left as None.
+        """
+        config = {**self._splash_config, **(splash_overrides or {})}
+        wait = config.get('wait', 10)
+        if wait > 0:
+            batch_size = max(1, min(batch_size,
+                                    int(config.get('timeout', 60) // wait)))
+
+        by_domain = OrderedDict()
+        for i, url in enumerate(request_urls):
+            by_domain.setdefault(domain_of(url), []).append(i)
+
+        results = [None] * len(request_urls)
+        retry = []
+        for indices in by_domain.values():
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start:start + batch_size]
+                try:
+                    outcomes = self._render_batch(
+                        [request_urls[i] for i in batch], extractor,
+                        validator, splash_overrides, header_overrides)
+                except DomainBackoff:
+                    break
+                for i, outcome in zip(batch, outcomes):
+                    results[i] = outcome
+                    if outcome is None:
+                        retry.append(i)
+
+        backing_off = set()
+        for i in sorted(retry):
+            domain = domain_of(request_urls[i])
+            if domain in backing_off:
+                continue
+            if retries <= 1:
+                results[i] = (None, False)
+                continue
+            try:
+                results[i] = self(request_urls[i],
+                                  extractor=extractor,
+                                  validator=validator,
+                                  render_js=True,
+                                  splash_overrides=splash_overrides,
+                                  header_overrides=header_overrides,
+                                  retries=retries - 1)
+            except DomainBackoff:
+                backing_off.add(domain)
+
+        return results
+
+    def _render_batch(self, request_urls, extractor, validator,
+                      splash_overrides, header_overrides):
+        # :return: a (content, success) per url, or None if it should retry
+        outcomes = [None] * len(request_urls)
+        lease, resp_time, proxy_failed = None, None, True
+
+        try:
+            lease = self._acquire_lease(request_urls[0], True)
+            config = {**self._splash_config, **(splash_overrides or {})}
+
+            start_time = time.time()
+            responses = render_batch(self._splash_session,
+                                     self._splash_server,
+                                     request_urls,
+                                     proxy=lease.resource['proxy'],
+                                     headers=self._common_headers(
+                                         header_overrides,
+                                         self._identity(request_urls[0],
+                                                        lease.resource)),
+                                     wait=config.get('wait', 10),
+                                     timeout=config.get('timeout', 60),
+                                     images=config.get('images', 0))
+            resp_time = (time.time() - start_time) / len(request_urls)
+
+            for i, resp in enumerate(responses):
+                content = extractor(resp)
+                if resp.status_code == 404 or resp.status_code == 500:
+                    outcomes[i] = (content, False)
+                elif resp.status_code == 200 and validator(content):
+                    outcomes[i] = (content, True)
+
+            proxy_failed = all(outcome is None for outcome in outcomes)
+        except DomainBackoff:
+            raise
+        except Exception:
+            print(format_exception(request_urls[0], 0,
+                                   sys.exc_info()) + "\n\n")
+        finally:
+            if lease is not None:
+                if self._splash_tracker is not None:
+                    self._splash_tracker.record(domain_of(request_urls[0]),
+                                                lease.resource['proxy'],
+                                                not proxy_failed)
+                if self._health is not None:
+                    self._health.record(lease.resource['proxy'],
+                                        domain_of(request_urls[0]),
+                                        not proxy_failed,
+                                        resp_time)
+                self._leases.release(lease, resp_time, proxy_failed)
+
+        return outcomes
+
+    def _acquire_lease(self, request_url, render_js, avoid=None,
+                       leases=None, block=None):
+        leases = self._leases if leases is None else leases
+        key = lease_key(request_url, self._proxy_requirements, render_js)
+        lease = leases.acquire(
+            key, lambda: self._get_proxy_resource(request_url, key, block))
+
+        domain = domain_of(request_url)
+        for _ in range(self._max_reroutes):
+            if (self._suits(lease.resource['proxy'], domain, render_js) and
+                    lease.resource['proxy'] not in (avoid or ())):
+                break
+            # Not a failure: the proxy may be fine, just not for this.
+            leases.release(lease, retire=True)
+            lease = leases.acquire(
+                key, lambda: self._get_proxy_resource(request_url, key, block))
+
+        return lease
+
+    def _suits(self, proxy, domain, render_js):
+        if (render_js and self._splash_tracker is not None and
+                not self._splash_tracker.is_compatible(domain, proxy)):
+            return False
+        return self._health is None or self._health.allows(proxy, domain)
+
+    def _get_proxy_resource(self, request_url, key, block=None):
+        wait = self._backoff.delay(key)
+        if wait > 0:
+            self._cool_down(key, wait, block)
 
-    def _get_proxy_resource(self, request_url):
         resource = get_proxy(self._mimic_server,
                              request_url,
                              self._proxy_requirements,
-                             max_wait_time=self._max_wait_time)
+                             max_wait_time=self._max_wait_time,
+                             session=self._mimic_session)
 
         if resource['proxy'] is None:
-            time.sleep(60)
+            self._cool_down(key, self._backoff.failure(key), block)
             raise Exception('No proxy found')
 
+        self._backoff.success(key)
         return resource
 
-    def _common_headers(self, header_overrides):
-        headers = {'User-Agent': random_user_agent()}
+    def _cool_down(self, key, delay, block=None):
+        if not (self._block_on_backoff if block is None else block):
+            raise DomainBackoff(key, delay)
+        time.sleep(delay)
+
+    def _release_proxy(self, proxy_resource, resp_time, is_failure):
+        release_proxy(self._mimic_server, proxy_resource, resp_time,
+                      is_failure, session=self._mimic_session)
+
+    @contextmanager
+    def _phase(self, phase, domain):
+        if self._metrics is None:
+            yield
+            return
+        with self._metrics.timer('phase_seconds', phase=phase,
+                                 domain=domain):
+            yield
+
+    def _observe_response(self, domain, proxy, resp_time, resp,
+                          streamed=False):
+        if self._metrics is None:
+            return
+        self._metrics.observe('request_seconds', resp_time, domain=domain)
+        self._metrics.observe('proxy_request_seconds', resp_time,
+                              proxy=proxy_label(proxy))
+        if not streamed:
+            self._metrics.inc('bytes_total', len(resp.content),
+                              domain=domain)
+        elif resp.headers.get('Content-Length', '').isdigit():
+            self._metrics.inc('bytes_total',
+                              int(resp.headers['Content-Length']),
+                              domain=domain)
+
+    def _identity(self, request_url, proxy_resource):
+        if self._identities is None:
+            return None
+        return self._identities.get(proxy_resource['proxy'],
+                                    domain_of(request_url))
+
+    def _common_headers(self, header_overrides, identity=None):
+        if identity is None:
+            headers = {'User-Agent': random_user_agent()}
+        else:
+            headers = dict(identity.headers)
         if header_overrides:
             headers.update(header_overrides)
         return headers
@@ -253,7 +1004,7 @@ class SmartFetcher:
                     request_data, proxy_resource, **splash_overrides):
         kwargs = {**self._splash_config,
                   **(splash_overrides or {})}
-        kwargs.update({'proxy': proxy_resource['proxy'].lower(),
+        kwargs.update({'proxy': normalize_proxy(proxy_resource['proxy']),
                        # 'timeout': self._max_wait_time,
                        #'wait': 10,  # Render wait time
                        'http_method': http_method,
@@ -269,14 +1020,15 @@ class SmartFetcher:
         kwargs['headers'] = headers
 
         start_time = time.time()
-        resp = requests.post(self._splash_server + '/render.html',
-                             data=json.dumps(kwargs),
-                             headers={"Content-Type": "application/json"})
+        resp = self._splash_session.post(
+            self._splash_server + '/render.html',
+            data=json.dumps(kwargs),
+            headers={"Content-Type": "application/json"})
         return start_time, resp
 
-    def _via_requests(self, headers, http_method, request_url,
+    def _via_requests(self, session, headers, http_method, request_url,
                       request_params, request_data, proxy_resource,
-                      **kwargs):
+                      identity=None, stream=False):
         kwargs = {'timeout': self._max_wait_time}
 
         if proxy_resource['proxy'].startswith('HTTPS'):
@@ -290,8 +1042,23 @@ class SmartFetcher:
             kwargs['data'] = request_data
 
         kwargs['headers'] = headers
+        if identity is not None:
+            kwargs['cookies'] = identity.cookies
 
         start_time = time.time()
-        resp = requests.request(http_method, request_url, **kwargs)
+        if self._metrics is None:
+            resp = session.request(http_method, request_url, stream=stream,
+                                   **kwargs)
+        else:
+            # Stream, to time the headers (TTFB) and body separately.
+            domain = domain_of(request_url)
+            with self._phase('ttfb', domain):
+                resp = session.request(http_method, request_url,
+                                       stream=True, **kwargs)
+            if not stream:
+                with self._phase('body', domain):
+                    resp.content
+        if identity is not None:
+            identity.update_cookies(resp)
 
         return start_time, resp
@@ -0,0 +1,268 @@
+import codecs
+import json
+import re
+
+# How much of an error body `FailingStatusCode` keeps.
+MAX_ERROR_BODY = 4096
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class AbortResponse(Exception):
+    def __init__(self, reason, head=b''):
+        """
+        Raised by a streaming extractor to stop reading a bad response
+        (the attempt then counts as a proxy failure and is retried).
+
+        :param reason: why the response was abandoned
+        :param head: the start of the body, for diagnostics
+        """
+        super().__init__(reason)
+        self.reason = reason
+        self.head = head
+
+
+# Unlike other aborts, a final failure: not retried, nor blamed on the
+# proxy (a body too large through one proxy is too large through any).
+class ResponseTooLarge(AbortResponse):
+    pass
+
+
+def read_head(resp, limit=MAX_ERROR_BODY, streamed=False):
+    """
+    :param resp: the response
+    :param limit: the most bytes to read
+    :param streamed: True if the body hasn't been read yet (only the
+        head is then read, not the rest)
+    :return: at most `limit` bytes from the start of the body
+    """
+    if not streamed:
+        return resp.content[:limit]
+    head = b''
+    for chunk in resp.iter_content(limit):
+        head += chunk
+        if len(head) >= limit:
+            break
+    return head[:limit]
+
+
+class StreamingExtractor:
+    # Tells `SmartFetcher` to stream the response rather than buffer it.
+    streaming = True
+
+    def __init__(self, max_bytes=None, reject_markers=(), sniff_bytes=1024,
+                 chunk_size=16 << 10):
+        """
+        An extractor that consumes the body incrementally, so a response
+        is never fully buffered unless the extraction needs it.
+
+        Subclasses override `start`, `feed` and `finish` (and keep the
+        per-response state in what `start` returns, so one instance can
+        serve many threads). The default collects the body as bytes,
+        like `content_extractor`.
+
+        :param max_bytes: if not None, abandon bodies larger than this
+            (checking Content-Length first)
+        :param reject_markers: byte strings (e.g. a captcha page's
+            marker) that abandon the response if found in the first
+            `sniff_bytes`
+        :param sniff_bytes: how much of the body to search for markers
+        :param chunk_size: the read size
+        """
+        self.max_bytes = max_bytes
+        self.reject_markers = tuple(reject_markers)
+        self.sniff_bytes = sniff_bytes
+        self.chunk_size = chunk_size
+
+    def __call__(self, resp):
+        length = resp.headers.get('Content-Length')
+        if (self.max_bytes is not None and length and length.isdigit() and
+                int(length) > self.max_bytes):
+            raise ResponseTooLarge(
+                "Content-Length {} > {}".format(length, self.max_bytes))
+
+        state = self.start(resp)
+        head, n_bytes = b'', 0
+        for chunk in resp.iter_content(self.chunk_size):
+            n_bytes += len(chunk)
+            if self.max_bytes is not None and n_bytes > self.max_bytes:
+                raise ResponseTooLarge(
+                    "Body > {} bytes".format(self.max_bytes), head)
+
+            if self.reject_markers and len(head) < self.sniff_bytes:
+                head += chunk[:self.sniff_bytes - len(head)]
+                for marker in self.reject_markers:
+                    if marker in head:
+                        raise AbortResponse(
+                            "Found {!r}".format(marker), head)
+
+            state = self.feed(state, chunk)
+        return self.finish(state)
+
+    def start(self, resp):
+        """
+        :return: the initial state for a response
+        """
+        return []
+
+    def feed(self, state, chunk):
+        """
+        :return: the state after consuming a chunk of the body
+        """
+        state.append(chunk)
+        return state
+
+    def finish(self, state):
+        """
+        :return: the extracted content
+        """
+        return b''.join(state)
+
+
+class _IncrementalJSON:
+    # Decodes a JSON document as it is fed. Each member of a top-level
+    # array or object is decoded (and its text dropped) as soon as it is
+    # complete; any other document is decoded at the end.
+
+    _CLOSE = {list: ']', dict: '}'}
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._retry_at = 0  # Don't parse again until the text is this long
+        self._doc = None  # The top-level list or dict
+        self._key = None
+        # first, member, key, colon, next (a comma or the close) or end
+        self._expect = 'first'
+
+    def feed(self, data, final=False):
+        self._buf += self._text.decode(data, final)
+        if final or len(self._buf) >= self._retry_at:
+            self._parse(final)
+
+    def close(self):
+        self.feed(b'', final=True)
+        if self._doc is None:
+            return json.loads(self._buf)
+        if self._expect != 'end':
+            raise self._error("Unterminated document", len(self._buf))
+        return self._doc
+
+    def _error(self, msg, pos):
+        return json.JSONDecodeError(msg, self._buf, pos)
+
+    def _parse(self, final):
+        buf, pos = self._buf, 0
+        while True:
+            pos = WHITESPACE.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            char = buf[pos]
+
+            if self._doc is None:
+                if char not in '[{':
+                    return  # A scalar: decoded whole, by `close`
+                self._doc = [] if char == '[' else {}
+                pos += 1
+            elif self._expect == 'end':
+                raise self._error("Extra data", pos)
+            elif (char == self._CLOSE[type(self._doc)] and
+                  self._expect in ('first', 'next')):
+                self._expect = 'end'
+                pos += 1
+            elif self._expect == 'next':
+                if char != ',':
+                    raise self._error("Expecting ',' delimiter", pos)
+                self._expect = ('key' if isinstance(self._doc, dict)
+                                else 'member')
+                pos += 1
+            elif self._expect == 'colon':
+                if char != ':':
+                    raise self._error("Expecting ':' delimiter", pos)
+                self._expect = 'member'
+                pos += 1
+            else:
+                is_key = (isinstance(self._doc, dict) and
+                          self._expect in ('first', 'key'))
+                if is_key and char != '"':
+                    raise self._error("Expecting property name enclosed "
+                                      "in double quotes", pos)
+                try:
+                    value, end = self._decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    break  # Incomplete (most likely)
+                if (not final and isinstance(value, (int, float)) and
+                        not isinstance(value, bool) and
+                        buf[end:end + 1] in ('', '.', 'e', 'E', '+', '-')):
+                    break  # The number may go on in the next chunk
+                if is_key:
+                    self._key, self._expect = value, 'colon'
+                elif isinstance(self._doc, dict):
+                    self._doc[self._key] = value
+                    self._expect = 'next'
+                else:
+                    self._doc.append(value)
+                    self._expect = 'next'
+                pos = end
+
+        if self._doc is not None:
+            self._buf = buf[pos:]
+        # Retry a member that didn't decode once its text has doubled,
+        # so a large member isn't decoded again for every chunk.
+        self._retry_at = 2 * len(self._buf)
+
+
+class StreamingJSONExtractor(StreamingExtractor):
+    """
+    Like `json_extractor`, with the size cap and early markers of
+    `StreamingExtractor`. The body is decoded as it arrives: each member
+    of a top-level array or object is decoded as soon as its text is
+    complete, so only the decoded document and the text of the member
+    being read are held, never the whole body. (A document that isn't an
+    array or object is decoded at the end.)
+    """
+
+    def start(self, resp):
+        return _IncrementalJSON()
+
+    def feed(self, state, chunk):
+        state.feed(chunk)
+        return state
+
+    def finish(self, state):
+        return state.close()
+
+
+class StreamingHTMLExtractor(StreamingExtractor):
+    def __init__(self, parser_factory, encoding='utf-8', **kwargs):
+        """
+        Feed the body to an `html.parser.HTMLParser` as it arrives, so
+        only what the parser keeps is held in memory.
+
+        :param parser_factory: a zero-argument callable returning a new
+            parser. The extracted content is the parser's `result`
+            attribute if it has one, else the parser.
+        :param encoding: the body's encoding
+        :param kwargs: the `StreamingExtractor` options
+        """
+        super().__init__(**kwargs)
+        self.parser_factory = parser_factory
+        self.encoding = encoding
+
+    def start(self, resp):
+        decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+        return self.parser_factory(), decoder
+
+    def feed(self, state, chunk):
+        parser, decoder = state
+        parser.feed(decoder.decode(chunk))
+        return state
+
+    def finish(self, state):
+        parser, decoder = state
+        parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+        return getattr(parser, 'result', parser)
@@ -0,0 +1,216 @@
+"""
+HTTP/2 transports, for `SmartFetcher` (`make_http2_session`) and for
+`direct_util` (`AsyncHTTP2Session`).
+
+Both multiplex concurrent requests to an origin over one connection where
+the server negotiates HTTP/2 (via ALPN, over TLS), and speak HTTP/1.1 to
+everything else. They need the optional `httpx` and `h2` packages
+(`pip install httpx[http2]`); without them, `make_http2_session` falls
+back to a plain `requests` session.
+"""
+import logging
+from threading import Lock
+from six.moves.urllib.parse import urlparse
+from http_lassie.proxy_leases import normalize_proxy
+from http_lassie.session_pool import make_session
+
+try:
+    import h2  # noqa: F401 (httpx needs it for HTTP/2)
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+_warned = []
+
+
+def http2_available():
+    return httpx is not None
+
+
+def _content_kwargs(data):
+    # httpx takes form fields as `data` but raw bodies as `content`.
+    if isinstance(data, (bytes, str)):
+        return {'content': data}
+    return {'data': data}
+
+
+class HTTP2Response:
+    def __init__(self, resp):
+        """
+        An `httpx.Response` with the subset of the `requests.Response`
+        interface that `SmartFetcher`, extractors and validators rely upon.
+        """
+        self.raw = resp
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+        self.url = str(resp.url)
+        self.http_version = resp.http_version
+        self.cookies = resp.cookies.jar
+        self.history = [HTTP2Response(r) for r in resp.history]
+
+    @property
+    def content(self):
+        return self.raw.read()
+
+    @property
+    def text(self):
+        self.raw.read()
+        return self.raw.text
+
+    def json(self):
+        self.raw.read()
+        return self.raw.json()
+
+    def iter_content(self, chunk_size=1):
+        return self.raw.iter_bytes(chunk_size)
+
+    def close(self):
+        self.raw.close()
+
+    def __repr__(self):
+        return "<HTTP2Response [{}] {}>".format(self.status_code,
+                                                self.http_version)
+
+
+class HTTP2Session:
+    def __init__(self, pool_maxsize=10, store_cookies=True,
+                 prior_knowledge=False):
+        """
+        A `requests.Session` stand-in backed by `httpx` clients (one per
+        proxy it is asked to route through).
+
+        :param pool_maxsize: the most connections per client
+        :param store_cookies: if False, never keep cookies between
+            requests (pass them per request instead)
+        :param prior_knowledge: if True, speak HTTP/2 to `http://` urls
+            without negotiating it (h2c, e.g. for a local stand-in)
+        """
+        if httpx is None:
+            raise ImportError("HTTP/2 needs `pip install httpx[http2]`")
+        self._lock = Lock()
+        self._clients = {}
+        self._limits = httpx.Limits(max_connections=pool_maxsize,
+                                    max_keepalive_connections=pool_maxsize)
+        self._store_cookies = store_cookies
+        self._prior_knowledge = prior_knowledge
+
+    def _client(self, proxy):
+        with self._lock:
+            client = self._clients.get(proxy)
+            if client is None:
+                client = httpx.Client(http2=True,
+                                      http1=not self._prior_knowledge,
+                                      proxy=proxy, limits=self._limits,
+                                      follow_redirects=True)
+                self._clients[proxy] = client
+            return client
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                cookies=None, timeout=None, proxies=None, stream=False):
+        """
+        Like `requests.Session.request` (for the arguments `SmartFetcher`
+        uses). As with `requests`, `proxies` maps a url scheme to the
+        proxy for it.
+
+        :return: an `HTTP2Response`
+        """
+        proxy = (proxies or {}).get(urlparse(url).scheme)
+        client = self._client(normalize_proxy(proxy))
+        request = client.build_request(method, url, params=params,
+                                       headers=headers, cookies=cookies,
+                                       timeout=timeout,
+                                       **_content_kwargs(data))
+        resp = client.send(request, stream=stream)
+        if not self._store_cookies:
+            client.cookies.clear()
+        return HTTP2Response(resp)
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+
+def make_http2_session(pool_maxsize=10, store_cookies=True,
+                       prior_knowledge=False):
+    """
+    A session factory for `SmartFetcher`'s `transport`.
+
+    :return: an `HTTP2Session`, or (logging a warning once) a
+        `requests.Session` from `make_session` if `httpx` or `h2` are
+        not installed
+    """
+    if httpx is None:
+        if not _warned:
+            _warned.append(True)
+            logging.warning("httpx[http2] is not installed; using HTTP/1.1")
+        return make_session(pool_maxsize, store_cookies)
+    return HTTP2Session(pool_maxsize, store_cookies, prior_knowledge)
+
+
+class _AsyncHTTP2Response:
+    # The subset of `aiohttp.ClientResponse` that `fetch_and_save` uses.
+    def __init__(self, resp):
+        self.raw = resp
+        self.status = resp.status_code
+        self.headers = resp.headers
+        self.http_version = resp.http_version
+        self.content = self
+        self._chunks = resp.aiter_bytes()
+
+    async def readany(self):
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b''
+
+
+class _AsyncRequest:
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def __aenter__(self):
+        return _AsyncHTTP2Response(await self._stream.__aenter__())
+
+    async def __aexit__(self, *exc_info):
+        return await self._stream.__aexit__(*exc_info)
+
+
+class AsyncHTTP2Session:
+    def __init__(self, max_connections=100, prior_knowledge=False,
+                 **client_kwargs):
+        """
+        An `aiohttp.ClientSession` stand-in (for `fetch_and_save` and the
+        functions built on it) backed by an `httpx.AsyncClient`.
+
+        :param max_connections: the most connections open at once
+        :param prior_knowledge: if True, speak HTTP/2 to `http://` urls
+            without negotiating it (h2c)
+        :param client_kwargs: more `httpx.AsyncClient` options (e.g.
+            `proxy`)
+        """
+        if httpx is None:
+            raise ImportError("HTTP/2 needs `pip install httpx[http2]`")
+        self._client = httpx.AsyncClient(
+            http2=True, http1=not prior_knowledge, follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_connections),
+            timeout=None, **client_kwargs)
+
+    def get(self, url, headers=None):
+        return _AsyncRequest(self._client.stream('GET', url,
+                                                 headers=headers))
+
+    @property
+    def closed(self):
+        return self._client.is_closed
+
+    async def close(self):
+        await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
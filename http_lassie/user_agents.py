@@ -1,9 +1,17 @@
 import os
 import random
+from threading import Lock
 
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 USER_AGENTS_PATH = os.path.join(THIS_DIR, "user_agents.tsv")
 
+# USER_AGENTS and MAX_PROPORTION are loaded on first access (see
+# `__getattr__`), so a star import only finds them if they are listed here
+# (and then loads them).
+__all__ = ['THIS_DIR', 'USER_AGENTS_PATH', 'load_user_agents',
+           'numpy_or_none', 'AliasSampler', 'USER_AGENTS', 'MAX_PROPORTION',
+           'random_user_agent', 'random_user_agents']
+
 
 def load_user_agents(file_path):
     """
@@ -24,18 +32,121 @@ def load_user_agents(file_path):
             user_agents.append((weight, user_agent))
     return user_agents, max_weight
 
-USER_AGENTS, MAX_PROPORTION = load_user_agents(USER_AGENTS_PATH)
+
+_numpy = []
+
+
+def numpy_or_none():
+    """
+    :return: the numpy module, or None if it isn't installed (imported on
+        first call, so importing http_lassie doesn't pay for it)
+    """
+    if not _numpy:
+        try:
+            import numpy
+        except ImportError:  # pragma: no cover
+            numpy = None
+        _numpy.append(numpy)
+    return _numpy[0]
+
+
+class AliasSampler:
+    def __init__(self, weights):
+        """
+        Sample indices in proportion to their weights in O(1) time, using
+        Vose's alias method.
+
+        :param weights: the (non-negative) weight of each index
+        """
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError("Need at least one positive weight")
+
+        scaled = [w * n / total for w in weights]
+        prob, alias = [1.0] * n, list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+
+        self.n = n
+        self.prob = prob
+        self.alias = alias
+        self._np_tables = None
+
+    def sample(self):
+        """
+        :return: an index, drawn in proportion to its weight
+        """
+        i = int(self.n * random.random())
+        return i if random.random() < self.prob[i] else self.alias[i]
+
+    def sample_many(self, k, use_numpy=True):
+        """
+        :param k: the number of indices to draw
+        :param use_numpy: if True, vectorize the draws with NumPy (when it
+            is installed)
+        :return: a list of k indices
+        """
+        np = numpy_or_none() if use_numpy else None
+        if np is None:
+            n, prob, alias, rand = self.n, self.prob, self.alias, random.random
+            return [i if rand() < prob[i] else alias[i]
+                    for i in (int(n * rand()) for _ in range(k))]
+
+        if self._np_tables is None:
+            self._np_tables = (np.asarray(self.prob), np.asarray(self.alias))
+        prob, alias = self._np_tables
+
+        i = np.random.randint(0, self.n, size=k)
+        return np.where(np.random.random(k) < prob[i], i, alias[i]).tolist()
+
+
+_lock = Lock()
+_STATE = None
+
+
+def _load():
+    # Parse the TSV on first use rather than when http_lassie is imported.
+    # The state is built aside and published in one assignment, so the
+    # unlocked readers never see it half-built.
+    global _STATE
+    with _lock:
+        if _STATE is None:
+            user_agents, max_weight = load_user_agents(USER_AGENTS_PATH)
+            _STATE = {'USER_AGENTS': user_agents,
+                      'MAX_PROPORTION': max_weight,
+                      'strings': [agent for _, agent in user_agents],
+                      'sampler': AliasSampler([w for w, _ in user_agents])}
+    return _STATE
+
+
+def __getattr__(name):
+    if name in ('USER_AGENTS', 'MAX_PROPORTION'):
+        return _load()[name]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,
+                                                                    name))
 
 
 def random_user_agent():
     """
     :return: a user string sampled in proportion to its usage weight
     """
-    # Do stochastic acceptance for fast proportional selection.
-    # See: http://jbn.github.io/fast_proportional_selection/
-    n = len(USER_AGENTS)
-    while True:
-        i = int(n * random.random())
-        proportion = USER_AGENTS[i][0]
-        if random.random() < proportion / MAX_PROPORTION:
-            return USER_AGENTS[i][1]
+    state = _STATE or _load()
+    return state['strings'][state['sampler'].sample()]
+
+
+def random_user_agents(n):
+    """
+    :param n: the number of user agents to draw
+    :return: a list of n user strings, each sampled in proportion to its
+        usage weight
+    """
+    state = _STATE or _load()
+    strings = state['strings']
+    return [strings[i] for i in state['sampler'].sample_many(n)]
@@ -1,10 +1,19 @@
+import heapq
+import itertools
 import logging
 import sys
-from threading import Thread, Lock
+import time
+from threading import Thread, Lock, Condition
 from six.moves.queue import Queue
+from http_lassie.backoff import DomainBackoff
+from http_lassie.results import ResultChannel
 from http_lassie.smart_fetcher import format_exception
 
 
+# Stands in on the done queue for the result of an item that raised.
+_ERRORED = object()
+
+
 def ignore(item, error, submit):
     pass
 
@@ -13,9 +22,34 @@ def echo_error(item, error, submit):
     logging.error(format_exception("[_work]", 0, sys.exc_info()))
 
 
+def retry_on_backoff(item, error, submit):
+    """
+    An error_func that resubmits items whose domain is cooling down
+    (see `SmartFetcher`'s `block_on_backoff`) once the cooldown ends,
+    leaving the worker free for other domains in the meantime.
+    """
+    if isinstance(error, DomainBackoff):
+        submit(item, delay=error.retry_after)
+    else:
+        echo_error(item, error, submit)
+
+
+class _Deferred:
+    __slots__ = ('due_at', 'seq', 'item')
+
+    def __init__(self, due_at, seq, item):
+        self.due_at = due_at
+        self.seq = seq
+        self.item = item
+
+    def __lt__(self, other):
+        return (self.due_at, self.seq) < (other.due_at, other.seq)
+
+
 class WorkerPool:
     def __init__(self, task_func, error_func=echo_error, n_workers=5,
-                 auto_stop=True):
+                 auto_stop=True, work_queue=None, metrics=None,
+                 max_results=0, spill_threshold=None, spill_dir=None):
         """
         Create a worker pool.
 
@@ -25,51 +59,190 @@ class WorkerPool:
         :param error_func: a function with the signature of
             f(item, exception, submit) that gets called on any exception
             not handled by the task_func
-        :param n_workers: number of simultaneous workers (Threaded)
+        :param n_workers: number of simultaneous workers (Threaded). Change
+            it while running with `resize` (or an `AutoScaler`).
         :param auto_stop: if True, kill each worker in the pool when there
             are no items left to process or items still in processing
+        :param work_queue: the queue workers pull items from. If None, a
+            FIFO `Queue`. Pass a `DomainQueue` to rate limit per domain.
+            If the queue has a `release` method, it is called with each
+            item once that item is finished (or, if the queue has a
+            `fail` method and the task raised, that is called instead).
+            If it has an `add` method
+            (e.g. a `DurableQueue`), items are submitted through it and
+            the ones it rejects as duplicates are dropped. Items already
+            in the queue count as submitted.
+        :param metrics: an optional `Metrics`, which then records the
+            queue depth, the items in flight, task durations and errors
+        :param max_results: the most results waiting to be gathered (0 for
+            no limit). Once it is reached, workers wait for `gather` to
+            catch up, so results can't pile up in memory (consume them
+            before calling `stop`).
+        :param spill_threshold: if not None, result payloads of this many
+            bytes or more are spilled to memory-mapped files and gathered
+            as memoryviews (see `ResultChannel`)
+        :param spill_dir: the directory payloads are spilled to (e.g.
+            `/dev/shm`). If None, the default temporary directory.
         """
         self._lock = Lock()
         self._task_func = task_func
         self._error_func = error_func
         self._auto_stop = auto_stop
 
-        self._submitted = 0
+        self._submitted = work_queue.qsize() if work_queue is not None else 0
         self._finished = 0
-        self._work_queue = Queue()
-        self._done_queue = Queue()
+        self._n_gathered = 0
+        self._in_flight = 0
+        self._metrics = metrics
+        self._work_queue = work_queue if work_queue is not None else Queue()
+        self._done_queue = ResultChannel(max_results, spill_threshold,
+                                         spill_dir)
+        self._release_item = getattr(self._work_queue, 'release', None)
+        self._fail_item = getattr(self._work_queue, 'fail', None)
+        self._add_item = getattr(self._work_queue, 'add', None)
+
+        self._deferred = []
+        self._deferred_ids = itertools.count()
+        self._deferred_cond = Condition(self._lock)
+        self._stopping = False
+        self._scheduler = Thread(target=self._schedule, daemon=True)
 
+        self._listeners = []
+        self._started = False
+        self._n_workers = n_workers
+        self._n_active = n_workers
         self._workers = [Thread(target=self._work) for _ in range(n_workers)]
 
     def start(self):
         """
         Start each thread and begin processing the queue.
         """
-        for worker in self._workers:
+        with self._lock:
+            self._started = True
+            workers = list(self._workers)
+        self._scheduler.start()
+        for worker in workers:
+            worker.start()
+
+    @property
+    def n_workers(self):
+        """
+        :return: the number of workers the pool is sized for
+        """
+        return self._n_workers
+
+    def resize(self, n_workers):
+        """
+        Change the number of workers while running.
+
+        New workers start right away. Extra workers retire as they finish
+        their current item (idle ones once they pick up their next item).
+
+        :param n_workers: the new (positive) number of workers
+        """
+        if n_workers < 1:
+            raise ValueError("n_workers must be positive")
+
+        new_workers = []
+        with self._lock:
+            if self._stopping:
+                return
+            self._n_workers = n_workers
+            if not self._started:
+                del self._workers[n_workers:]
+                while len(self._workers) < n_workers:
+                    self._workers.append(Thread(target=self._work))
+                self._n_active = n_workers
+                return
+
+            self._workers = [t for t in self._workers if t.is_alive()]
+            while self._n_active < n_workers:
+                new_workers.append(Thread(target=self._work))
+                self._n_active += 1
+            self._workers.extend(new_workers)
+
+        for worker in new_workers:
             worker.start()
 
+    def add_listener(self, listener):
+        """
+        :param listener: a function with the signature of
+            f(item, result, error, elapsed), called (on the worker thread)
+            after each item is processed. error is None on success.
+        """
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+
+    def queue_depth(self):
+        """
+        :return: the number of items waiting for a worker
+        """
+        return self._work_queue.qsize()
+
     def stop(self):
         """
         Send each thread the kill sentinel.
 
         This is a graceful stop. The method then blocks until all threads die.
+        Deferred items that have not come due are dropped.
         """
-        for worker in self._workers:
+        with self._deferred_cond:
+            self._stopping = True
+            self._deferred_cond.notify()
+
+        with self._lock:
+            workers = [t for t in self._workers if t.is_alive()]
+
+        for worker in workers:
             self._work_queue.put(None)  # Signal end.
 
-        for worker in self._workers:
+        for worker in workers:
             worker.join()
 
-    def submit(self, item):
+    def submit(self, item, delay=0):
         """
         Submit some item for processing.
+
+        :param item: the item
+        :param delay: if positive, hold the item back for this many seconds
+            before it becomes available to the workers
         """
         if item is None:
             raise ValueError("Can't submit a `None`. It's the kill sentinel")
 
         with self._lock:
             self._submitted += 1
-        self._work_queue.put(item)
+
+        if self._add_item is not None:
+            if not self._add_item(item, hold=delay > 0):  # A duplicate
+                with self._lock:
+                    self._submitted -= 1
+                return
+        elif delay <= 0:
+            self._work_queue.put(item)
+
+        if delay > 0:
+            with self._lock:
+                entry = _Deferred(time.time() + delay,
+                                  next(self._deferred_ids), item)
+                heapq.heappush(self._deferred, entry)
+                self._deferred_cond.notify()
+                return
+        self._observe_queue()
+
+    def deferred_stats(self):
+        """
+        :return: a dict of the number of deferred items and the seconds
+            until the next and the last of them come due
+        """
+        now = time.time()
+        with self._lock:
+            if not self._deferred:
+                return {'n_deferred': 0, 'next_due_in': 0, 'last_due_in': 0}
+            return {'n_deferred': len(self._deferred),
+                    'next_due_in': max(0, self._deferred[0].due_at - now),
+                    'last_due_in': max(0, max(entry.due_at for entry
+                                              in self._deferred) - now)}
 
     def gather(self):
         """
@@ -80,28 +253,97 @@ class WorkerPool:
 
         :return: an item from the done queue
         """
-        while not self.is_done() or not self._done_queue.empty():
-            yield self._done_queue.get()
+        # Every finished item puts one entry on the done queue (even if
+        # it raised), so counting them can't miss the last one.
+        while True:
+            with self._lock:
+                if self._n_gathered >= self._submitted:
+                    break
+            result = self._done_queue.get()
+            with self._lock:
+                self._n_gathered += 1
+            if result is not _ERRORED:
+                yield result
 
         if self._auto_stop:
             self.stop()
 
     def _work(self):
         while True:
+            with self._lock:
+                if self._n_active > self._n_workers:  # Resized down
+                    self._n_active -= 1
+                    break
+
             item = self._work_queue.get()
             if item is None:  # Kill sentinel
                 break
 
+            with self._lock:
+                self._in_flight += 1
+            self._observe_queue()
+            start, outcome = time.perf_counter(), 'ok'
+            result, error = None, None
+
             try:
-                self._done_queue.put(self._task_func(item, self.submit))
+                result = self._task_func(item, self.submit)
+                self._done_queue.put(result)
             except Exception as e:
+                outcome, error = 'error', e
                 try:
                     self._error_func(item, e, self.submit)
                 except Exception as e:
                     print(format_exception("[_work]", 0, sys.exc_info()))
+                self._done_queue.put(_ERRORED)
             finally:
+                if error is not None and self._fail_item is not None:
+                    self._fail_item(item)
+                elif self._release_item is not None:
+                    self._release_item(item)
                 with self._lock:
                     self._finished += 1
+                    self._in_flight -= 1
+                elapsed = time.perf_counter() - start
+                if self._metrics is not None:
+                    self._metrics.observe('task_seconds', elapsed)
+                    self._metrics.inc('tasks_total', outcome=outcome)
+                self._observe_queue()
+                for listener in self._listeners:
+                    try:
+                        listener(item, result, error, elapsed)
+                    except Exception:
+                        logging.error(format_exception("[listener]", 0,
+                                                       sys.exc_info()))
+
+    def _observe_queue(self):
+        if self._metrics is None:
+            return
+        self._metrics.set('queue_depth', self._work_queue.qsize())
+        self._metrics.set('tasks_in_flight', self._in_flight)
+        self._metrics.set('tasks_deferred', len(self._deferred))
+        self._metrics.set('workers', self._n_workers)
+
+    def _schedule(self):
+        while True:
+            due = []
+            with self._deferred_cond:
+                while not self._stopping and not due:
+                    now = time.time()
+                    while self._deferred and self._deferred[0].due_at <= now:
+                        due.append(heapq.heappop(self._deferred).item)
+                    if not due:
+                        timeout = None
+                        if self._deferred:
+                            timeout = self._deferred[0].due_at - now
+                        self._deferred_cond.wait(timeout)
+                if self._stopping:
+                    return
+
+            # Not under the lock: a bounded work queue blocks until a
+            # worker takes an item, and workers take the lock to finish.
+            for item in due:
+                self._work_queue.put(item)
+            self._observe_queue()
 
     def is_done(self):
         return self._submitted == self._finished and self._work_queue.empty()
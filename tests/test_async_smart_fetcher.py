@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from http_lassie.async_smart_fetcher import *
+
+
+def make_app(statuses):
+    released = []
+
+    async def acquire(request):
+        return web.json_response({'proxy': None, 'resource_id': 1})
+
+    async def release(request):
+        released.append(dict(await request.post()))
+        return web.Response(text="ok")
+
+    async def target(request):
+        return web.Response(status=statuses.pop(0), body=b"hello")
+
+    app = web.Application()
+    app.router.add_post('/proxies/acquire', acquire)
+    app.router.add_post('/proxies/release', release)
+    app.router.add_get('/target', target)
+    return app, released
+
+
+class DirectFetcher(AsyncSmartFetcher):
+    # The stand-in mimic hands out no proxies, so go direct.
+    async def _get_proxy_resource(self, request_url, render_js):
+        resource = await get_proxy_async(self.session, self._mimic_server,
+                                         request_url, [])
+        return {'proxy': '', 'resource_id': resource['resource_id']}
+
+
+class TestAsyncSmartFetcher(unittest.TestCase):
+    def _run(self, statuses, **kwargs):
+        async def go():
+            app, released = make_app(statuses)
+            server = TestServer(app)
+            await server.start_server()
+            base = str(server.make_url(''))
+            try:
+                async with DirectFetcher(base, None) as fetcher:
+                    res = await fetcher(base + '/target', **kwargs)
+                    return res, released
+            finally:
+                await server.close()
+
+        return asyncio.run(go())
+
+    def test_success(self):
+        (content, success), released = self._run([200])
+        self.assertEqual(content, b"hello")
+        self.assertTrue(success)
+        self.assertEqual(len(released), 1)
+        self.assertNotIn('is_failure', released[0])
+
+    def test_retries_then_gives_up(self):
+        (content, success), released = self._run(
+            [503, 503], retries=2)
+        self.assertFalse(success)
+        self.assertEqual(len(released), 2)
+        self.assertTrue(all(r['is_failure'] == 'true' for r in released))
+
+    def test_not_found_is_final(self):
+        (content, success), released = self._run([404, 200])
+        self.assertFalse(success)
+        self.assertEqual(len(released), 1)
+        self.assertNotIn('is_failure', released[0])
+
+    def test_validator(self):
+        (content, success), released = self._run(
+            [200, 200], validator=lambda c: False, retries=2)
+        self.assertFalse(success)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import asyncio
+import unittest
+from http_lassie.async_worker_pool import *
+
+
+def collect(pool):
+    async def go():
+        return [item async for item in pool.gather()]
+    return go()
+
+
+class TestAsyncWorkerPool(unittest.TestCase):
+    def test_nothing_submitted(self):
+        async def f(x, submit):
+            return x
+
+        self.assertEqual(asyncio.run(collect(AsyncWorkerPool(f))), [])
+
+    def test_integration(self):
+        errors = []
+
+        async def err_callback(item, e, submit):
+            errors.append(item)
+
+        async def f(x, submit):
+            await asyncio.sleep(0)
+            if x == 5:
+                submit(100)
+            elif x == 10:
+                raise ValueError('Bad Value')
+            return x**2
+
+        async def go():
+            pool = AsyncWorkerPool(f, err_callback, concurrency=3,
+                                   max_queued=2, max_results=2)
+            pool.feed(range(20))
+            collected = set(await collect(pool))
+            return pool, collected
+
+        pool, collected = asyncio.run(go())
+        expected = {x**2 for x in range(20) if x != 10} | {100**2}
+        self.assertEqual(collected, expected)
+        self.assertEqual(errors, [10])
+        self.assertEqual(pool.stats(), {'n_submitted': 21,
+                                        'n_finished': 21,
+                                        'n_running': 0,
+                                        'work_queue_size': 0,
+                                        'done_queue_size': 0,
+                                        'is_done': True})
+
+    def test_concurrency_limit(self):
+        running, peak = [0], [0]
+
+        async def f(x, submit):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.001)
+            running[0] -= 1
+            return x
+
+        async def go():
+            pool = AsyncWorkerPool(f, concurrency=4, max_queued=1)
+            pool.feed(range(50))
+            return await collect(pool)
+
+        self.assertEqual(sorted(asyncio.run(go())), list(range(50)))
+        self.assertEqual(peak[0], 4)
+
+    def test_submit_applies_backpressure(self):
+        async def f(x, submit):
+            return x
+
+        async def go():
+            pool = AsyncWorkerPool(f, max_queued=2)
+            await pool.submit(1)
+            await pool.submit(2)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(pool.submit(3), 0.01)
+
+        asyncio.run(go())
+
+
+if __name__ == '__main__':
+    unittest.main()
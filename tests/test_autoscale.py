@@ -0,0 +1,99 @@
+import unittest
+from http_lassie.autoscale import *
+from http_lassie.backoff import DomainBackoff
+from http_lassie.worker_pool import WorkerPool, ignore
+
+
+class FakePool:
+    def __init__(self, n_workers, queue_depth=0):
+        self.n_workers = n_workers
+        self.depth = queue_depth
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def queue_depth(self):
+        return self.depth
+
+    def resize(self, n_workers):
+        self.n_workers = n_workers
+
+    def finish(self, result=None, error=None, elapsed=0.01):
+        for listener in self.listeners:
+            listener(None, result, error, elapsed)
+
+
+class TestAutoScaler(unittest.TestCase):
+    def test_grows_with_backlog(self):
+        pool = FakePool(4, queue_depth=10)
+        scaler = AutoScaler(pool, max_workers=6, increase=2)
+        self.assertEqual(scaler.adjust(), 6)
+        self.assertEqual(scaler.adjust(), 6)
+
+        pool.depth = 0
+        self.assertEqual(scaler.adjust(), 6)
+
+    def test_shrinks_on_no_proxy(self):
+        pool = FakePool(10, queue_depth=10)
+        scaler = AutoScaler(pool, min_workers=3)
+        pool.finish(error=DomainBackoff('a.com', 1))
+        pool.finish(error=DomainBackoff(('b.com', (), False), 1))
+        self.assertEqual(scaler.stats()['backoffs'], {'a.com': 1,
+                                                      'b.com': 1})
+        self.assertEqual(scaler.adjust(), 5)
+
+        pool.finish(error=DomainBackoff('a.com', 1))
+        pool.finish(error=DomainBackoff('b.com', 1))
+        self.assertEqual(scaler.adjust(), 3)
+
+        # The window resets after each adjustment.
+        self.assertEqual(scaler.adjust(), 4)
+
+    def test_one_domain_backing_off(self):
+        pool = FakePool(10, queue_depth=10)
+        scaler = AutoScaler(pool, max_workers=20)
+        for _ in range(5):
+            pool.finish(error=DomainBackoff('a.com', 1))
+        pool.finish(result=(b'', True))
+        self.assertEqual(scaler.adjust(), 11)
+
+    def test_shrinks_on_failures(self):
+        pool = FakePool(10)
+        scaler = AutoScaler(pool, is_failure=lambda result: not result[1])
+        for _ in range(8):
+            pool.finish(result=(b'', True))
+        for _ in range(2):
+            pool.finish(result=(b'', False))
+        self.assertEqual(scaler.adjust(), 10)  # 20% is tolerated
+
+        pool.finish(result=(b'', False))
+        self.assertEqual(scaler.adjust(), 5)
+        self.assertEqual(scaler.stats()['n_resizes'], 1)
+
+    def test_shrinks_on_latency(self):
+        pool = FakePool(10, queue_depth=10)
+        scaler = AutoScaler(pool, max_latency=1.0)
+        pool.finish(elapsed=2.0)
+        self.assertEqual(scaler.adjust(), 5)
+
+    def test_bad_bounds(self):
+        with self.assertRaises(ValueError):
+            AutoScaler(FakePool(1), min_workers=5, max_workers=2)
+
+    def test_scales_a_worker_pool(self):
+        pool = WorkerPool(lambda x, submit: x, ignore, n_workers=1)
+        scaler = AutoScaler(pool, max_workers=4, interval=0.01)
+        for i in range(50):
+            pool.submit(i)
+        scaler.adjust()
+        self.assertEqual(pool.n_workers, 2)
+
+        pool.start()
+        scaler.start()
+        self.assertEqual(sorted(pool.gather()), list(range(50)))
+        scaler.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
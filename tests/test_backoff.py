@@ -0,0 +1,55 @@
+import time
+import unittest
+from http_lassie.backoff import *
+
+
+class TestBackoffScheduler(unittest.TestCase):
+    def test_exponential_without_jitter(self):
+        backoff = BackoffScheduler(base_delay=1, factor=2, max_delay=5,
+                                   jitter=0)
+        delays = [backoff.failure('a.com') for _ in range(5)]
+        self.assertEqual(delays, [1, 2, 4, 5, 5])
+        self.assertGreater(backoff.delay('a.com'), 4)
+        self.assertEqual(backoff.delay('b.com'), 0)
+
+    def test_jitter_bounds(self):
+        backoff = BackoffScheduler(base_delay=10, jitter=0.5)
+        for _ in range(100):
+            backoff.success('a.com')
+            delay = backoff.failure('a.com')
+            self.assertGreaterEqual(delay, 5)
+            self.assertLessEqual(delay, 10)
+
+    def test_success_resets(self):
+        backoff = BackoffScheduler(jitter=0)
+        backoff.failure('a.com')
+        backoff.failure('a.com')
+        backoff.success('a.com')
+        self.assertEqual(backoff.delay('a.com'), 0)
+        self.assertEqual(backoff.failure('a.com'), 1)
+
+    def test_expired_keys_are_pruned(self):
+        backoff = BackoffScheduler(base_delay=0.01, max_delay=0.02,
+                                   jitter=0)
+        for i in range(100):
+            backoff.failure('{}.com'.format(i))
+        time.sleep(0.05)
+        self.assertEqual(backoff.delay('0.com'), 0)
+        self.assertNotIn('0.com', backoff._ready_at)
+
+        # Long ready, the streak is forgotten (and swept with the rest).
+        for i in range(100, 200):
+            backoff.failure('{}.com'.format(i))
+        self.assertLess(len(backoff._failures), 120)
+        self.assertEqual(backoff.failure('1.com'), 0.01)
+
+    def test_stats(self):
+        backoff = BackoffScheduler()
+        backoff.failure('a.com')
+        stats = backoff.stats()
+        self.assertEqual(stats['n_cooling'], 1)
+        self.assertIn('a.com', stats['cooling'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from http_lassie.cache import *
+from http_lassie.response import BufferedResponse
+
+
+def response(content=b"body", **headers):
+    return BufferedResponse(200, content, headers, 'http://a.com/')
+
+
+class TestFreshness(unittest.TestCase):
+    def test_lifetimes(self):
+        self.assertEqual(freshness_lifetime({'Cache-Control':
+                                             'public, max-age=60'}), 60)
+        self.assertEqual(freshness_lifetime({'cache-control': 'no-cache'}), 0)
+        self.assertIsNone(freshness_lifetime({'Cache-Control': 'no-store'}))
+        self.assertEqual(freshness_lifetime({}, default_ttl=5), 5)
+        self.assertEqual(freshness_lifetime(
+            {'Expires': 'Thu, 01 Dec 1994 16:00:00 GMT'}), 0)
+
+    def test_request_key(self):
+        self.assertEqual(request_key('get', 'http://a.com', {'a': 1, 'b': 2}),
+                         request_key('GET', 'http://a.com', {'b': 2, 'a': 1}))
+        self.assertNotEqual(request_key('GET', 'http://a.com'),
+                            request_key('GET', 'http://a.com',
+                                        render_js=True))
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_fresh_hit(self):
+        cache = ResponseCache()
+        cache.store('k', response(**{'Cache-Control': 'max-age=60'}))
+        fresh, stale = cache.lookup('k')
+        self.assertEqual(fresh.to_response().content, b"body")
+        self.assertIsNone(stale)
+        self.assertEqual(cache.stats(), {'n_hits': 1, 'n_misses': 0,
+                                         'n_revalidated': 0, 'n_stored': 1,
+                                         'n_evictions': 0, 'n_entries': 1})
+
+    def test_stale_with_etag_revalidates(self):
+        cache = ResponseCache()
+        cache.store('k', response(ETag='"v1"'))
+        fresh, stale = cache.lookup('k')
+        self.assertIsNone(fresh)
+        self.assertEqual(stale.validators, {'If-None-Match': '"v1"'})
+
+        not_modified = BufferedResponse(304, b"", {'Cache-Control':
+                                                   'max-age=60'})
+        resp = cache.revalidated('k', stale, not_modified)
+        self.assertEqual(resp.content, b"body")
+        self.assertIsNotNone(cache.lookup('k')[0])
+
+    def test_uncacheable(self):
+        cache = ResponseCache()
+        cache.store('a', response())
+        cache.store('b', response(**{'Cache-Control': 'no-store'}))
+        self.assertEqual(cache.lookup('a'), (None, None))
+        self.assertEqual(cache.lookup('b'), (None, None))
+
+        cache = ResponseCache(default_ttl=60)
+        cache.store('c', response(), 'POST')
+        self.assertEqual(cache.lookup('c'), (None, None))
+
+    def test_memory_byte_budget(self):
+        backend = MemoryCache(max_bytes=10)
+        cache = ResponseCache(backend, default_ttl=60)
+        for key in 'abc':
+            cache.store(key, response(b"12345"))
+        self.assertIsNone(cache.lookup('a')[0])
+        self.assertIsNotNone(cache.lookup('c')[0])
+        self.assertEqual(cache.stats()['n_evictions'], 1)
+
+    def test_disk(self):
+        directory = tempfile.mkdtemp()
+        try:
+            backend = DiskCache(directory, max_bytes=1500)
+            cache = ResponseCache(backend, default_ttl=60)
+            cache.store('a', response(b"x" * 1000))
+            time.sleep(0.01)
+            cache.store('b', response(b"y" * 1000))
+
+            self.assertEqual(len(backend), 1)
+            fresh, _ = ResponseCache(DiskCache(directory)).lookup('b')
+            self.assertEqual(fresh.to_response().content, b"y" * 1000)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_disk_lru(self):
+        directory = tempfile.mkdtemp()
+        try:
+            backend = DiskCache(directory, max_bytes=2500)
+            cache = ResponseCache(backend, default_ttl=60)
+            cache.store('a', response(b"x" * 1000))
+            cache.store('b', response(b"y" * 1000))
+            self.assertIsNotNone(backend.get('a'))  # Now 'b' is the oldest
+            cache.store('c', response(b"z" * 1000))
+            self.assertEqual(len(backend), 2)
+            self.assertIsNone(backend.get('b'))
+            self.assertIsNotNone(backend.get('a'))
+
+            # Removed behind the cache's back: a miss, not an error.
+            os.remove(os.path.join(directory, 'a.entry'))
+            self.assertIsNone(backend.get('a'))
+            self.assertEqual(len(backend), 1)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+import unittest
+from http_lassie.coalesce import *
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_result(self):
+        flights, calls, results = SingleFlight(), [], []
+        started = threading.Event()
+
+        def work():
+            calls.append(1)
+            started.set()
+            time.sleep(0.05)
+            return 'content'
+
+        def call():
+            results.append(flights.do('k', work))
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=call) for _ in range(4)]
+        for t in followers:
+            t.start()
+        for t in [leader] + followers:
+            t.join()
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['content'] * 5)
+        self.assertEqual(flights.stats(), {'n_calls': 1, 'n_shared': 4,
+                                           'n_in_flight': 0})
+
+    def test_errors_are_shared_then_forgotten(self):
+        flights = SingleFlight()
+
+        def fail():
+            raise ValueError('nope')
+
+        with self.assertRaises(ValueError):
+            flights.do('k', fail)
+        self.assertEqual(flights.do('k', lambda: 1), 1)
+
+    def test_flight_key(self):
+        def extractor(resp):
+            return resp
+
+        a = flight_key('GET', 'http://a.com', None, None, False,
+                       extractor, None)
+        self.assertEqual(a, flight_key('get', 'http://a.com', None, None,
+                                       False, extractor, None))
+        self.assertNotEqual(a, flight_key('GET', 'http://a.com', None, None,
+                                          False, len, None))
+
+
+class TestAsyncSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_result(self):
+        flights, calls = AsyncSingleFlight(), []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'content'
+
+        async def go():
+            return await asyncio.gather(*[flights.do('k', work)
+                                          for _ in range(5)])
+
+        self.assertEqual(asyncio.run(go()), ['content'] * 5)
+        self.assertEqual(calls, [1])
+        self.assertEqual(flights.stats(), {'n_calls': 1, 'n_shared': 4,
+                                           'n_in_flight': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
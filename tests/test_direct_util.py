@@ -0,0 +1,211 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http_lassie.direct_util import *
+from http_lassie.direct_util import _OffLoopWriter
+from http_lassie.metrics import Metrics
+from http_lassie.politeness import domain_of
+
+BODY = b"0123456789" * 1000
+
+
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, dict(self.headers)))
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+        if self.path == '/etag':
+            return self.do_etag()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def do_etag(self):
+        etag = '"v1"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') == etag:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if start >= len(BODY):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(BODY) - 1, len(BODY)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(BODY) - start))
+        self.end_headers()
+        self.wfile.write(BODY[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDirectUtil(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.base = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever,
+                         daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def pairs(self, n, missing=()):
+        for i in range(n):
+            path = '/missing' if i in missing else '/{}'.format(i)
+            yield self.base + path, os.path.join(self.dir, str(i))
+
+    def test_iter_download_all(self):
+        results = list(iter_download_all(self.pairs(10, missing={3}),
+                                         concurrency=3))
+        errors = [r for r in results if isinstance(r, DownloadError)]
+        self.assertEqual(len(results), 10)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].url.endswith('/missing'))
+        for result in results:
+            if not isinstance(result, DownloadError):
+                self.assertEqual(result[2], len(BODY))
+                with open(result[1], 'rb') as fp:
+                    self.assertEqual(fp.read(), BODY)
+
+    def test_metrics(self):
+        metrics = Metrics()
+        results = list(iter_download_all(self.pairs(4, missing={3}),
+                                         metrics=metrics))
+        self.assertEqual(len(results), 4)
+
+        domain = domain_of(self.base)
+        self.assertEqual(metrics.get('bytes_total', domain=domain),
+                         3 * len(BODY))
+        self.assertEqual(metrics.get('downloads_total', domain=domain,
+                                     status=200), 3)
+        self.assertEqual(metrics.get('downloads_total', domain=domain,
+                                     status=404), 1)
+        for phase, count in (('connect', 4), ('ttfb', 4), ('body', 3)):
+            histogram = metrics.get('phase_seconds', phase=phase,
+                                    domain=domain)
+            self.assertEqual(histogram.count, count)
+        self.assertEqual(metrics.get('downloads_in_flight'), 0)
+
+    def fetch(self, path, **kwargs):
+        async def go():
+            async with aiohttp.ClientSession() as session:
+                return await fetch_and_save(session, self.base + path,
+                                            self.output_path, **kwargs)
+        return asyncio.run(go())
+
+    @property
+    def output_path(self):
+        return os.path.join(self.dir, 'out')
+
+    def read_output(self):
+        with open(self.output_path, 'rb') as fp:
+            return fp.read()
+
+    def test_conditional(self):
+        self.assertEqual(self.fetch('/etag')[2], len(BODY))
+        self.assertEqual(self.fetch('/etag')[2], 0)
+        self.assertEqual(Handler.requests[-1][1]['If-None-Match'], '"v1"')
+        self.assertEqual(self.read_output(), BODY)
+        self.assertFalse(os.path.exists(self.output_path + PART_SUFFIX))
+
+    def test_resume(self):
+        with open(self.output_path + PART_SUFFIX, 'wb') as fp:
+            fp.write(BODY[:100])
+        write_meta(self.output_path, {'partial': {'etag': '"v1"'}})
+
+        self.assertEqual(self.fetch('/etag')[2], len(BODY) - 100)
+        self.assertEqual(self.read_output(), BODY)
+        self.assertEqual(read_meta(self.output_path),
+                         {'complete': {'etag': '"v1"'}})
+
+    def test_stale_partial_restarts(self):
+        with open(self.output_path + PART_SUFFIX, 'wb') as fp:
+            fp.write(b"x" * 100)
+        write_meta(self.output_path, {'partial': {'etag': '"v0"'}})
+
+        self.assertEqual(self.fetch('/etag')[2], len(BODY))
+        self.assertEqual(self.read_output(), BODY)
+
+    def test_unsatisfiable_range_restarts(self):
+        with open(self.output_path + PART_SUFFIX, 'wb') as fp:
+            fp.write(BODY)  # Complete, but never renamed
+        write_meta(self.output_path, {'partial': {'etag': '"v1"'}})
+
+        self.assertEqual(self.fetch('/etag')[2], len(BODY))
+        self.assertEqual(self.read_output(), BODY)
+        self.assertNotIn('Range', Handler.requests[-1][1])
+
+    def test_no_validators_no_meta(self):
+        write_meta(self.output_path, {'complete': {'etag': '"old"'}})
+        self.assertEqual(self.fetch('/plain', conditional=False)[2],
+                         len(BODY))
+        self.assertFalse(os.path.exists(self.output_path + META_SUFFIX))
+
+    def test_bad_status_leaves_no_file(self):
+        with self.assertRaises(ValueError):
+            self.fetch('/missing')
+        self.assertFalse(os.path.exists(self.output_path))
+
+    def test_off_loop_writer(self):
+        chunks = [bytes([i % 256]) * (i * 37 % 1500 + 1) for i in range(200)]
+
+        async def go():
+            with open(self.output_path, 'wb') as fp:
+                writer = _OffLoopWriter(fp, 64, 4096, None)
+                for chunk in chunks:
+                    await writer.write(chunk)
+                await writer.close()
+
+        asyncio.run(go())
+        self.assertEqual(self.read_output(), b"".join(chunks))
+
+    def test_stream_pulls_input_lazily(self):
+        pulled = []
+
+        def pairs():
+            for pair in self.pairs(10):
+                pulled.append(pair)
+                yield pair
+
+        async def go():
+            results = stream_download_all(pairs(), concurrency=2)
+            first = await results.__anext__()
+            n_pulled = len(pulled)
+            rest = [r async for r in results]
+            return first, n_pulled, rest
+
+        first, n_pulled, rest = asyncio.run(go())
+        self.assertLessEqual(n_pulled, 3)
+        self.assertEqual(len(rest), 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
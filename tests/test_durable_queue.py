@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+import unittest
+from http_lassie.durable_queue import *
+from http_lassie.worker_pool import WorkerPool, ignore, retry_on_backoff
+from http_lassie.backoff import DomainBackoff
+
+
+class TestDurableQueue(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'work.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_resume(self):
+        queue = DurableQueue(self.path)
+        for url in ('a', 'b', 'c', 'd'):
+            self.assertTrue(queue.add(url))
+        self.assertEqual(queue.get(), 'a')
+        queue.release('a')
+        self.assertEqual(queue.get(), 'b')  # In flight at the "crash"
+        queue.close()
+
+        queue = DurableQueue(self.path)
+        self.assertEqual(queue.n_resumed, 3)
+        self.assertEqual([queue.get() for _ in range(3)], ['b', 'c', 'd'])
+        self.assertEqual(queue.stats()['n_done'], 1)
+        queue.close()
+
+    def test_dedupe(self):
+        queue = DurableQueue(self.path)
+        self.assertTrue(queue.add('a'))
+        self.assertFalse(queue.add('a'))  # Already pending
+        queue.release(queue.get())
+        self.assertFalse(queue.add('a'))  # Already done
+        queue.close()
+
+        queue = DurableQueue(self.path)
+        self.assertFalse(queue.add('a'))  # Done in an earlier run
+        self.assertEqual(queue.qsize(), 0)
+        queue.close()
+
+        queue = DurableQueue(self.path, dedupe=False)
+        self.assertTrue(queue.add('a'))
+        queue.close()
+
+    def test_retry_of_an_item_in_flight(self):
+        queue = DurableQueue(self.path)
+        queue.add('a')
+        item = queue.get()
+        self.assertTrue(queue.add(item, hold=True))
+        queue.release(item)  # Another copy is still pending
+        self.assertEqual(queue.stats()['n_pending'], 1)
+        self.assertTrue(queue.empty())
+        queue.close()
+
+        queue = DurableQueue(self.path)
+        self.assertEqual(queue.get(), 'a')
+        queue.close()
+
+    def test_batched_writes(self):
+        queue = DurableQueue(self.path, flush_interval=60, batch_size=10)
+        for i in range(5):
+            queue.add(i)
+        self.assertEqual(queue.stats()['n_unwritten'], 5)
+        queue.flush()
+        self.assertEqual(queue.stats()['n_written'], 5)
+        queue.close()
+
+    def test_worker_pool(self):
+        queue = DurableQueue(self.path)
+        queue.add('done')
+        queue.release(queue.get())
+        for i in range(5):
+            queue.add(i)
+        queue.close()
+
+        attempts = []
+
+        def f(x, submit):
+            attempts.append(x)
+            if x == 0 and attempts.count(0) == 1:
+                raise DomainBackoff('a.com', 0.01)  # Retried later
+            return x
+
+        queue = DurableQueue(self.path)
+        pool = WorkerPool(f, retry_on_backoff, n_workers=2, work_queue=queue)
+        pool.submit(5)
+        pool.submit(5)  # Pending, so dropped
+        pool.submit('done')  # Done in an earlier run, so dropped
+        pool.start()
+        self.assertEqual(sorted(pool.gather()), list(range(6)))
+        self.assertEqual(pool.stats()['n_submitted'], 7)  # With the retry
+        self.assertEqual(attempts.count(0), 2)
+        self.assertEqual(queue.stats()['n_done'], 7)
+        queue.close()
+
+    def test_sync_adds(self):
+        queue = DurableQueue(self.path, flush_interval=60, sync_adds=True)
+        queue.add('a')
+        self.assertEqual(queue.stats()['n_unwritten'], 0)
+        queue.release(queue.get())  # Batched: lost in a "crash"
+
+        resumed = DurableQueue(self.path)
+        self.assertEqual(resumed.get(), 'a')  # Processed again
+        resumed.close()
+        queue.close()
+
+    def test_failures(self):
+        def f(x, submit):
+            if x % 2:
+                raise ValueError(x)
+            return x
+
+        queue = DurableQueue(self.path)
+        pool = WorkerPool(f, ignore, n_workers=2, work_queue=queue)
+        for i in range(4):
+            pool.submit(i)
+        pool.start()
+        self.assertEqual(sorted(pool.gather()), [0, 2])
+        self.assertEqual((queue.stats()['n_done'],
+                          queue.stats()['n_failed']), (2, 2))
+        self.assertEqual(queue.failed_items(), [1, 3])
+        queue.close()
+
+        queue = DurableQueue(self.path)  # Failed items may be retried
+        self.assertTrue(queue.add(1))
+        self.assertFalse(queue.add(0))
+        queue.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from benchmarks.harness import SCENARIOS, compare, current_rss_mb
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+class TestHarness(unittest.TestCase):
+    def test_current_rss(self):
+        before = current_rss_mb()
+        block = b'x' * (64 << 20)  # Touched, so resident
+        self.assertGreater(current_rss_mb() - before, 32)
+        del block
+
+    def test_compare(self):
+        def result(rps, p99):
+            return {'scenario': 'fetch_many', 'concurrency': 8,
+                    'requests_per_s': rps, 'p99_s': p99}
+
+        baseline = {'label': 'old', 'git_commit': None,
+                    'results': [result(100, 0.0)]}
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            # No p99 to compare with (e.g. a timer too coarse to see it).
+            self.assertEqual(compare([result(100, 0.01)], baseline, 0.1),
+                             0)
+            self.assertEqual(compare([result(50, 0.01)], baseline, 0.1),
+                             1)
+        self.assertIn('p99     n/a', out.getvalue())
+
+    def test_smoke(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'smoke.json')
+            subprocess.check_call(
+                [sys.executable, '-m', 'benchmarks.harness',
+                 '--requests', '4', '--concurrency', '2',
+                 '--output', output],
+                cwd=ROOT, stdout=subprocess.DEVNULL, timeout=120)
+            with open(output) as fp:
+                doc = json.load(fp)
+
+        results = doc['results']
+        self.assertTrue({r['scenario'] for r in results} <= set(SCENARIOS))
+        self.assertIn('smart_fetcher', {r['scenario'] for r in results})
+        for result in results:
+            self.assertEqual((result['n_requests'], result['n_ok']), (4, 4))
+            self.assertGreater(result['rss_mb'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from six.moves.urllib.parse import parse_qs
+from http_lassie.hedging import *
+from http_lassie.smart_fetcher import SmartFetcher
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Mimic, and the two proxies it takes turns handing out (the first
+    # one handed out is slow).
+    ports = []
+    n_acquired = 0
+    released = []
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = parse_qs(self.rfile.read(length).decode())
+        if self.path == '/proxies/acquire':
+            Handler.n_acquired += 1
+            n = Handler.n_acquired
+            body = json.dumps({'proxy': 'HTTP://127.0.0.1:{}'.format(
+                Handler.ports[n % 2]), 'id': n}).encode()
+        else:
+            Handler.released.append((params['id'][0],
+                                     float(params['response_time'][0]),
+                                     'is_failure' in params))
+            body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.server.server_port == Handler.ports[1]:
+            time.sleep(0.5)
+        body = b'page'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHedgePolicy(unittest.TestCase):
+    def test_percentile_delay(self):
+        policy = HedgePolicy(percentile=0.9, initial_delay=2,
+                             min_delay=0.01, min_samples=10)
+        self.assertEqual(policy.delay('a'), 2)
+        for i in range(1, 11):
+            policy.record('a', i / 10)
+        self.assertEqual(policy.delay('a'), 1.0)
+        self.assertEqual(policy.delay('b'), 2)
+
+        policy = HedgePolicy(min_delay=0.5, max_delay=1, min_samples=1)
+        policy.record('a', 0.1)
+        self.assertEqual(policy.delay('a'), 0.5)
+        policy.record('a', 5)
+        self.assertEqual(policy.delay('a'), 1)
+
+    def test_budget(self):
+        policy = HedgePolicy(budget=0.25, max_tokens=2)
+        for _ in range(3):
+            policy.delay('a')
+        self.assertFalse(policy.try_hedge())
+        policy.delay('a')
+        self.assertTrue(policy.try_hedge())
+        self.assertFalse(policy.try_hedge())
+
+        for _ in range(100):
+            policy.delay('a')
+        self.assertTrue(policy.try_hedge())
+        self.assertTrue(policy.try_hedge())
+        self.assertFalse(policy.try_hedge())
+        self.assertEqual(policy.stats()['n_hedged'], 3)
+
+
+class TestHedgedFetch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servers = [ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+                       for _ in range(2)]
+        for server in cls.servers:
+            threading.Thread(target=server.serve_forever,
+                             daemon=True).start()
+        Handler.ports = [server.server_port for server in cls.servers]
+        cls.base = 'http://127.0.0.1:{}'.format(Handler.ports[0])
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+
+    def setUp(self):
+        Handler.n_acquired, Handler.released = 0, []
+
+    def recording(self, policy):
+        recorded = []
+        record = policy.record
+        policy.record = lambda domain, latency: (recorded.append(latency),
+                                                  record(domain, latency))
+        return recorded
+
+    def test_slow_attempt_is_hedged(self):
+        policy = HedgePolicy(initial_delay=0.1, budget=1)
+        recorded = self.recording(policy)
+        fetcher = SmartFetcher(self.base, None, hedge=policy)
+        content, ok = fetcher(self.base + '/page')
+        self.assertEqual((content, ok), (b'page', True))
+        self.assertEqual(policy.stats()['n_hedged'], 1)
+        # Only the winner (the hedge) is timed.
+        self.assertEqual(len(recorded), 1)
+        self.assertLess(recorded[0], 0.4)
+
+        # The loser is released (not as a failure) once it responds.
+        for _ in range(100):
+            if len(Handler.released) == 2:
+                break
+            time.sleep(0.02)
+        released = {id_: (resp_time, is_failure)
+                    for id_, resp_time, is_failure in Handler.released}
+        self.assertGreaterEqual(released['1'][0], 0.5)
+        self.assertLess(released['2'][0], 0.4)
+        self.assertFalse(released['1'][1] or released['2'][1])
+        fetcher.close()
+
+    def test_fast_attempt_starts_no_thread(self):
+        policy = HedgePolicy(initial_delay=5, budget=1)
+        recorded = self.recording(policy)
+        fetcher = SmartFetcher(self.base, None, hedge=policy)
+        Handler.n_acquired = 1  # The next proxy handed out is the fast one
+        n_threads = threading.active_count()
+        self.assertEqual(fetcher(self.base + '/page'), (b'page', True))
+        self.assertEqual(Handler.n_acquired, 2)
+        self.assertEqual(len(recorded), 1)
+        # Just the timer thread, however many attempts are made.
+        self.assertEqual(fetcher(self.base + '/page'), (b'page', True))
+        self.assertLessEqual(threading.active_count(), n_threads + 1)
+        self.assertEqual(policy.stats()['n_hedged'], 0)
+        fetcher.close()
+
+    def test_no_budget_no_hedge(self):
+        policy = HedgePolicy(initial_delay=0.01, budget=0)
+        fetcher = SmartFetcher(self.base, None, hedge=policy)
+        self.assertEqual(fetcher(self.base + '/page'), (b'page', True))
+        self.assertEqual(Handler.n_acquired, 1)
+        self.assertEqual(policy.stats()['n_denied'], 1)
+        fetcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http_lassie.identity import *
+from http_lassie.session_pool import make_session
+
+
+class CookieHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = (self.headers.get('Cookie') or '').encode()
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'visit=1; Path=/')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestIdentityManager(unittest.TestCase):
+    def test_sticky_per_proxy_and_domain(self):
+        manager = IdentityManager()
+        a = manager.get('http://p1:80', 'example.com')
+        self.assertIs(manager.get('http://p1:80', 'example.com'), a)
+        self.assertIsNot(manager.get('http://p2:80', 'example.com'), a)
+        self.assertIsNot(manager.get('http://p1:80', 'example.org'), a)
+
+        self.assertEqual(a.headers['User-Agent'], a.user_agent)
+        self.assertEqual(a.uses, 2)
+        self.assertEqual(manager.stats(), {'n_created': 3, 'n_reused': 1,
+                                           'n_retired': 0,
+                                           'n_identities': 3})
+
+    def test_lifetime(self):
+        manager = IdentityManager(lifetime=0.05)
+        a = manager.get('p', 'd')
+        time.sleep(0.1)
+        self.assertIsNot(manager.get('p', 'd'), a)
+
+    def test_retire(self):
+        manager = IdentityManager()
+        a = manager.get('p', 'd')
+        manager.retire('p', 'd')
+        manager.retire('p', 'd')
+        self.assertIsNot(manager.get('p', 'd'), a)
+        self.assertEqual(manager.stats()['n_retired'], 1)
+
+    def test_bounded(self):
+        manager = IdentityManager(max_identities=2)
+        a = manager.get('p', 'a')
+        manager.get('p', 'b')
+        manager.get('p', 'a')  # Touch a, so b is now the oldest
+        manager.get('p', 'c')
+        self.assertEqual(len(manager), 2)
+        self.assertIs(manager.get('p', 'a'), a)
+
+
+class TestIdentityCookies(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), CookieHandler)
+        threading.Thread(target=cls.server.serve_forever,
+                         daemon=True).start()
+        cls.url = 'http://127.0.0.1:{}/'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_cookies_follow_the_identity(self):
+        session = make_session(store_cookies=False)
+        a, b = make_identity(time.time()), make_identity(time.time())
+
+        resp = session.get(self.url, cookies=a.cookies)
+        a.update_cookies(resp)
+        self.assertEqual(resp.content, b'')
+        self.assertEqual(len(session.cookies), 0)
+
+        self.assertEqual(session.get(self.url, cookies=a.cookies).content,
+                         b'visit=1')
+        self.assertEqual(session.get(self.url, cookies=b.cookies).content,
+                         b'')
+        session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import asyncio
+import time
+import unittest
+from http_lassie.politeness import *
+from http_lassie.worker_pool import WorkerPool
+
+
+class TestDomainLimiter(unittest.TestCase):
+    def test_in_flight_cap(self):
+        limiter = DomainLimiter(rate=None, max_in_flight=2)
+        self.assertEqual(limiter.try_acquire('a.com'), 0)
+        self.assertEqual(limiter.try_acquire('a.com'), 0)
+        self.assertIsNone(limiter.try_acquire('a.com'))
+        self.assertEqual(limiter.try_acquire('b.com'), 0)
+        limiter.release('a.com')
+        self.assertEqual(limiter.try_acquire('a.com'), 0)
+        self.assertEqual(limiter.in_flight(), {'a.com': 2, 'b.com': 1})
+
+    def test_rate(self):
+        limiter = DomainLimiter(rate=10, burst=1, max_in_flight=None)
+        self.assertEqual(limiter.try_acquire('a.com'), 0)
+        wait = limiter.try_acquire('a.com')
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.1)
+
+    def test_idle_buckets_are_evicted(self):
+        limiter = DomainLimiter(rate=1000, burst=1, max_in_flight=None)
+        for i in range(200):
+            if i == 100:
+                time.sleep(0.01)  # Long enough to refill
+            key = '{}.com'.format(i)
+            self.assertEqual(limiter.try_acquire(key), 0)
+            if i != 0:
+                limiter.release(key)
+        self.assertLess(len(limiter._buckets), 150)
+        self.assertIn('0.com', limiter._buckets)  # Still in flight
+
+        # A key still limited keeps its bucket.
+        limiter = DomainLimiter(rate=0.01, burst=1, max_in_flight=None)
+        for i in range(200):
+            key = '{}.com'.format(i)
+            limiter.try_acquire(key)
+            limiter.release(key)
+        self.assertGreater(limiter.try_acquire('0.com'), 0)
+
+    def test_per_domain_overrides(self):
+        limiter = DomainLimiter(rate=None, max_in_flight=1,
+                                per_domain={'big.com': {'max_in_flight': 3}})
+        for _ in range(3):
+            self.assertEqual(limiter.try_acquire('big.com'), 0)
+        self.assertEqual(limiter.try_acquire('small.com'), 0)
+        self.assertIsNone(limiter.try_acquire('small.com'))
+
+
+    def test_acquire_waits_for_release(self):
+        limiter = DomainLimiter(rate=None, max_in_flight=1)
+
+        async def go():
+            await limiter.acquire('a.com')
+            waiting = asyncio.ensure_future(limiter.acquire('a.com'))
+            cancelled = asyncio.ensure_future(limiter.acquire('a.com'))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiting.done())
+            cancelled.cancel()
+
+            start = time.time()
+            asyncio.get_running_loop().call_later(0.02, limiter.release,
+                                                  'a.com')
+            await asyncio.wait_for(waiting, 1)
+            return time.time() - start
+
+        self.assertLess(asyncio.run(go()), 0.5)
+        self.assertEqual(limiter.in_flight(), {'a.com': 1})
+        self.assertEqual(limiter._waiters, {})
+
+    def test_acquire_sleeps_for_the_rate(self):
+        limiter = DomainLimiter(rate=20, burst=1, max_in_flight=None)
+
+        async def go():
+            start = time.time()
+            for _ in range(3):
+                await limiter.acquire('a.com')
+            return time.time() - start
+
+        self.assertGreaterEqual(asyncio.run(go()), 0.09)
+
+
+class TestDomainQueue(unittest.TestCase):
+    def test_round_robin(self):
+        queue = DomainQueue(domain_of, DomainLimiter(rate=None,
+                                                     max_in_flight=None))
+        for url in ['http://a.com/1', 'http://a.com/2', 'http://a.com/3',
+                    'http://b.com/1']:
+            queue.put(url)
+
+        order = [queue.get() for _ in range(4)]
+        self.assertEqual(order, ['http://a.com/1', 'http://b.com/1',
+                                 'http://a.com/2', 'http://a.com/3'])
+        self.assertTrue(queue.empty())
+
+    def test_sentinels_skip_the_line(self):
+        queue = DomainQueue(domain_of)
+        queue.put('http://a.com/1')
+        queue.put(None)
+        self.assertIsNone(queue.get())
+
+    def test_worker_pool_respects_in_flight_cap(self):
+        limiter = DomainLimiter(rate=None, max_in_flight=1)
+        running, peak = {}, {}
+
+        def f(url, submit):
+            key = domain_of(url)
+            running[key] = running.get(key, 0) + 1
+            peak[key] = max(peak.get(key, 0), running[key])
+            time.sleep(0.005)
+            running[key] -= 1
+            return url
+
+        pool = WorkerPool(f, n_workers=4,
+                          work_queue=DomainQueue(domain_of, limiter))
+        urls = ['http://{}.com/{}'.format(d, i) for d in 'ab'
+                for i in range(5)]
+        for url in urls:
+            pool.submit(url)
+        pool.start()
+
+        self.assertEqual(sorted(pool.gather()), sorted(urls))
+        self.assertEqual(peak, {'a.com': 1, 'b.com': 1})
+        self.assertEqual(limiter.in_flight(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import time
+import unittest
+from http_lassie.proxy_health import *
+
+P1, P2 = 'HTTP://10.0.0.1:80', 'HTTP://10.0.0.2:80'
+
+
+class TestProxyHealth(unittest.TestCase):
+    def test_rates_and_percentiles(self):
+        health = ProxyHealth()
+        for latency in (0.1, 0.2, 0.3, 0.4):
+            health.record(P1, 'a.com', True, latency)
+        health.record(P1, 'b.com', False)
+
+        self.assertEqual(health.success_rate(P1), 0.8)
+        self.assertEqual(health.success_rate(P1, 'a.com'), 1.0)
+        self.assertEqual(health.success_rate(P1, 'b.com'), 0.0)
+        self.assertEqual(health.success_rate(P2), 1.0)
+        self.assertEqual(health.percentile(P1, 0.5), 0.3)
+        self.assertEqual(health.percentile(P1, 1.0, 'a.com'), 0.4)
+        self.assertIsNone(health.percentile(P2, 0.5))
+
+    def test_circuit_per_domain(self):
+        health = ProxyHealth(min_samples=3, open_for=0.05)
+        for _ in range(6):
+            health.record(P1, 'b.com', True)
+        for _ in range(3):
+            self.assertTrue(health.allows(P1, 'a.com'))
+            health.record(P1, 'a.com', False)
+
+        self.assertFalse(health.allows(P1, 'a.com'))
+        self.assertTrue(health.allows(P1, 'b.com'))
+        self.assertEqual(health.excluded('a.com'), {P1})
+        self.assertEqual(health.excluded('b.com'), set())
+
+        # Half open: one trial, then closed on success.
+        time.sleep(0.06)
+        self.assertTrue(health.allows(P1, 'a.com'))
+        self.assertFalse(health.allows(P1, 'a.com'))
+        health.record(P1, 'a.com', True)
+        self.assertTrue(health.allows(P1, 'a.com'))
+        self.assertEqual(health.stats()['n_open'], 0)
+
+    def test_failed_trial_reopens_for_longer(self):
+        health = ProxyHealth(min_samples=1, open_for=0.05)
+        health.record(P1, 'a.com', False)
+        time.sleep(0.06)
+        self.assertTrue(health.allows(P1, 'a.com'))
+        health.record(P1, 'a.com', False)
+
+        time.sleep(0.06)
+        self.assertFalse(health.allows(P1, 'a.com'))  # Now open for 0.1s
+        time.sleep(0.05)
+        self.assertTrue(health.allows(P1, 'a.com'))
+        self.assertEqual(health.stats()['n_opened'], 4)
+
+    def test_proxy_wide_circuit(self):
+        health = ProxyHealth(min_samples=4)
+        for domain in ('a.com', 'b.com', 'c.com', 'd.com'):
+            health.record(P1, domain, False)
+        self.assertFalse(health.allows(P1, 'e.com'))
+        self.assertEqual(health.excluded(), {P1})
+
+
+    def test_bounded(self):
+        health = ProxyHealth(max_circuits=4)
+        health.record(P1, 'a.com', True, 0.1)
+        health.record(P2, 'a.com', True, 0.2)
+        health.record(P1, 'b.com', True, 0.3)  # Drops (P1, 'a.com')
+
+        self.assertEqual(health.stats()['n_circuits'], 4)
+        self.assertIsNone(health.percentile(P1, 0.5, 'a.com'))
+        self.assertEqual(health.percentile(P1, 1.0), 0.3)
+        self.assertEqual(health.percentile(P2, 0.5, 'a.com'), 0.2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import threading
+import unittest
+from http_lassie.results import *
+
+
+class TestResultChannel(unittest.TestCase):
+    def test_spill(self):
+        view = spill(b'abc' * 1000)
+        self.assertIsInstance(view, memoryview)
+        self.assertTrue(view.readonly)
+        self.assertEqual(view[:6].tobytes(), b'abcabc')
+        self.assertEqual(len(view), 3000)
+
+    def test_spills_large_payloads(self):
+        channel = ResultChannel(spill_threshold=10)
+        channel.put(b'small')
+        channel.put((b'x' * 10, True))
+        channel.put(bytearray(b'y' * 20))
+        channel.put({'not': b'spilled' * 10})
+
+        self.assertEqual(channel.get(), b'small')
+        content, ok = channel.get()
+        self.assertIsInstance(content, memoryview)
+        self.assertEqual((bytes(content), ok), (b'x' * 10, True))
+        self.assertEqual(bytes(channel.get()), b'y' * 20)
+        self.assertIsInstance(channel.get(), dict)
+        self.assertEqual(channel.stats(), {'n_waiting': 0, 'n_spilled': 2,
+                                           'bytes_spilled': 30})
+
+    def test_bounded(self):
+        channel = ResultChannel(maxsize=1)
+        channel.put(1)
+        putter = threading.Thread(target=channel.put, args=(2,))
+        putter.start()
+        putter.join(0.1)
+        self.assertTrue(putter.is_alive())  # Blocked until a get
+        self.assertEqual(channel.get(), 1)
+        putter.join()
+        self.assertEqual(channel.get(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from http_lassie.session_pool import *
+
+
+class FakeSession:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestSessionPool(unittest.TestCase):
+    def test_reuses_sessions_by_key(self):
+        pool = SessionPool(2, session_factory=FakeSession)
+        self.assertIs(pool.get('a'), pool.get('a'))
+        self.assertIsNot(pool.get('a'), pool.get('b'))
+
+    def test_evicts_least_recently_used(self):
+        pool = SessionPool(2, session_factory=FakeSession)
+        a, b = pool.get('a'), pool.get('b')
+        pool.get('a')  # Touch a, so b is now the oldest
+        pool.get('c')
+
+        self.assertTrue(b.closed)
+        self.assertFalse(a.closed)
+        self.assertNotIn('b', pool)
+        self.assertEqual(pool.stats(), {'n_sessions': 2,
+                                        'max_sessions': 2,
+                                        'n_evictions': 1})
+
+    def test_borrowed_sessions_close_on_release(self):
+        pool = SessionPool(1, session_factory=FakeSession)
+        a = pool.acquire('a')
+        self.assertIs(pool.acquire('a'), a)
+        pool.get('b')  # Evicts a, which is still in use
+
+        self.assertNotIn('a', pool)
+        self.assertFalse(a.closed)
+        pool.release(a)
+        self.assertFalse(a.closed)
+        pool.release(a)
+        self.assertTrue(a.closed)
+
+        b = pool.acquire('b')
+        pool.release(b)
+        pool.discard('b')  # Not borrowed
+        self.assertTrue(b.closed)
+
+    def test_close(self):
+        pool = SessionPool(2, session_factory=FakeSession)
+        a, b = pool.get('a'), pool.acquire('b')
+        pool.close()
+        self.assertTrue(a.closed)
+        self.assertEqual(len(pool), 0)
+
+        self.assertFalse(b.closed)  # Still in use
+        pool.release(b)
+        self.assertTrue(b.closed)
+
+    def test_bad_size(self):
+        with self.assertRaises(ValueError):
+            SessionPool(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import unittest
+from http_lassie.sharded_pool import *
+
+
+def square(x, submit):
+    if x == 5:
+        submit(100)
+    elif x == 10:
+        raise ValueError('Bad Value')
+    return x ** 2
+
+
+def pid_by_key(x, submit):
+    return x % 3, os.getpid()
+
+
+def resubmit_later(x, submit):
+    if x < 0:
+        submit(-x, delay=0.05)
+    return x
+
+
+class TestShardedWorkerPool(unittest.TestCase):
+    def test_integration(self):
+        pool = ShardedWorkerPool(square, ignore_error, n_shards=2)
+        for item in range(20):
+            pool.submit(item)
+        pool.start()
+
+        expected = {x ** 2 for x in range(20) if x != 10} | {100 ** 2}
+        self.assertEqual(set(pool.gather()), expected)
+        self.assertEqual(pool.stats(), {'n_submitted': 21,
+                                        'n_finished': 21,
+                                        'n_deferred': 0,
+                                        'living_processes': 0})
+
+    def test_routes_by_key(self):
+        pool = ShardedWorkerPool(pid_by_key, n_shards=3,
+                                 key_func=lambda x: x % 3)
+        for item in range(30):
+            pool.submit(item)
+        pool.start()
+
+        pids = {}
+        for key, pid in pool.gather():
+            pids.setdefault(key, set()).add(pid)
+        self.assertTrue(all(len(p) == 1 for p in pids.values()))
+
+    def test_delayed_resubmission(self):
+        pool = ShardedWorkerPool(resubmit_later, n_shards=2)
+        pool.submit(-1)
+        pool.start()
+        self.assertEqual(sorted(pool.gather()), [-1, 1])
+
+
+def ignore_error(item, error, submit):
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
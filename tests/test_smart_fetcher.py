@@ -0,0 +1,231 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http_lassie.backoff import BackoffScheduler
+from http_lassie.cache import ResponseCache
+from http_lassie.smart_fetcher import *
+from http_lassie.streaming import StreamingExtractor
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Mimic, the proxy it hands out, and the targets.
+    protocol_version = 'HTTP/1.1'
+    n_acquired = 0
+    n_released = 0
+    no_proxy = False
+    credentials = ''
+    batches = []
+    rendered = []
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        body = b'ok'
+        if self.path == '/execute':  # Splash
+            urls = json.loads(data.decode())['urls']
+            Handler.batches.append(len(urls))
+            body = json.dumps([{'url': url, 'ok': True, 'status': 200,
+                                'html': url} for url in urls]).encode()
+        elif self.path == '/render.html':  # Splash
+            args = json.loads(data.decode())
+            Handler.rendered.append(args)
+            body = args['url'].encode()
+        elif self.path == '/proxies/acquire':
+            Handler.n_acquired += 1
+            cold = Handler.no_proxy or b'cold' in data
+            proxy = None if cold else 'HTTP://{}{}'.format(
+                Handler.credentials, self.headers['Host'])
+            body = json.dumps({'proxy': proxy,
+                               'id': Handler.n_acquired}).encode()
+        else:
+            Handler.n_released += 1
+        self.respond(200, body)
+
+    def do_GET(self):
+        path = '/' + self.path.split('/', 3)[3]  # Sent as a full url
+        if path.startswith('/slow/'):
+            time.sleep(float(path.split('/')[2]))
+        if path == '/fail':
+            self.respond(503, b'unavailable')
+        elif path == '/missing':
+            self.respond(404, b'not found')
+        elif path == '/cookie':
+            self.respond(200, (self.headers.get('Cookie') or '').encode(),
+                         {'Set-Cookie': 'seen=1; Path=/'})
+        else:
+            self.respond(200, path.encode())
+
+    def respond(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.base = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever,
+                         daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class TestFetchMany(ServerTestCase):
+    def setUp(self):
+        Handler.n_acquired, Handler.n_released = 0, 0
+        Handler.no_proxy = False
+        self.fetcher = SmartFetcher(self.base, None)
+
+    def tearDown(self):
+        self.fetcher.close()
+
+    def test_results(self):
+        requests = [self.base + '/a',
+                    {'request_url': self.base + '/b',
+                     'extractor': lambda resp: resp.text},
+                    self.base + '/missing',
+                    self.base + '/fail']
+        results = list(self.fetcher.fetch_many(requests, ordered=True,
+                                               retries=2))
+        self.assertEqual([r.index for r in results], [0, 1, 2, 3])
+
+        a, b, missing, fail = results
+        self.assertEqual(tuple(a), (b'/a', True))
+        self.assertEqual((a.status, a.attempts, a.error), (200, 1, None))
+        self.assertEqual(a.proxy, 'HTTP://' + self.base[7:])
+        self.assertGreaterEqual(a.elapsed, a.resp_time)
+        self.assertEqual(b.content, '/b')
+
+        self.assertEqual((missing.ok, missing.status), (False, 404))
+        self.assertEqual((fail.ok, fail.status, fail.attempts),
+                         (False, 503, 2))
+        self.assertIsInstance(fail.error, FailingStatusCode)
+        self.assertEqual(Handler.n_released, Handler.n_acquired)
+
+    def test_cookies_are_kept_only_if_asked(self):
+        for _ in range(2):
+            self.assertEqual(self.fetcher(self.base + '/cookie'),
+                             (b'', True))
+
+        fetcher = SmartFetcher(self.base, None, keep_cookies=True)
+        self.assertEqual(fetcher(self.base + '/cookie'), (b'', True))
+        self.assertEqual(fetcher(self.base + '/cookie'), (b'seen=1', True))
+        fetcher.close()
+
+    def test_too_large_is_final(self):
+        result, = self.fetcher.fetch_many(
+            [self.base + '/big'], extractor=StreamingExtractor(max_bytes=1))
+        self.assertEqual((result.ok, result.status, result.attempts),
+                         (False, 200, 1))
+        self.assertIsInstance(result.error, ResponseTooLarge)
+        self.assertEqual((Handler.n_acquired, Handler.n_released), (1, 1))
+
+    def test_cache_hit_the_extractor_rejects(self):
+        fetcher = SmartFetcher(self.base, None,
+                               cache=ResponseCache(default_ttl=60))
+        url = self.base + '/a'
+        self.assertEqual(fetcher(url), (b'/a', True))
+        self.assertEqual(fetcher(url), (b'/a', True))
+        self.assertEqual(Handler.n_acquired, 1)
+
+        # An extractor that raises on the cached entry: a miss.
+        def picky(resp):
+            if getattr(resp, 'request', None) is None:  # From the cache
+                raise ValueError
+            return resp.content
+
+        self.assertEqual(fetcher(url, extractor=picky), (b'/a', True))
+        self.assertEqual(Handler.n_acquired, 2)
+        fetcher.close()
+
+    def test_reuses_proxies(self):
+        requests = ['{}/{}'.format(self.base, i) for i in range(5)]
+        results = list(self.fetcher.fetch_many(requests, concurrency=1))
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual((Handler.n_acquired, Handler.n_released), (1, 1))
+
+    def test_completion_order(self):
+        requests = [self.base + '/slow/0.3', self.base + '/fast']
+        results = self.fetcher.fetch_many(requests, concurrency=2)
+        self.assertEqual([r.index for r in results], [1, 0])
+
+        results = self.fetcher.fetch_many(requests, concurrency=2,
+                                          ordered=True)
+        self.assertEqual([r.index for r in results], [0, 1])
+
+    def test_bounded_input(self):
+        n_pulled = [0]
+
+        def requests():
+            for i in range(100):
+                n_pulled[0] += 1
+                yield '{}/{}'.format(self.base, i)
+
+        results = self.fetcher.fetch_many(requests(), concurrency=2)
+        next(results)
+        self.assertLessEqual(n_pulled[0], 5)
+        self.assertEqual(len(list(results)), 99)
+
+    def test_backoff(self):
+        Handler.no_proxy = True
+        fetcher = SmartFetcher(self.base, None,
+                               backoff=BackoffScheduler(base_delay=0.01))
+        result, = fetcher.fetch_many([self.base + '/a'], retries=2)
+        self.assertEqual(result.ok, False)
+        self.assertIsInstance(result.error, DomainBackoff)
+
+        # A plain call sleeps through cooldowns by default.
+        self.assertEqual(fetcher(self.base + '/a', retries=2),
+                         (None, False))
+        fetcher.close()
+
+
+class TestRenderMany(ServerTestCase):
+    def setUp(self):
+        Handler.batches = []
+        Handler.no_proxy = False
+        self.fetcher = SmartFetcher(self.base, self.base,
+                                    block_on_backoff=False)
+
+    def tearDown(self):
+        self.fetcher.close()
+
+    def test_proxy_credentials_keep_their_case(self):
+        Handler.credentials = 'User:PaSS@'
+        try:
+            url = self.base + '/a'
+            self.assertEqual(self.fetcher(url, render_js=True),
+                             (url.encode(), True))
+        finally:
+            Handler.credentials = ''
+        self.assertEqual(Handler.rendered[-1]['proxy'],
+                         'http://User:PaSS@' + self.base[len('http://'):])
+
+    def test_batches_fit_the_timeout(self):
+        urls = ['{}/{}'.format(self.base, i) for i in range(3)]
+        results = self.fetcher.render_many(
+            urls, splash_overrides={'wait': 10, 'timeout': 20})
+        self.assertEqual(results, [(url.encode(), True) for url in urls])
+        self.assertEqual(Handler.batches, [2, 1])
+
+    def test_backoff_keeps_finished_results(self):
+        urls = [self.base + '/a', 'http://cold.test/b', self.base + '/c']
+        results = self.fetcher.render_many(urls)
+        self.assertEqual(results, [(urls[0].encode(), True), None,
+                                   (urls[2].encode(), True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import json
+import threading
+import unittest
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from http_lassie.response import BufferedResponse
+from http_lassie.smart_fetcher import FailingStatusCode
+from http_lassie.streaming import *
+
+BIG = 64 << 20
+
+
+class Handler(BaseHTTPRequestHandler):
+    n_sent = 0
+
+    def do_GET(self):
+        self.send_response(200)
+        if self.path == '/chunked':  # No Content-Length to check up front
+            self.send_header('Connection', 'close')
+        else:
+            self.send_header('Content-Length', str(BIG))
+        self.end_headers()
+        try:
+            self.wfile.write(b'<p>captcha</p>')
+            for _ in range(BIG // (1 << 16)):
+                self.wfile.write(b'x' * (1 << 16))
+                Handler.n_sent += 1 << 16
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class TitleParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.result, self._in_title = '', False
+
+    def handle_starttag(self, tag, attrs):
+        self._in_title = tag == 'title'
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.result += data  # Data may arrive in pieces
+
+
+class TestStreamingExtractors(unittest.TestCase):
+    def test_collects_bytes(self):
+        resp = BufferedResponse(200, b'abc' * 1000)
+        self.assertEqual(StreamingExtractor(chunk_size=7)(resp),
+                         b'abc' * 1000)
+
+    def test_size_cap(self):
+        resp = BufferedResponse(200, b'x' * 100)
+        with self.assertRaises(ResponseTooLarge):
+            StreamingExtractor(max_bytes=99, chunk_size=10)(resp)
+
+        resp.headers['Content-Length'] = '100'
+        with self.assertRaises(ResponseTooLarge):
+            StreamingExtractor(max_bytes=99)(resp)
+
+    def test_reject_markers(self):
+        extractor = StreamingExtractor(reject_markers=[b'captcha'],
+                                       sniff_bytes=20, chunk_size=3)
+        with self.assertRaises(AbortResponse) as cm:
+            extractor(BufferedResponse(200, b'<p>capt' + b'cha</p>'))
+        self.assertEqual(cm.exception.head, b'<p>captcha</')
+
+        # Markers past sniff_bytes are ignored.
+        body = b'x' * 20 + b'captcha'
+        self.assertEqual(extractor(BufferedResponse(200, body)), body)
+
+    def test_json_and_html(self):
+        doc = {'a': [1, 2, 3]}
+        resp = BufferedResponse(200, json.dumps(doc).encode())
+        self.assertEqual(StreamingJSONExtractor(chunk_size=2)(resp), doc)
+
+        body = '<html><title>Café</title><p>...</p></html>'.encode()
+        extractor = StreamingHTMLExtractor(TitleParser, chunk_size=1)
+        self.assertEqual(extractor(BufferedResponse(200, body)),
+                         'Café')
+
+    def test_json_chunk_boundaries(self):
+        docs = ['[1, 22, -4.5e3, 1.25E-2, true, null, "a]b,\\"c", {}]',
+                '{"a": 10, "b": "\u00e9\\u00e9", "c": {"d": [1, {}]}}',
+                '[]', ' {} ', '123', '"abc"', '{"a": 1, "a": 2}']
+        for doc in docs:
+            for chunk_size in (1, 2, 3, 1000):
+                resp = BufferedResponse(200, doc.encode())
+                extractor = StreamingJSONExtractor(chunk_size=chunk_size)
+                self.assertEqual(extractor(resp), json.loads(doc))
+
+        for doc in ['[1,]', '[1 2]', '{"a" 1}', '[1] x', '[1, 2', '{1: 2}',
+                    '', '[1.x]', '[1e]']:
+            for chunk_size in (1, 1000):
+                resp = BufferedResponse(200, doc.encode())
+                extractor = StreamingJSONExtractor(chunk_size=chunk_size)
+                with self.assertRaises(ValueError):
+                    extractor(resp)
+
+    def test_json_is_decoded_as_it_arrives(self):
+        extractor = StreamingJSONExtractor()
+        state = extractor.feed(extractor.start(None), b'[')
+        for i in range(1000):
+            state = extractor.feed(state,
+                                   '{{"id": {}}}, '.format(i).encode())
+        self.assertLess(len(state._buf), 20)  # Not the whole body
+        state = extractor.feed(state, b'{"id": 1000}]')
+        self.assertEqual(extractor.finish(state),
+                         [{'id': i} for i in range(1001)])
+
+    def test_read_head(self):
+        resp = BufferedResponse(503, b'{"error": "' + b'x' * 10000)
+        head = read_head(resp, 100)
+        self.assertEqual(len(head), 100)
+        self.assertEqual(read_head(resp, 100, streamed=True), head)
+
+        error = FailingStatusCode(503, head)
+        self.assertTrue(str(error).startswith('status code: 503'))
+
+
+class TestStreamingRequests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.base = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever,
+                         daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def get(self, path, extractor):
+        resp = requests.get(self.base + path, stream=True)
+        try:
+            return extractor(resp)
+        finally:
+            resp.close()
+
+    def test_aborts_early(self):
+        with self.assertRaises(AbortResponse):
+            self.get('/chunked',
+                     StreamingExtractor(reject_markers=[b'captcha']))
+
+        with self.assertRaises(ResponseTooLarge):
+            self.get('/chunked', StreamingExtractor(max_bytes=1 << 20))
+        self.assertLess(Handler.n_sent, BIG // 2)
+
+        with self.assertRaises(ResponseTooLarge):
+            self.get('/sized', StreamingExtractor(max_bytes=1 << 20))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from http_lassie import transport
+from http_lassie.direct_util import fetch_and_save
+from http_lassie.smart_fetcher import SmartFetcher
+from http_lassie.transport import *
+
+try:
+    from benchmarks.standins import H2Target, StandInConfig, h2
+except ImportError:  # pragma: no cover
+    h2 = None
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Mimic, the proxy it hands out, and the target.
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        body = b'ok'
+        if self.path == '/proxies/acquire':
+            body = json.dumps({'proxy': 'HTTP://127.0.0.1:{}'.format(
+                self.server.server_port), 'id': 1}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        Handler.proxy_auth = self.headers.get('Proxy-Authorization')
+        body = ('via proxy' if self.path.startswith('http://') else
+                'direct').encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(not http2_available(), "needs httpx[http2]")
+class TestHTTP2Session(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.base = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever,
+                         daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_falls_back_to_http1(self):
+        session = make_http2_session()
+        resp = session.request('GET', self.base + '/page', timeout=5)
+        self.assertEqual((resp.status_code, resp.content), (200, b'direct'))
+        self.assertEqual(resp.http_version, 'HTTP/1.1')
+        session.close()
+
+    def test_smart_fetcher_transport(self):
+        fetcher = SmartFetcher(self.base, None,
+                               transport=make_http2_session)
+        self.assertEqual(fetcher(self.base + '/page'),
+                         (b'via proxy', True))
+        fetcher.close()
+
+    def test_proxy_credentials_keep_their_case(self):
+        session = make_http2_session()
+        proxy = 'HTTP://User:PaSS@' + self.base[len('http://'):]
+        resp = session.request('GET', 'http://a.test/page', timeout=5,
+                               proxies={'http': proxy})
+        self.assertEqual(resp.content, b'via proxy')
+        self.assertEqual(Handler.proxy_auth, 'Basic {}'.format(
+            base64.b64encode(b'User:PaSS').decode()))
+        session.close()
+
+    def test_without_httpx(self):
+        httpx, transport.httpx = transport.httpx, None
+        try:
+            self.assertIsInstance(make_http2_session(), requests.Session)
+        finally:
+            transport.httpx = httpx
+
+
+@unittest.skipIf(not http2_available() or h2 is None, "needs httpx[http2]")
+class TestAsyncHTTP2Session(unittest.TestCase):
+    def test_multiplexed_downloads(self):
+        n_connections = []
+
+        def protocol():
+            n_connections.append(1)
+            return H2Target(StandInConfig(latency=0.01, body_size=100000))
+
+        async def run(directory):
+            loop = asyncio.get_running_loop()
+            server = await loop.create_server(protocol, '127.0.0.1', 0)
+            base = 'http://127.0.0.1:{}'.format(
+                server.sockets[0].getsockname()[1])
+            try:
+                async with AsyncHTTP2Session(prior_knowledge=True) as session:
+                    return await asyncio.gather(*[
+                        fetch_and_save(session, '{}/{}'.format(base, i),
+                                       os.path.join(directory, str(i)),
+                                       conditional=False)
+                        for i in range(20)])
+            finally:
+                server.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            results = asyncio.run(run(directory))
+            self.assertEqual([n for _, _, n in results], [100000] * 20)
+            self.assertEqual(os.path.getsize(os.path.join(directory, '7')),
+                             100000)
+        self.assertEqual(len(n_connections), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
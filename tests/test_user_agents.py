@@ -1,5 +1,8 @@
 from collections import Counter
+import sys
+import threading
 import unittest
+from http_lassie import user_agents
 from http_lassie.user_agents import *
 
 
@@ -18,6 +21,66 @@ class TestUserAgents(unittest.TestCase):
         self.assertLess(counts[POPULAR], 1000)
         self.assertGreater(counts[POPULAR], 500)
 
+    def test_random_user_agents(self):
+        agents = random_user_agents(10000)
+        self.assertEqual(len(agents), 10000)
+
+        counts = Counter(agents)
+        self.assertLess(counts[RARE], 64.0)
+        self.assertLess(counts[POPULAR], 1000)
+        self.assertGreater(counts[POPULAR], 500)
+
+    def test_star_import(self):
+        namespace = {}
+        exec('from http_lassie.user_agents import *', namespace)
+        self.assertEqual(namespace['USER_AGENTS'], user_agents.USER_AGENTS)
+        self.assertEqual(namespace['MAX_PROPORTION'],
+                         max(weight for weight, _ in USER_AGENTS))
+        self.assertIn('random_user_agents', namespace)
+
+    def test_alias_sampler(self):
+        sampler = AliasSampler([1, 0, 3])
+        counts = Counter(sampler.sample() for _ in range(4000))
+        self.assertEqual(counts[1], 0)
+        self.assertGreater(counts[2], 2 * counts[0])
+
+        counts = Counter(sampler.sample_many(4000, use_numpy=False))
+        self.assertEqual(counts[1], 0)
+        self.assertGreater(counts[2], 2 * counts[0])
+
+        self.assertRaises(ValueError, AliasSampler, [])
+        self.assertRaises(ValueError, AliasSampler, [0, 0])
+
+    @unittest.skipIf(numpy_or_none() is None, "needs numpy")
+    def test_alias_sampler_numpy(self):
+        counts = Counter(AliasSampler([1, 0, 3]).sample_many(4000))
+        self.assertEqual(counts[1], 0)
+        self.assertGreater(counts[2], 2 * counts[0])
+        self.assertTrue(all(type(i) is int for i in counts))
+
+    def test_concurrent_first_use(self):
+        state, user_agents._STATE = user_agents._STATE, None
+        errors = []
+
+        def draw():
+            try:
+                random_user_agent()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=draw) for _ in range(16)]
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+            user_agents._STATE = user_agents._STATE or state
+        self.assertEqual(errors, [])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,4 +1,9 @@
+import threading
+import time
 import unittest
+from six.moves.queue import Queue
+from http_lassie.backoff import DomainBackoff
+from http_lassie.metrics import Metrics
 from http_lassie.worker_pool import *
 
 
@@ -62,6 +67,120 @@ class TestWorkerPool(unittest.TestCase):
         self.assertEqual(len(expected), len(collected))
         self.assertEqual(expected, collected)
 
+    def test_retry_on_backoff(self):
+        attempts = []
+
+        def f(x, submit):
+            attempts.append(x)
+            if len(attempts) == 1:
+                raise DomainBackoff('a.com', 0.05)
+            return x
+
+        pool = WorkerPool(f, retry_on_backoff, n_workers=1)
+        pool.submit(1)
+        self.assertEqual(pool.deferred_stats()['n_deferred'], 0)
+        pool.start()
+        self.assertEqual(list(pool.gather()), [1])
+        self.assertEqual(attempts, [1, 1])
+
+    def test_metrics(self):
+        def f(x, submit):
+            if x == 3:
+                raise ValueError(x)
+            return x
+
+        metrics = Metrics()
+        pool = WorkerPool(f, ignore, n_workers=2, metrics=metrics)
+        for i in range(5):
+            pool.submit(i)
+        self.assertEqual(metrics.get('queue_depth'), 5)
+        pool.start()
+        self.assertEqual(sorted(pool.gather()), [0, 1, 2, 4])
+
+        self.assertEqual(metrics.get('tasks_total', outcome='ok'), 4)
+        self.assertEqual(metrics.get('tasks_total', outcome='error'), 1)
+        self.assertEqual(metrics.get('task_seconds').count, 5)
+        self.assertEqual(metrics.get('tasks_in_flight'), 0)
+        self.assertEqual(metrics.get('queue_depth'), 0)
+
+    def test_resize(self):
+        release = threading.Event()
+        active, lock = set(), threading.Lock()
+
+        def f(x, submit):
+            with lock:
+                active.add(threading.current_thread())
+            release.wait()
+            return x
+
+        pool = WorkerPool(f, n_workers=2)
+        pool.resize(3)
+        for i in range(20):
+            pool.submit(i)
+        pool.start()
+        pool.resize(6)
+        self.assertEqual(pool.n_workers, 6)
+        time.sleep(0.1)
+        self.assertEqual(len(active), 6)
+
+        pool.resize(1)
+        release.set()
+        self.assertEqual(sorted(pool.gather()), list(range(20)))
+        self.assertEqual(pool.stats()['living_threads'], 0)
+
+        with self.assertRaises(ValueError):
+            pool.resize(0)
+
+    def test_bounded_results(self):
+        pool = WorkerPool(lambda item, submit: bytes([item]) * 100,
+                          n_workers=4, max_results=2, spill_threshold=50)
+        for i in range(20):
+            pool.submit(i)
+        pool.start()
+        time.sleep(0.1)
+        self.assertLessEqual(pool.stats()['n_finished'], 2)  # The rest wait
+
+        results = sorted(bytes(result) for result in pool.gather())
+        self.assertEqual(results, [bytes([i]) * 100 for i in range(20)])
+
+    def test_gather_ends_when_the_last_item_fails(self):
+        def f(x, submit):
+            time.sleep(0.05)  # gather is already waiting
+            raise ValueError(x)
+
+        pool = WorkerPool(f, error_func=ignore, n_workers=1)
+        pool.submit(1)
+        pool.start()
+        gatherer = threading.Thread(target=lambda: list(pool.gather()))
+        gatherer.start()
+        gatherer.join(2)
+        self.assertFalse(gatherer.is_alive())
+
+    def test_deferred_items_with_a_bounded_queue(self):
+        def f(x, submit):
+            time.sleep(0.01)
+            return x
+
+        pool = WorkerPool(f, n_workers=1, work_queue=Queue(maxsize=1))
+        for i in range(5):
+            pool.submit(i, delay=0.01)
+        pool.start()
+        results = []
+        gatherer = threading.Thread(
+            target=lambda: results.extend(pool.gather()))
+        gatherer.start()
+        gatherer.join(5)
+        self.assertFalse(gatherer.is_alive())
+        self.assertEqual(sorted(results), list(range(5)))
+
+    def test_deferred_stats(self):
+        pool = WorkerPool(lambda x, submit: x, n_workers=1)
+        pool.submit(1, delay=60)
+        stats = pool.deferred_stats()
+        self.assertEqual(stats['n_deferred'], 1)
+        self.assertGreater(stats['next_due_in'], 50)
+        self.assertFalse(pool.is_done())
+
     def test_ignore(self):
         self.assertEqual(ignore(None, None, None), None)
 
@@ -82,5 +201,20 @@ class TestWorkerPool(unittest.TestCase):
         self.assertEqual(called, [1])
         pool.stop()
 
+    def test_failing_listener(self):
+        seen = []
+
+        def bad_listener(item, result, error, elapsed):
+            raise ValueError
+
+        pool = WorkerPool(lambda x, submit: x, n_workers=2)
+        pool.add_listener(bad_listener)
+        pool.add_listener(lambda item, *args: seen.append(item))
+        for i in range(5):
+            pool.submit(i)
+        pool.start()
+        self.assertEqual(sorted(pool.gather()), list(range(5)))
+        self.assertEqual(sorted(seen), list(range(5)))
+
 if __name__ == '__main__':
     unittest.main()